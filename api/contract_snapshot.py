@@ -0,0 +1,158 @@
+import datetime
+import threading
+from dataclasses import fields
+from typing import Optional
+
+from db.db_access import primary_key
+from model.models import SpreadsheetData
+from utils.utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# 索引を作る列(クエリのパラメータ名: SpreadsheetDataの属性名)
+INDEXED_FIELDS = {
+    "team": "team_name",
+    "league": "league",
+    "end_date": "end_date",
+    "roster_status": "roster_status",
+    "handle": "handle_name",
+}
+FIELD_NAMES = [field.name for field in fields(SpreadsheetData)]
+
+
+# 索引のキー(文字列は大文字・小文字を区別しない)
+def index_key(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+# 検索結果の並び順(チーム名、選手名の順)
+def document_order(document: dict) -> tuple[str, str]:
+    return (document["team_name"] or "", document["handle_name"] or "")
+
+
+class ContractSnapshot:
+    """契約データのメモリ上のスナップショット
+
+    INDEXED_FIELDSの列ごとに値→主キーの索引を持ち、条件に一致する契約をDBに問い合わせずに返す。
+    スクレイピングのたびに差分(更新/削除/追加)だけを反映する。
+    """
+
+    def __init__(self):
+        self._records: dict[tuple[str, str], SpreadsheetData] = {}
+        # JSONで返す辞書(レコードごとに作成しておく)
+        self._documents: dict[tuple[str, str], dict] = {}
+        # 列 → 索引のキー → 主キーの集合(順序を保つためdictを使う)
+        self._indexes: dict[str, dict[object, dict[tuple[str, str], None]]] = {
+            attribute: {} for attribute in INDEXED_FIELDS.values()
+        }
+        # 条件が1つ以下の検索の並べ替え済みの結果((列, 索引のキー)、条件なしはNone)
+        # 該当する契約が変わったときだけ作り直す
+        self._sorted_documents: dict[Optional[tuple[str, object]], list[dict]] = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.version = 0
+        self.updated_at: Optional[datetime.datetime] = None
+
+    def _add(self, data: SpreadsheetData):
+        key = primary_key(data)
+        self._records[key] = data
+        self._documents[key] = {name: getattr(data, name) for name in FIELD_NAMES}
+        self._sorted_documents.pop(None, None)
+        for attribute, index in self._indexes.items():
+            value = index_key(getattr(data, attribute))
+            index.setdefault(value, {})[key] = None
+            self._sorted_documents.pop((attribute, value), None)
+
+    def _remove(self, key: tuple[str, str]):
+        data = self._records.pop(key, None)
+        if data is None:
+            return
+        del self._documents[key]
+        self._sorted_documents.pop(None, None)
+        for attribute, index in self._indexes.items():
+            value = index_key(getattr(data, attribute))
+            self._sorted_documents.pop((attribute, value), None)
+            keys = index[value]
+            keys.pop(key, None)
+            if keys == {}:
+                del index[value]
+
+    def _touch(self):
+        self.version += 1
+        self.updated_at = datetime.datetime.now(datetime.timezone.utc)
+
+    # スナップショットをdata_listで置き換える(主キーが重複する場合は後のものを残す)
+    def load(self, data_list: list[SpreadsheetData]):
+        with self._lock:
+            self._records.clear()
+            self._documents.clear()
+            self._sorted_documents.clear()
+            for index in self._indexes.values():
+                index.clear()
+            for data in data_list:
+                self._remove(primary_key(data))
+                self._add(data)
+            self.loaded = True
+            self._touch()
+        logger.debug("Loaded {} contracts into the snapshot".format(len(data_list)))
+
+    # 差分(更新後/削除/追加)だけを反映する
+    def apply_diff(
+        self,
+        data_list_update: list[SpreadsheetData],
+        data_list_removed: list[SpreadsheetData],
+        data_list_added: list[SpreadsheetData],
+    ):
+        with self._lock:
+            for data in data_list_removed:
+                self._remove(primary_key(data))
+            for data in data_list_update + data_list_added:
+                self._remove(primary_key(data))
+                self._add(data)
+            self._touch()
+        logger.debug(
+            "Applied diff to the snapshot (update: {}, delete: {}, insert: {})".format(
+                len(data_list_update), len(data_list_removed), len(data_list_added)
+            )
+        )
+
+    # 条件(INDEXED_FIELDSのパラメータ名: 値)にすべて一致する契約の辞書のリストを返す
+    # 一番小さい索引から順に絞り込むので、テーブル全体は走査しない
+    def query(self, limit: int = None, **conditions) -> list[dict]:
+        with self._lock:
+            key_sets = []
+            for name, value in conditions.items():
+                attribute = INDEXED_FIELDS[name]
+                keys = self._indexes[attribute].get(index_key(value))
+                if keys is None:
+                    return []
+                key_sets.append((attribute, index_key(value), keys))
+            if len(key_sets) <= 1:
+                cache_key = key_sets[0][:2] if key_sets != [] else None
+                documents = self._sorted_documents.get(cache_key)
+                if documents is None:
+                    keys = key_sets[0][2] if key_sets != [] else self._documents
+                    documents = sorted(
+                        (self._documents[key] for key in keys), key=document_order
+                    )
+                    self._sorted_documents[cache_key] = documents
+                # キャッシュを変更されないようコピーを返す
+                return documents[:limit]
+            key_sets.sort(key=lambda key_set: len(key_set[2]))
+            documents = [
+                self._documents[key]
+                for key in key_sets[0][2]
+                if all(key in key_set[2] for key_set in key_sets[1:])
+            ]
+        documents.sort(key=document_order)
+        return documents[:limit]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "contracts": len(self._records),
+                "version": self.version,
+                "updated_at": (
+                    self.updated_at.isoformat() if self.updated_at is not None else None
+                ),
+            }
@@ -0,0 +1,85 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from api.contract_snapshot import INDEXED_FIELDS, ContractSnapshot
+from utils.utils import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class ContractReadApi:
+    """ContractSnapshotを読み取り専用のHTTP/JSONで公開する
+
+    GET /contracts?team=&league=&end_date=&roster_status=&handle=&limit=
+        条件にすべて一致する契約(条件は省略可、文字列は大文字・小文字を区別しない)
+    GET /health
+        スナップショットの件数・バージョン・更新時刻
+    スナップショットを読み込む前は503を返す。keep-aliveで接続を使い回せるようHTTP/1.1で応答する。
+    """
+
+    def __init__(self, snapshot: ContractSnapshot, host: str, port: int):
+        self.snapshot = snapshot
+        self._server = ThreadingHTTPServer((host, port), self._create_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    # パスとクエリから(ステータスコード, JSONにする値)を返す
+    def handle(self, path: str) -> tuple[int, object]:
+        url = urlparse(path)
+        if url.path == "/health":
+            return 200, self.snapshot.stats()
+        if url.path != "/contracts":
+            return 404, {"error": "not found"}
+        if not self.snapshot.loaded:
+            return 503, {"error": "snapshot is not loaded yet"}
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            limit = int(params.pop("limit")) if "limit" in params else None
+            if "end_date" in params:
+                params["end_date"] = int(params["end_date"])
+        except ValueError as err:
+            return 400, {"error": str(err)}
+        unknown = [name for name in params if name not in INDEXED_FIELDS]
+        if unknown != []:
+            return 400, {"error": "unknown parameter: {}".format(", ".join(unknown))}
+        contracts = self.snapshot.query(limit=limit, **params)
+        return 200, {"count": len(contracts), "contracts": contracts}
+
+    def _create_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # ヘッダーと本文を分けて送るので、Nagleアルゴリズムで応答が遅れないようにする
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                status, value = api.handle(self.path)
+                body = json.dumps(value, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.debug("Serving the read API on {}".format(self.url))
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,82 @@
+# diff_lists_from_data_listsのスケーリングを計測するベンチマーク
+# 使い方: python3 -m benchmark.bench_diff
+# 行数を10倍にしたときに処理時間もおおよそ10倍(1行あたりの時間が一定)であれば線形
+
+import logging
+import random
+import time
+
+from model.models import SpreadsheetData, League
+from db.db_access import diff_lists_from_data_lists
+
+ROW_COUNTS = [1_000, 10_000, 100_000]
+CHANGE_RATE = 0.05
+DUPLICATE_RATE = 0.01
+REPEAT = 3
+
+
+def create_data(index: int, end_date: int = 2026, team_name: str = None):
+    league = list(League)[index % len(League)].value
+    return SpreadsheetData(
+        league,
+        team_name or "TEAM{}".format(index % 500),
+        "HANDLE{}".format(index),
+        "PLAYER",
+        "FIRST{}".format(index),
+        "FAMILY{}".format(index),
+        end_date,
+        "RESIDENT",
+        "Active",
+        "T{}".format(index % 500),
+        "",
+    )
+
+
+# 旧データと、一部が更新/追加/削除/重複した新データを作成する
+def create_data_lists(row_count: int, seed: int = 0):
+    rand = random.Random(seed)
+    data_list_old = [create_data(i) for i in range(row_count)]
+    data_list_new = []
+    change_count = int(row_count * CHANGE_RATE)
+    for i in range(row_count):
+        r = rand.random()
+        if r < CHANGE_RATE:
+            # 削除
+            continue
+        elif r < CHANGE_RATE * 2:
+            # チーム移籍
+            data_list_new.append(create_data(i, team_name="NEWTEAM"))
+        else:
+            data_list_new.append(create_data(i))
+        if rand.random() < DUPLICATE_RATE:
+            # end_dateが短い重複行
+            data_list_new.append(create_data(i, end_date=2024, team_name="OLDTEAM"))
+    # 追加
+    data_list_new.extend(
+        create_data(row_count + i) for i in range(change_count)
+    )
+    rand.shuffle(data_list_new)
+    return data_list_new, data_list_old
+
+
+def main():
+    # 差分の行ごとのログ出力は計測対象外
+    logging.getLogger("db.db_access").setLevel(logging.WARNING)
+    print("{:>8} {:>12} {:>12}".format("rows", "seconds", "us/row"))
+    for row_count in ROW_COUNTS:
+        data_list_new, data_list_old = create_data_lists(row_count)
+        elapsed = []
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            diff_lists_from_data_lists(data_list_new, data_list_old)
+            elapsed.append(time.perf_counter() - start)
+        best = min(elapsed)
+        print(
+            "{:>8} {:>12.4f} {:>12.3f}".format(
+                row_count, best, best / row_count * 1_000_000
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# ローカルのスタブに対してDiscordへの送信時間を計測するベンチマーク
+# 使い方: python3 -m benchmark.bench_discord_dispatcher
+
+import logging
+import time
+
+from benchmark.stubs.discord_webhook_stub import DiscordWebhookStub
+from discord_utils.discord_dispatcher import DiscordWebhookDispatcher
+from discord_utils.discord_message_sender import DiscordMessageSender
+from model.webhook_structures import DiscordWebhookStructure, Embed
+
+MESSAGE_COUNTS = [3, 12]
+
+
+def create_message_list(webhook_url: str, count: int) -> list[DiscordMessageSender]:
+    return [
+        DiscordMessageSender(
+            webhook_url,
+            DiscordWebhookStructure(embeds=[Embed(title="message {}".format(i))]),
+        )
+        for i in range(count)
+    ]
+
+
+def main():
+    logging.getLogger("discord_utils.discord_dispatcher").setLevel(logging.WARNING)
+    print("{:>10} {:>10} {:>10} {:>10} {:>12}".format(
+        "messages", "errors", "delivered", "429s", "seconds"
+    ))
+    for server_error_rate in [0.0, 0.2]:
+        for count in MESSAGE_COUNTS:
+            stub = DiscordWebhookStub(server_error_rate=server_error_rate).start()
+            dispatcher = DiscordWebhookDispatcher()
+            dispatcher.BACKOFF_BASE = 0.05
+            start = time.perf_counter()
+            result_list = dispatcher.dispatch(create_message_list(stub.url, count))
+            elapsed = time.perf_counter() - start
+            stub.stop()
+            print("{:>10} {:>10} {:>10} {:>10} {:>12.3f}".format(
+                count,
+                server_error_rate,
+                sum(result.success for result in result_list),
+                stub.rate_limited_count,
+                elapsed,
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# Liquipediaの選手ページからのプロフィール抽出の処理時間を計測するベンチマーク
+# 使い方: python3 -m benchmark.bench_liquipedia_extractor
+
+import os
+import time
+
+from scraping.liquipedia_extractor import (
+    extract_profile,
+    extract_profile_with_beautifulsoup,
+)
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+FIXTURES = ["liquipedia_player.html", "liquipedia_player_minimal.html"]
+EXTRACTORS = {
+    "bs4": extract_profile_with_beautifulsoup,
+    "single-pass": extract_profile,
+}
+REPEAT = 20
+
+
+def load_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURE_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def main():
+    print("{:>32} {:>12} {:>12}".format("fixture", "extractor", "ms/page"))
+    for fixture in FIXTURES:
+        text = load_fixture(fixture)
+        profiles = {}
+        for name, extractor in EXTRACTORS.items():
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                profiles[name] = extractor(text)
+            elapsed = (time.perf_counter() - start) / REPEAT
+            print("{:>32} {:>12} {:>12.3f}".format(fixture, name, elapsed * 1000))
+        # どちらの実装でも同じプロフィールになることを確認
+        assert profiles["single-pass"] == profiles["bs4"], fixture
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# スプレッドシートの取得から通知の送信までを、外部のサービスを使わずに段階ごとに計測するベンチマーク
+# 使い方: python3 -m benchmark.bench_pipeline [--rows 500 5000] [--output result.json]
+# pubhtml・Liquipediaのページ・Discordのwebhookはローカルのスタブ、DBはメモリ上のSQLite(SQLiteStorage)を使う
+# 結果はJSONで出力するので、保存しておけば前回との比較で性能の劣化に気づける
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from urllib.parse import parse_qs, urlparse
+
+from benchmark.stubs.discord_webhook_stub import DiscordWebhookStub
+from benchmark.stubs.static_http_stub import StaticHttpStub
+from benchmark.synthetic import (
+    create_changed_rows,
+    create_pubhtml,
+    create_rows,
+    create_sheet_csvs,
+)
+from db.db_access import (
+    diff_lists_from_data_lists,
+    index_by_primary_key,
+    insert_data_to_db,
+    read_data_from_db,
+    write_diff_to_db,
+)
+from db.storage import SQLiteStorage
+from discord_utils.discord_dispatcher import DiscordWebhookDispatcher
+from discord_utils.discord_message_sender import pack_messages
+from message.message_creator import create_message_list
+from scraping.liquipedia import LiquipediaEnrichmentExecutor
+from scraping.spreadsheet import get_spreadsheet_data_list, parse_spreadsheet_html
+from utils.metrics import Metrics, get_metrics, set_metrics
+from utils.rate_limiter import TokenBucket
+
+FIXTURE_PATH = os.path.join(
+    os.path.dirname(__file__), "fixtures", "liquipedia_player.html"
+)
+TABLE_NAME = "VCTContractsTableBench"
+# 現在の登録数の1倍・10倍程度
+ROW_COUNTS = [500, 5_000]
+
+
+class StageTimer:
+    """段階ごとの処理時間と件数を記録する"""
+
+    def __init__(self):
+        self.stages: dict[str, dict] = {}
+
+    def measure(self, name: str, function, count=None):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        items = count(result) if count is not None else None
+        self.stages[name] = {"seconds": round(elapsed, 6), "items": items}
+        return result
+
+
+def run(row_count: int, args, spreadsheet_stub, liquipedia_stub, webhook_stub) -> dict:
+    rows_old = create_rows(
+        row_count,
+        duplicate_rate=args.duplicate_rate,
+        accent_rate=args.accent_rate,
+        seed=args.seed,
+    )
+    rows_new = create_changed_rows(
+        rows_old, row_count, change_rate=args.change_rate, seed=args.seed + 1
+    )
+    # スタブが返すpubhtmlとシートごとのCSVを今回の行数のものに差し替える
+    # (SPREADSHEET_BACKENDの設定に従ってどちらかを取得する)
+    pubhtml = create_pubhtml(rows_new).encode("utf-8")
+    sheet_csvs = {
+        gid: text.encode("utf-8") for gid, text in create_sheet_csvs(rows_new).items()
+    }
+
+    def respond(path: str):
+        url = urlparse(path)
+        if url.path.endswith("/pubhtml"):
+            return pubhtml
+        return sheet_csvs.get(parse_qs(url.query).get("gid", [None])[0])
+
+    spreadsheet_stub.respond = respond
+
+    # 変更前のデータをDBに書き込んでおく(計測対象外)
+    # DBには主キーが重複して書き込めないので、重複は取り除いておく
+    storage = SQLiteStorage(":memory:")
+    connection = storage.connect()
+    storage.ensure_schema(connection, TABLE_NAME, history=False)
+    data_list_initial = parse_spreadsheet_html(create_pubhtml(rows_old))
+    insert_data_to_db(
+        connection, TABLE_NAME, list(index_by_primary_key(data_list_initial).values())
+    )
+
+    timer = StageTimer()
+    # 各段階の内側の計測(DBの書き込みの種類ごと・webhookの送信ごとなど)も結果に含める
+    set_metrics(Metrics())
+    data_list_new = timer.measure(
+        "get_spreadsheet_data_list",
+        lambda: get_spreadsheet_data_list(spreadsheet_stub.url + "/pubhtml"),
+        len,
+    )
+    data_list_old = timer.measure(
+        "read_data_from_db",
+        lambda: read_data_from_db(connection, TABLE_NAME),
+        len,
+    )
+    (
+        data_list_update_old,
+        data_list_update_new,
+        data_list_added,
+        data_list_removed,
+    ) = timer.measure(
+        "diff_lists_from_data_lists",
+        lambda: diff_lists_from_data_lists(data_list_new, data_list_old),
+        lambda result: sum(len(data_list) for data_list in result[1:]),
+    )
+    timer.measure(
+        "write_diff_to_db",
+        lambda: write_diff_to_db(
+            connection,
+            TABLE_NAME,
+            data_list_update_new,
+            data_list_removed,
+            data_list_added,
+        ),
+        lambda _: len(data_list_update_new)
+        + len(data_list_removed)
+        + len(data_list_added),
+    )
+    # キャッシュを使わず、すべての選手のページをスタブから取得する
+    enrichment_executor = LiquipediaEnrichmentExecutor(
+        rate_limiter=TokenBucket(rate=1_000_000, capacity=1_000_000),
+        url_format=liquipedia_stub.url + "/valorant/{}",
+    )
+    message_list = timer.measure(
+        "create_message_list",
+        lambda: create_message_list(
+            data_list_update_old,
+            data_list_update_new,
+            data_list_added,
+            data_list_removed,
+            webhook_url=webhook_stub.url,
+            enrichment_executor=enrichment_executor,
+        ),
+        len,
+    )
+    dispatcher = DiscordWebhookDispatcher()
+    result_list = timer.measure(
+        "dispatch",
+        lambda: dispatcher.dispatch(pack_messages(message_list)),
+        len,
+    )
+    connection.close()
+    return {
+        "rows": row_count,
+        "pubhtml_bytes": len(pubhtml),
+        "stages": timer.stages,
+        "spans": get_metrics().summary(),
+        "total_seconds": round(
+            sum(stage["seconds"] for stage in timer.stages.values()), 6
+        ),
+        "counts": {
+            "update": len(data_list_update_new),
+            "added": len(data_list_added),
+            "removed": len(data_list_removed),
+            "messages": len(message_list),
+            "posts": len(result_list),
+            "failed_posts": sum(not result.success for result in result_list),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=ROW_COUNTS)
+    parser.add_argument("--change-rate", type=float, default=0.05)
+    parser.add_argument("--duplicate-rate", type=float, default=0.01)
+    parser.add_argument("--accent-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果のJSONの保存先(省略時は標準出力)")
+    args = parser.parse_args()
+
+    # 行ごとのログ出力は計測対象外
+    logging.disable(logging.INFO)
+    with open(FIXTURE_PATH, "rb") as f:
+        fixture = f.read()
+    spreadsheet_stub = StaticHttpStub(lambda path: None).start()
+    liquipedia_stub = StaticHttpStub(
+        lambda path: fixture if path.startswith("/valorant/") else None
+    ).start()
+    # レート制限で待たないよう、上限を十分に大きくする
+    webhook_stub = DiscordWebhookStub(limit=1_000_000).start()
+    try:
+        results = [
+            run(row_count, args, spreadsheet_stub, liquipedia_stub, webhook_stub)
+            for row_count in args.rows
+        ]
+    finally:
+        spreadsheet_stub.stop()
+        liquipedia_stub.stop()
+        webhook_stub.stop()
+
+    report = {
+        "benchmark": "pipeline",
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {
+            "change_rate": args.change_rate,
+            "duplicate_rate": args.duplicate_rate,
+            "accent_rate": args.accent_rate,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
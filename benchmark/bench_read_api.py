@@ -0,0 +1,177 @@
+# 読み取り用のAPI(ContractSnapshot/ContractReadApi)の負荷試験
+# 使い方: python3 -m benchmark.bench_read_api [--rows 5000] [--threads 8] [--requests 20000] [--output result.json]
+# スナップショットの検索時間(プロセス内)、HTTP経由の応答時間とスループット、差分の反映時間を計測する
+
+import argparse
+import http.client
+import json
+import logging
+import platform
+import statistics
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+from api.contract_snapshot import ContractSnapshot
+from api.read_api import ContractReadApi
+from benchmark.synthetic import create_changed_rows, create_rows
+from db.db_access import diff_lists_from_data_lists
+from model.models import SpreadsheetData
+
+# 検索の種類ごとのクエリ文字列(indexは選手・チームの番号)
+QUERIES = {
+    "team": lambda index: "team=TEAM{}".format(index % 500),
+    "handle": lambda index: "handle=handle{}".format(index),
+    "league_team": lambda index: "league=EMEA&team=TEAM{}".format(index % 500),
+    "end_date": lambda index: "end_date=2024",
+    "league_limit": lambda index: "league=PACIFIC&limit=50",
+}
+QUERY_REPEAT = 10_000
+
+
+def percentile(values: list[float], ratio: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+# プロセス内での1回の検索時間(マイクロ秒)
+def measure_queries(snapshot: ContractSnapshot, row_count: int) -> dict:
+    result = {}
+    for name, create_query in QUERIES.items():
+        conditions = [
+            dict(
+                (key, int(value) if key in ("end_date", "limit") else value)
+                for key, value in (
+                    item.split("=") for item in create_query(i % row_count).split("&")
+                )
+            )
+            for i in range(QUERY_REPEAT)
+        ]
+        start = time.perf_counter()
+        count = 0
+        for condition in conditions:
+            count += len(snapshot.query(**condition))
+        elapsed = time.perf_counter() - start
+        result[name] = {
+            "microseconds": round(elapsed / QUERY_REPEAT * 1_000_000, 3),
+            "average_results": round(count / QUERY_REPEAT, 1),
+        }
+    return result
+
+
+# threads本の接続(keep-alive)から合計requests回のリクエストを送り、応答時間を計測する
+def measure_http(url: str, row_count: int, threads: int, requests: int) -> dict:
+    host, port = urlparse(url).hostname, urlparse(url).port
+    latencies: list[float] = []
+    errors = 0
+    lock = threading.Lock()
+    query_list = list(QUERIES.values())
+
+    def worker(worker_index: int):
+        nonlocal errors
+        connection = http.client.HTTPConnection(host, port)
+        local_latencies = []
+        local_errors = 0
+        for i in range(worker_index, requests, threads):
+            path = "/contracts?" + query_list[i % len(query_list)](i % row_count)
+            start = time.perf_counter()
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+            local_latencies.append(time.perf_counter() - start)
+            if response.status != 200:
+                local_errors += 1
+        connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+            errors += local_errors
+
+    thread_list = [
+        threading.Thread(target=worker, args=(index,)) for index in range(threads)
+    ]
+    start = time.perf_counter()
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p90_ms": round(percentile(latencies, 0.9) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+    }
+
+
+# 全件の読み込みと差分の反映にかかる時間
+def measure_refresh(rows: list[list[str]], row_count: int) -> dict:
+    data_list_old = [SpreadsheetData(*row) for row in rows]
+    data_list_new = [
+        SpreadsheetData(*row) for row in create_changed_rows(rows, row_count)
+    ]
+    _, data_list_update, data_list_added, data_list_removed = (
+        diff_lists_from_data_lists(data_list_new, data_list_old)
+    )
+    snapshot = ContractSnapshot()
+    start = time.perf_counter()
+    snapshot.load(data_list_old)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    snapshot.apply_diff(data_list_update, data_list_removed, data_list_added)
+    apply_seconds = time.perf_counter() - start
+    return {
+        "load_seconds": round(load_seconds, 6),
+        "apply_diff_seconds": round(apply_seconds, 6),
+        "diff_rows": len(data_list_update)
+        + len(data_list_added)
+        + len(data_list_removed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5_000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--output", help="結果のJSONの保存先(省略時は標準出力)")
+    args = parser.parse_args()
+
+    # 行ごとのログ出力は計測対象外
+    logging.disable(logging.INFO)
+    rows = create_rows(args.rows)
+    snapshot = ContractSnapshot()
+    snapshot.load([SpreadsheetData(*row) for row in rows])
+    read_api = ContractReadApi(snapshot, "127.0.0.1", 0).start()
+    try:
+        http_result = measure_http(read_api.url, args.rows, args.threads, args.requests)
+    finally:
+        read_api.stop()
+
+    report = {
+        "benchmark": "read_api",
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": {
+            "rows": args.rows,
+            "threads": args.threads,
+            "requests": args.requests,
+        },
+        "query": measure_queries(snapshot, args.rows),
+        "http": http_result,
+        "refresh": measure_refresh(rows, args.rows),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
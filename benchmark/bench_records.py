@@ -0,0 +1,106 @@
+# SpreadsheetDataの作成時間とメモリ使用量を計測するベンチマーク
+# 使い方: python3 -m benchmark.bench_records
+# 比較のため、__dict__を持つdataclassと1文字ずつ連結する正規化(変更前の実装)も計測する
+
+import gc
+import time
+import tracemalloc
+import unicodedata
+from dataclasses import dataclass
+
+from benchmark.synthetic import create_rows
+from model.models import SpreadsheetData
+
+ROW_COUNTS = [10_000, 100_000]
+REPEAT = 7
+
+
+def legacy_normalize_unicode(words: str) -> str:
+    unicode_words = ""
+    for character in unicodedata.normalize("NFD", words):
+        if unicodedata.category(character) != "Mn":
+            unicode_words += character
+    return unicode_words
+
+
+@dataclass
+class LegacySpreadsheetData:
+    league: str
+    team_name: str
+    handle_name: str
+    role: str
+    first_name: str
+    family_name: str
+    end_date: int
+    resident: str
+    roster_status: str
+    team_tag: str
+    team_contact_info: str
+
+    def __post_init__(self):
+        self.first_name = legacy_normalize_unicode(self.first_name)
+        self.family_name = legacy_normalize_unicode(self.family_name)
+        self.end_date = int(self.end_date) if self.end_date != "" else 0
+
+
+RECORD_TYPES = {
+    "legacy": LegacySpreadsheetData,
+    "slots": SpreadsheetData,
+}
+
+
+# スプレッドシートのセルと同様に、行ごとに別の文字列オブジェクトを作る
+def copy_rows(rows: list[list[str]]) -> list[list[str]]:
+    return [["".join(list(value)) for value in row] for row in rows]
+
+
+def measure_time(record_type, rows) -> float:
+    elapsed = []
+    for _ in range(REPEAT):
+        cells = copy_rows(rows)
+        gc.collect()
+        start = time.perf_counter()
+        [record_type(*row) for row in cells]
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed)
+
+
+# 作成したレコードが保持しているメモリ(セルの文字列のうちレコードから参照されないものは除く)
+def measure_memory(record_type, rows) -> int:
+    cells = copy_rows(rows)
+    gc.collect()
+    tracemalloc.start()
+    records = [record_type(*row) for row in cells]
+    del cells
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return current
+
+
+def main():
+    print(
+        "{:>8} {:>8} {:>12} {:>12} {:>12}".format(
+            "rows", "type", "seconds", "MB", "bytes/row"
+        )
+    )
+    for row_count in ROW_COUNTS:
+        rows = create_rows(row_count)
+        for name, record_type in RECORD_TYPES.items():
+            # 計測時間とメモリは別々に計測する(tracemallocは処理時間に影響するため)
+            seconds = measure_time(record_type, rows)
+            memory = measure_memory(record_type, rows)
+            print(
+                "{:>8} {:>8} {:>12.4f} {:>12.2f} {:>12.0f}".format(
+                    len(rows), name, seconds, memory / 1024 / 1024, memory / len(rows)
+                )
+            )
+        # どちらの実装でも同じ値になることを確認
+        assert [SpreadsheetData(*row).values() for row in rows[:1000]] == [
+            list(vars(LegacySpreadsheetData(*row)).values()) for row in rows[:1000]
+        ]
+
+
+if __name__ == "__main__":
+    main()
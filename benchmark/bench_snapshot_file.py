@@ -0,0 +1,67 @@
+# 前回の取得結果をスナップショットファイルから読み込んで差分を計算する時間を計測するベンチマーク
+# 使い方: python3 -m benchmark.bench_snapshot_file
+# 比較のため、全件をSpreadsheetDataにしてから差分を計算する場合(テーブル全体を読み込む場合と同じ)も計測する
+
+import logging
+import os
+import tempfile
+import time
+
+from benchmark.bench_diff import create_data_lists
+from db.db_access import diff_lists_from_data_lists
+from db.snapshot_file import SnapshotReader, diff_lists_by_snapshot, write_snapshot
+from model.models import SpreadsheetData
+
+ROW_COUNTS = [1_000, 10_000, 100_000]
+REPEAT = 3
+
+
+def main():
+    # 差分の行ごとのログ出力は計測対象外
+    logging.disable(logging.INFO)
+    print(
+        "{:>8} {:>10} {:>12} {:>12} {:>12} {:>12}".format(
+            "rows", "MB", "write", "open", "diff", "full"
+        )
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "snapshot.bin")
+        for row_count in ROW_COUNTS:
+            data_list_new, data_list_old = create_data_lists(row_count)
+            start = time.perf_counter()
+            write_snapshot(path, data_list_old)
+            write_seconds = time.perf_counter() - start
+            # 全件を読み込む場合に相当するよう、DBの行と同じタプルから作成する
+            rows = [tuple(data.values()) for data in data_list_old]
+
+            open_list, diff_list, full_list = [], [], []
+            for _ in range(REPEAT):
+                start = time.perf_counter()
+                snapshot = SnapshotReader(path)
+                open_list.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                snapshot_result = diff_lists_by_snapshot(snapshot, data_list_new)
+                diff_list.append(time.perf_counter() - start)
+                snapshot.close()
+
+                start = time.perf_counter()
+                full_result = diff_lists_from_data_lists(
+                    data_list_new, [SpreadsheetData(*row) for row in rows]
+                )
+                full_list.append(time.perf_counter() - start)
+            # どちらの方法でも同じ差分になることを確認
+            assert snapshot_result == full_result
+            print(
+                "{:>8} {:>10.2f} {:>12.4f} {:>12.6f} {:>12.4f} {:>12.4f}".format(
+                    row_count,
+                    os.path.getsize(path) / 1024 / 1024,
+                    write_seconds,
+                    min(open_list),
+                    min(diff_list),
+                    min(full_list),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# スプレッドシートの取得方法(pubhtml/シートごとのCSV)ごとの処理時間と転送量を計測するベンチマーク
+# 使い方: python3 -m benchmark.bench_spreadsheet_ingestion
+# pubhtmlとCSVはローカルのスタブから返す
+# "csv"はシートのgidをpubhtmlのタブから探す場合(gidを保存していない初回の実行)で、pubhtmlの取得も含む
+# "csv-gids"はgidが分かっている場合(SPREADSHEET_SHEET_GIDSや保存したgidを使う2回目以降の実行)
+
+import logging
+import time
+from urllib.parse import parse_qs, urlparse
+
+from benchmark.stubs.static_http_stub import StaticHttpStub
+import conf.global_values as g
+import scraping.spreadsheet as spreadsheet
+from benchmark.synthetic import create_pubhtml, create_rows, create_sheet_csvs
+
+ROW_COUNTS = [1_000, 10_000]
+BACKENDS = ["html", "csv", "csv-gids"]
+REPEAT = 3
+
+
+def main():
+    logging.disable(logging.INFO)
+    responses = {}
+
+    def respond(path: str):
+        url = urlparse(path)
+        if url.path.endswith("/pubhtml"):
+            return responses["pubhtml"]
+        gid = parse_qs(url.query).get("gid", [None])[0]
+        return responses["csv"].get(gid)
+
+    stub = StaticHttpStub(respond).start()
+    url = stub.url + "/spreadsheets/d/e/stub/pubhtml#"
+    print(
+        "{:>8} {:>8} {:>12} {:>12}".format("rows", "backend", "seconds", "bytes(MB)")
+    )
+    try:
+        for row_count in ROW_COUNTS:
+            rows = create_rows(row_count)
+            responses["pubhtml"] = create_pubhtml(rows).encode("utf-8")
+            responses["csv"] = {
+                gid: text.encode("utf-8")
+                for gid, text in create_sheet_csvs(rows).items()
+            }
+            csv_size = sum(len(text) for text in responses["csv"].values())
+            sizes = {
+                "html": len(responses["pubhtml"]),
+                "csv": len(responses["pubhtml"]) + csv_size,
+                "csv-gids": csv_size,
+            }
+            results = {}
+            for backend in BACKENDS:
+                g.SPREADSHEET_SHEET_GIDS = (
+                    list(responses["csv"]) if backend == "csv-gids" else []
+                )
+                elapsed = []
+                for _ in range(REPEAT):
+                    # 毎回gidを探すよう、プロセス内のキャッシュを空にしてから計測する
+                    spreadsheet._sheet_gids_cache.clear()
+                    start = time.perf_counter()
+                    results[backend] = spreadsheet.get_spreadsheet_data_list(
+                        url, backend=backend.split("-")[0]
+                    )
+                    elapsed.append(time.perf_counter() - start)
+                print(
+                    "{:>8} {:>8} {:>12.4f} {:>12.2f}".format(
+                        row_count, backend, min(elapsed), sizes[backend] / 1024 / 1024
+                    )
+                )
+            # どちらの取得方法でも同じ結果になることを確認
+            assert results["csv"] == results["html"] == results["csv-gids"]
+    finally:
+        g.SPREADSHEET_SHEET_GIDS = []
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
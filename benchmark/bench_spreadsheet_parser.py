@@ -0,0 +1,47 @@
+# pubhtmlのパーサーごとの処理時間とピークメモリを計測するベンチマーク
+# 使い方: python3 -m benchmark.bench_spreadsheet_parser
+
+import time
+import tracemalloc
+
+from benchmark.synthetic import create_pubhtml, create_rows
+from scraping.spreadsheet import SPREADSHEET_PARSERS
+
+ROW_COUNTS = [1_000, 10_000]
+
+
+# tracemallocを有効にすると処理時間が大きく変わるので、時間とメモリは別々に計測する
+def measure(parser, text):
+    start = time.perf_counter()
+    data_list = parser.parse(text)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    parser.parse(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return data_list, elapsed, peak
+
+
+def main():
+    print(
+        "{:>8} {:>10} {:>8} {:>12} {:>12}".format(
+            "rows", "html(MB)", "parser", "seconds", "peak(MB)"
+        )
+    )
+    for row_count in ROW_COUNTS:
+        text = create_pubhtml(create_rows(row_count))
+        results = {}
+        for name, parser_class in SPREADSHEET_PARSERS.items():
+            data_list, elapsed, peak = measure(parser_class(), text)
+            results[name] = data_list
+            print(
+                "{:>8} {:>10.2f} {:>8} {:>12.4f} {:>12.2f}".format(
+                    row_count, len(text) / 1024 / 1024, name, elapsed, peak / 1024 / 1024
+                )
+            )
+        # どのパーサーでも同じ結果になることを確認
+        assert all(result == results["bs4"] for result in results.values())
+
+
+if __name__ == "__main__":
+    main()
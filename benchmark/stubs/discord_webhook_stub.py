@@ -0,0 +1,132 @@
+# DiscordのWebhookのレート制限の挙動を模倣するローカルのスタブサーバー
+# 使い方: python3 -m benchmark.stubs.discord_webhook_stub --port 8765
+# http://127.0.0.1:8765/api/webhooks/<id>/<token> にPOSTする
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class DiscordWebhookStub:
+    """webhookのURLごとにlimit回/reset_after秒のバケットを持ち、超えると429を返す
+
+    server_error_rateの割合で500を返す。受け取ったペイロードはreceivedに保存する
+    """
+
+    def __init__(
+        self,
+        limit: int = 5,
+        reset_after: float = 2.0,
+        server_error_rate: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: int = 0,
+    ):
+        self.limit = limit
+        self.reset_after = reset_after
+        self.server_error_rate = server_error_rate
+        self.received: list[dict] = []
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self._random = random.Random(seed)
+        self._buckets: dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._create_handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}/api/webhooks/0/stub".format(host, port)
+
+    def _create_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, headers, response = stub.handle(self.path, body)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle(self, path: str, body: bytes):
+        with self._lock:
+            self.request_count += 1
+            now = time.monotonic()
+            # [残り回数, リセット時刻]
+            bucket = self._buckets.setdefault(path, [self.limit, now + self.reset_after])
+            if now >= bucket[1]:
+                bucket[0] = self.limit
+                bucket[1] = now + self.reset_after
+            reset_after = max(0.0, bucket[1] - now)
+            if bucket[0] <= 0:
+                self.rate_limited_count += 1
+                headers = self._rate_limit_headers(0, reset_after)
+                headers["Content-Type"] = "application/json"
+                response = json.dumps(
+                    {
+                        "message": "You are being rate limited.",
+                        "retry_after": round(reset_after, 3),
+                        "global": False,
+                    }
+                ).encode()
+                return 429, headers, response
+            bucket[0] -= 1
+            headers = self._rate_limit_headers(bucket[0], reset_after)
+            if self._random.random() < self.server_error_rate:
+                return 500, headers, b""
+            self.received.append(json.loads(body))
+            return 204, headers, b""
+
+    def _rate_limit_headers(self, remaining: int, reset_after: float) -> dict:
+        return {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset-After": "{:.3f}".format(reset_after),
+            "X-RateLimit-Bucket": "stub",
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--reset-after", type=float, default=2.0)
+    parser.add_argument("--server-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    stub = DiscordWebhookStub(
+        limit=args.limit,
+        reset_after=args.reset_after,
+        server_error_rate=args.server_error_rate,
+        port=args.port,
+    )
+    print("Listening on {}".format(stub.url))
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# 固定の内容を返すローカルのHTTPサーバー
+# pubhtmlやLiquipediaの選手ページの代わりに使う
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+
+class StaticHttpStub:
+    """GETされたパスに対してrespond(path)が返す本文を返す(Noneの場合は404)
+
+    keep-aliveで接続を使い回せるようHTTP/1.1で応答する。
+    """
+
+    def __init__(
+        self,
+        respond: Callable[[str], Optional[bytes]],
+        content_type: str = "text/html; charset=utf-8",
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.respond = respond
+        self.content_type = content_type
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._create_handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def _create_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.request_count += 1
+                body = stub.respond(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", stub.content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
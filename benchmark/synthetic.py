@@ -0,0 +1,149 @@
+# ベンチマーク用の合成データを作成する
+import csv
+import html
+import io
+import random
+
+from model.models import League
+
+HEADER = [
+    "League",
+    "Team",
+    "Handle",
+    "Role",
+    "First Name",
+    "Family Name",
+    "End Date",
+    "Resident",
+    "Roster Status",
+    "Team Tag",
+    "Team Contact Info",
+]
+# normalize_unicodeで正規化が必要な名前
+ACCENTED_NAMES = ["José", "Adrián", "Björn", "Çağlar", "Ñuñez", "Zoë"]
+
+
+def create_row(index: int, end_date: int = 2026, team_name: str = None) -> list[str]:
+    league = list(League)[index % len(League)].value
+    return [
+        league,
+        team_name or "TEAM{}".format(index % 500),
+        "HANDLE{}".format(index),
+        "PLAYER",
+        "FIRST{}".format(index),
+        "FAMILY{}".format(index),
+        str(end_date),
+        "RESIDENT",
+        "Active",
+        "T{}".format(index % 500),
+        "",
+    ]
+
+
+# 行のリストを作成する
+# duplicate_rate: end_dateの短い重複行の割合, accent_rate: アクセント付きの名前の割合
+def create_rows(
+    row_count: int, duplicate_rate: float = 0.01, accent_rate: float = 0.05, seed: int = 0
+) -> list[list[str]]:
+    rand = random.Random(seed)
+    rows = []
+    for index in range(row_count):
+        row = create_row(index)
+        if rand.random() < accent_rate:
+            row[4] = "{}{}".format(rand.choice(ACCENTED_NAMES), index)
+        rows.append(row)
+        if rand.random() < duplicate_rate:
+            duplicate = list(row)
+            duplicate[1] = "OLDTEAM"
+            duplicate[6] = "2024"
+            rows.append(duplicate)
+    return rows
+
+
+# 行をシートごとに分ける(各シートの先頭はヘッダー行)
+def split_sheets(rows: list[list[str]], sheet_count: int) -> list[list[list[str]]]:
+    chunk_size = max(1, len(rows) // sheet_count + 1)
+    return [
+        [HEADER] + rows[sheet * chunk_size : (sheet + 1) * chunk_size]
+        for sheet in range(sheet_count)
+    ]
+
+
+# create_pubhtmlと同じ内容のシートごとのCSVを作成する(gidはシートの番号)
+def create_sheet_csvs(rows: list[list[str]], sheet_count: int = 4) -> dict[str, str]:
+    csvs = {}
+    for sheet, sheet_rows in enumerate(split_sheets(rows, sheet_count)):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\r\n").writerows(sheet_rows)
+        csvs[str(sheet)] = buffer.getvalue()
+    return csvs
+
+
+# Googleスプレッドシートのpubhtmlに似たHTMLを作成する
+# 行番号のth・セルごとのclass・シートのタブ・スタイルなど、パース対象外のマークアップも含める
+def create_pubhtml(rows: list[list[str]], sheet_count: int = 4) -> str:
+    parts = [
+        "<html><head><style>",
+        "".join(
+            ".ritz .waffle .s{0}{{background-color:#ffffff;text-align:left;}}".format(i)
+            for i in range(200)
+        ),
+        "</style></head><body><div id=\"sheet-menu\"><ul>",
+    ]
+    for sheet in range(sheet_count):
+        parts.append(
+            "<li id=\"sheet-button-{0}\"><a href=\"#\">Sheet{0}</a></li>".format(sheet)
+        )
+    parts.append("</ul></div><div id=\"sheets-viewport\">")
+    for sheet, sheet_rows in enumerate(split_sheets(rows, sheet_count)):
+        parts.append(
+            "<div id=\"{}\" style=\"display:none;position:relative;\" dir=\"ltr\">"
+            "<div class=\"ritz grid-container\" dir=\"ltr\">"
+            "<table class=\"waffle\" cellspacing=\"0\" cellpadding=\"0\"><thead><tr>"
+            "<th class=\"row-header freezebar-origin-ltr\"></th>".format(sheet)
+        )
+        for column in range(len(HEADER)):
+            parts.append(
+                "<th id=\"{0}C{1}\" style=\"width:100px;\" "
+                "class=\"column-headers-background\">{2}</th>".format(
+                    sheet, column, chr(ord("A") + column)
+                )
+            )
+        parts.append("</tr></thead><tbody>")
+        for index, row in enumerate(sheet_rows):
+            parts.append(
+                "<tr style=\"height: 20px\"><th id=\"{0}R{1}\" style=\"height: 20px;\" "
+                "class=\"row-headers-background\"><div class=\"row-header-wrapper\" "
+                "style=\"line-height: 20px\">{2}</div></th>".format(sheet, index, index + 1)
+            )
+            for column, value in enumerate(row):
+                parts.append(
+                    "<td class=\"s{}\" dir=\"ltr\">{}</td>".format(
+                        column, html.escape(value)
+                    )
+                )
+            parts.append("</tr>")
+        parts.append("</tbody></table></div></div>")
+    parts.append("</div></body></html>")
+    return "".join(parts)
+
+
+# rowsを元に、一部の行が削除・移籍・追加された新しい行のリストを作成する
+# change_rateの割合ずつ削除と移籍(チーム名の変更)を行い、同じ割合だけrow_count以降の番号の行を追加する
+def create_changed_rows(
+    rows: list[list[str]], row_count: int, change_rate: float = 0.05, seed: int = 1
+) -> list[list[str]]:
+    rand = random.Random(seed)
+    changed_rows = []
+    for row in rows:
+        r = rand.random()
+        if r < change_rate:
+            continue
+        elif r < change_rate * 2:
+            row = list(row)
+            row[1] = "NEWTEAM"
+        changed_rows.append(row)
+    changed_rows.extend(
+        create_row(row_count + index) for index in range(int(row_count * change_rate))
+    )
+    return changed_rows
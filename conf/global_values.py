@@ -3,9 +3,83 @@ TARGET_URL = (
     "https://docs.google.com/spreadsheets/d/e/2PACX-1vRmmWiBmMMD43m5VtZq"
     "54nKlmj0ZtythsA1qCpegwx-iRptx2HEsG0T3cQlG1r2AIiKxBWnaurJZQ9Q/pubhtml#"
 )
+# データの保存先("mysql": MySQLサーバー, "sqlite": SQLITE_PATHのSQLiteのファイル)
+STORAGE_BACKEND = "mysql"
+SQLITE_PATH = "vct_contracts.sqlite3"
 DB_NAME = "VCTContractsDB"
 TABLE_NAME = "VCTContractsTable"
 TABLE_NAME_TEST = "VCTContractsTableTest"
+# スプレッドシートの取得方法("csv": シートごとのCSVを並行して取得, "html": pubhtml)
+# CSVを取得できない場合はpubhtmlから取得する
+SPREADSHEET_BACKEND = "csv"
+# CSVで取得するシートのgid(空の場合はpubhtmlのタブから探す)と、同時に取得するシートの数
+SPREADSHEET_SHEET_GIDS = []
+SPREADSHEET_MAX_WORKERS = 4
+# pubhtmlから探したgidを取得結果と一緒に保存しておく秒数(過ぎたらシートの追加に備えて探し直す)
+SPREADSHEET_SHEET_GIDS_TTL = 86400
+# pubhtmlのパーサー("stream": 逐次パース, "bs4": BeautifulSoup)
+SPREADSHEET_PARSER = "stream"
+# 差分の計算方法
+# "fingerprint": 主キーとfingerprintだけを読み込んで比較
+# "staging": 一時テーブルを使ってDB側で比較(MySQLのみ)
+# "python": テーブル全体を読み込んで比較
+DIFF_MODE = "fingerprint"
+# 通知の送信待ちのメッセージを保存するテーブル
+OUTBOX_TABLE_NAME = "VCTNotificationOutbox"
+# 1回の読み込みで取得する件数・送信を諦めるまでの回数・送信中のまま放置された場合に再送するまでの秒数
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_CLAIM_TIMEOUT = 600
+# 1回だけ実行する場合に、スクレイピングに続けてアウトボックスを送信するかどうか
+# (スプレッドシートに変化がない場合も、送信待ちのメッセージが残っていれば送信する)
+# Falseの場合は送信を待たずに終了するので、--drainを別のスケジュールで実行する
+OUTBOX_DRAIN_INLINE = True
+# 送信待ちのメッセージが残っていることを示す目印のファイル(アウトボックスのテーブルごとに分ける)
+OUTBOX_PENDING_PATH_FORMAT = ".outbox_pending_{}"
+# --watchでの取得間隔(秒)
+# 変化があった直後は最小間隔で取得し、変化がなければbackoff_factor倍ずつ最大間隔まで延ばす
+WATCH_MIN_INTERVAL = 30
+WATCH_MAX_INTERVAL = 900
+WATCH_BACKOFF_FACTOR = 2.0
+# 移籍期間("MM-DD"の開始日と終了日、年をまたいでもよい)と、その期間中の最大間隔
+WATCH_TRANSFER_WINDOWS = [("10-01", "01-31")]
+WATCH_TRANSFER_WINDOW_INTERVAL = 60
+# 前回取得時のETag/Last-Modified/ダイジェストの保存先(テーブルごとに分ける)
+FETCH_STATE_PATH_FORMAT = ".fetch_state_{}.json"
+# --snapshotで前回の取得結果を保存するファイル(テーブルごとに分ける)
+SNAPSHOT_PATH_FORMAT = ".snapshot_{}.bin"
+# Liquipediaへのリクエスト数の上限(1秒あたり)とバースト、同時に取得するページ数
+# 利用規約の上限は2秒に1リクエストなので、並行して取得してもバーストは1にする
+# https://liquipedia.net/api-terms-of-use
+LIQUIPEDIA_REQUESTS_PER_SECOND = 0.5
+LIQUIPEDIA_BURST = 1
+LIQUIPEDIA_MAX_WORKERS = 4
+# Liquipediaの取得をまとめて待つ時間(秒)。間に合わなかった選手はプロフィールなしで通知する
+LIQUIPEDIA_ENRICHMENT_TIMEOUT = 60
+# Liquipediaのプロフィール情報のキャッシュの保存先・有効期間(秒)・最大件数
+LIQUIPEDIA_CACHE_PATH = ".liquipedia_cache.json"
+LIQUIPEDIA_CACHE_TTL = 7 * 24 * 60 * 60
+LIQUIPEDIA_CACHE_MAX_ENTRIES = 2000
+# ページがない(404など)選手を取得し直すまでの秒数(毎回取得してレート制限の枠を使わないようにする)
+LIQUIPEDIA_NEGATIVE_CACHE_TTL = 6 * 60 * 60
+# --watch --serveで公開する読み取り用のAPIのアドレス
+API_HOST = "127.0.0.1"
+API_PORT = 8080
+# --dry-runで実行されるはずのSQLとwebhookのペイロードの書き込み先
+DRY_RUN_SQL_PATH = "dry_run.sql"
+DRY_RUN_PAYLOAD_PATH = "dry_run_payloads.json"
+# 段階ごとの計測結果の書き込み先(Noneの場合は書き込まない。.promの場合はPrometheusのテキスト形式、それ以外はJSON)
+METRICS_PATH = None
+# --profileをつけた場合の段階ごとのcProfile/tracemallocのレポートの書き込み先と、表示する件数
+PROFILE_DIR = "profile"
+PROFILE_TOP_N = 20
+# HTTPクライアントのタイムアウト(秒)・接続プールの数(ホスト数)と1ホストあたりの接続数
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 10
+HTTP_POOL_CONNECTIONS = 8
+HTTP_POOL_MAXSIZE = 8
+# 名前解決で使うアドレスファミリー("ipv4", "ipv6", "any")
+HTTP_ADDRESS_FAMILY = "ipv4"
 # 以下のデフォルト値は環境変数で設定するため使われることはない
 HOST_NAME = "EXAMPLE_HOST_NAME"
 USER_NAME = "EXAMPLE_USER_NAME"
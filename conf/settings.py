@@ -10,10 +10,13 @@ def get_env_variable(var_name):
     return value
 
 
-def load_env():
+# use_dbがFalseの場合(--snapshotなどDBを使わない場合)はDBの接続情報を読み込まない
+def load_env(use_db: bool = True):
     load_dotenv()
-    g.HOST_NAME = get_env_variable("HOST_NAME")
-    g.USER_NAME = get_env_variable("USER_NAME")
-    g.PASSWORD = get_env_variable("PASSWORD")
+    # MySQLの接続情報はMySQLを使う場合だけ必要
+    if use_db and g.STORAGE_BACKEND == "mysql":
+        g.HOST_NAME = get_env_variable("HOST_NAME")
+        g.USER_NAME = get_env_variable("USER_NAME")
+        g.PASSWORD = get_env_variable("PASSWORD")
     g.WEBHOOK_URL = get_env_variable("WEBHOOK_URL")
     g.WEBHOOK_URL_TEST = get_env_variable("WEBHOOK_URL_TEST")
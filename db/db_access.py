@@ -1,16 +1,170 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+import datetime
 import mysql.connector
+import mysql.connector.pooling
 from model.models import SpreadsheetData
-import copy
-from utils.utils import setup_logger
+from utils.utils import normalize_unicode, setup_logger
+from utils.metrics import span
 
 logger = setup_logger(__name__)
 
+# 接続プールの大きさ(1プロセスで同時に使う接続の数)
+POOL_SIZE = 4
+# 1つのセッションで準備済みのまま保持するSQL文の最大数
+PREPARED_STATEMENT_CACHE_SIZE = 32
+# (ホスト名, ユーザー名)ごとの接続プール
+_connection_pools: dict[tuple[str, str], mysql.connector.pooling.MySQLConnectionPool] = {}
 
-def connect_to_mysql_server(host_name, user_name, user_password):
+
+class _ReusableCursor:
+    """セッションで使い回すカーソル
+
+    close()しても閉じずに、次の文でそのまま使う。
+    実際に閉じるのはセッションを閉じたとき。
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def close(self):
+        pass
+
+    def _close(self):
+        self._cursor.close()
+
+
+class _PreparedCursor:
+    """SQL文ごとにサーバー側で準備済みのカーソルを保持し、同じ文の2回目以降は準備を省く
+
+    executeしたカーソルを覚えておき、fetch系やrowcountはそのカーソルに委譲する。
+    close()しても閉じずに使い回す。
+    """
+
+    def __init__(self, connection, cache_size: int = PREPARED_STATEMENT_CACHE_SIZE):
+        self._connection = connection
+        self._cache_size = cache_size
+        self._cursors: OrderedDict[str, object] = OrderedDict()
+        self._last = None
+
+    def _cursor_for(self, operation: str):
+        cursor = self._cursors.get(operation)
+        if cursor is None:
+            cursor = self._connection.cursor(prepared=True)
+            self._cursors[operation] = cursor
+            # 古い文から閉じる
+            if len(self._cursors) > self._cache_size:
+                _, oldest = self._cursors.popitem(last=False)
+                oldest.close()
+        else:
+            self._cursors.move_to_end(operation)
+        self._last = cursor
+        return cursor
+
+    def execute(self, operation, params=()):
+        return self._cursor_for(operation).execute(operation, params)
+
+    def executemany(self, operation, seq_params):
+        return self._cursor_for(operation).executemany(operation, seq_params)
+
+    def __getattr__(self, name):
+        if self._last is None:
+            raise AttributeError(name)
+        return getattr(self._last, name)
+
+    def close(self):
+        pass
+
+    def _close(self):
+        for cursor in self._cursors.values():
+            cursor.close()
+        self._cursors.clear()
+        self._last = None
+
+
+class DBSession:
+    """接続プールから借りた接続と、使い回すカーソルをまとめたもの
+
+    接続と同じようにcursor()/commit()/rollback()を持つので、
+    このモジュールの関数にはconnectionの代わりにそのまま渡せる。
+    close()すると接続はプールに返される。
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = None
+        self._prepared_cursor = None
+
+    def cursor(self, prepared: bool = False):
+        if prepared:
+            if self._prepared_cursor is None:
+                self._prepared_cursor = _PreparedCursor(self.connection)
+            return self._prepared_cursor
+        if self._cursor is None:
+            # 結果を読み残しても次の文を実行できるようにバッファする
+            self._cursor = _ReusableCursor(self.connection.cursor(buffered=True))
+        return self._cursor
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def is_connected(self) -> bool:
+        return self.connection.is_connected()
+
+    @contextmanager
+    def transaction(self, prepared: bool = False):
+        with transaction(self, prepared=prepared) as cursor:
+            yield cursor
+
+    def close(self):
+        for cursor in (self._cursor, self._prepared_cursor):
+            if cursor is not None:
+                try:
+                    cursor._close()
+                except Exception as err:
+                    logger.warning("Failed closing cursor: '{}'".format(err))
+        self._cursor = None
+        self._prepared_cursor = None
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# (ホスト名, ユーザー名)ごとの接続プールを返す。初回だけ作成する
+def get_connection_pool(
+    host_name, user_name, user_password, pool_size: int = POOL_SIZE
+) -> mysql.connector.pooling.MySQLConnectionPool:
+    key = (host_name, user_name)
+    pool = _connection_pools.get(key)
+    if pool is None:
+        pool = mysql.connector.pooling.MySQLConnectionPool(
+            pool_name="vct_pool_{}".format(len(_connection_pools)),
+            pool_size=pool_size,
+            host=host_name,
+            user=user_name,
+            passwd=user_password,
+        )
+        _connection_pools[key] = pool
+    return pool
+
+
+# 接続プールから接続を借り、セッションとして返す
+def connect_to_mysql_server(host_name, user_name, user_password) -> DBSession:
     connection = None
     try:
-        connection = mysql.connector.connect(
-            host=host_name, user=user_name, passwd=user_password
+        connection = DBSession(
+            get_connection_pool(host_name, user_name, user_password).get_connection()
         )
         logger.debug("MySQL Database connection successful")
     except Exception as err:
@@ -18,6 +172,34 @@ def connect_to_mysql_server(host_name, user_name, user_password):
     return connection
 
 
+# with文で使うセッション。databaseを指定した場合は選択してから返す
+@contextmanager
+def open_session(host_name, user_name, user_password, database: str = None):
+    session = connect_to_mysql_server(host_name, user_name, user_password)
+    if session is None:
+        exit(1)
+    try:
+        if database is not None:
+            execute_query(session, "USE {}".format(database))
+        yield session
+    finally:
+        session.close()
+
+
+# カーソルを渡し、ブロックを抜けたらコミットする。例外が発生した場合はロールバックする
+@contextmanager
+def transaction(connection, prepared: bool = False):
+    cursor = connection.cursor(prepared=prepared)
+    try:
+        yield cursor
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
 def create_or_check_database(connection, db_name):
     query = "CREATE DATABASE IF NOT EXISTS {} DEFAULT CHARACTER SET 'utf8'".format(
         db_name
@@ -44,6 +226,7 @@ def create_or_check_table(connection, table_name):
         roster_status VARCHAR(50),
         team_tag VARCHAR(50),
         team_contact_info VARCHAR(50),
+        fingerprint CHAR(40),
         PRIMARY KEY (first_name, family_name)
     )
     """.format(
@@ -55,6 +238,168 @@ def create_or_check_table(connection, table_name):
         success_message="Create table or already exists",
         error_message="Failed creating table",
     )
+    create_or_check_fingerprint_column(connection, table_name)
+
+
+# fingerprint列があるかどうか(user-012より前に作成されたテーブルにはない)
+# コミットはしないので、読み取り専用のトランザクション内でも使える
+def fingerprint_column_exists(connection, table_name) -> bool:
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            """SELECT COUNT(*) FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+                AND COLUMN_NAME = 'fingerprint'""",
+            (table_name,),
+        )
+        return cursor.fetchone()[0] > 0
+    finally:
+        cursor.close()
+
+
+# fingerprintが未計算のレコードがあるかどうか
+def has_null_fingerprints(connection, table_name) -> bool:
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            "SELECT 1 FROM `{}` WHERE `fingerprint` IS NULL LIMIT 1".format(table_name)
+        )
+        return cursor.fetchone() is not None
+    finally:
+        cursor.close()
+
+
+# fingerprint列がない(以前に作成された)テーブルに列を追加し、既存のレコードの値を計算する
+def create_or_check_fingerprint_column(connection, table_name):
+    exists = fingerprint_column_exists(connection, table_name)
+    connection.commit()
+    if exists:
+        return
+    execute_query(
+        connection,
+        "ALTER TABLE `{}` ADD COLUMN `fingerprint` CHAR(40)".format(table_name),
+        success_message="Add fingerprint column",
+        error_message="Failed adding fingerprint column",
+    )
+    backfill_fingerprints(connection, table_name)
+
+
+# fingerprintが未計算のレコードの値を計算して書き込む
+def backfill_fingerprints(connection, table_name):
+    try:
+        with transaction(connection) as cursor:
+            cursor.execute(
+                "SELECT {} FROM `{}` WHERE `fingerprint` IS NULL".format(
+                    COLUMNS, table_name
+                )
+            )
+            data_list = [SpreadsheetData(*row) for row in cursor.fetchall()]
+        if data_list != []:
+            # 1行ずつのUPDATEなので、準備済みの文を使い回す
+            with transaction(connection, prepared=True) as cursor:
+                cursor.executemany(
+                    FINGERPRINT_UPDATE_QUERY_FORMAT.format(table_name),
+                    [(data.fingerprint(), *primary_key(data)) for data in data_list],
+                )
+        logger.debug("Success backfilling {} fingerprints".format(len(data_list)))
+    except Exception as err:
+        logger.error("Failed backfilling fingerprints: '{}'".format(err))
+        exit(1)
+
+
+# 通知の送信待ちのメッセージを保存するテーブル(アウトボックス)
+# 差分の書き込みと同じトランザクションで書き込み、送信は別に行う
+def create_or_check_outbox_table(connection, table_name):
+    query = """
+    CREATE TABLE IF NOT EXISTS {} (
+        id BIGINT NOT NULL AUTO_INCREMENT,
+        webhook_url VARCHAR(255) NOT NULL,
+        payload MEDIUMTEXT NOT NULL,
+        status VARCHAR(16) NOT NULL DEFAULT 'pending',
+        attempts INT NOT NULL DEFAULT 0,
+        last_error VARCHAR(255),
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        claimed_at DATETIME,
+        sent_at DATETIME,
+        PRIMARY KEY (id),
+        INDEX status_index (status, id)
+    )
+    """.format(
+        table_name
+    )
+    execute_query(
+        connection,
+        query,
+        success_message="Create outbox table or already exists",
+        error_message="Failed creating outbox table",
+    )
+
+
+# 契約の変更履歴を保存するテーブル(追記のみ)
+# 変更ごとに変更後の値を1行追加し、valid_from〜valid_to(NULLは現在も有効)の間有効とする
+# change_typeは"initial"(作成時の既存のレコード)・"added"・"updated"・"removed"
+# 削除はvalid_fromとvalid_toが同じ時刻の行として記録する
+# 期間での検索はvalid_from、選手ごとの検索はhandle_nameと主キーの索引を使う
+def create_or_check_history_table(connection, table_name):
+    history_table_name = HISTORY_TABLE_FORMAT.format(table_name)
+    query = """
+    CREATE TABLE IF NOT EXISTS {} (
+        id BIGINT NOT NULL AUTO_INCREMENT,
+        league VARCHAR(50),
+        team_name VARCHAR(50),
+        handle_name VARCHAR(50),
+        role VARCHAR(50),
+        first_name VARCHAR(50) NOT NULL,
+        family_name VARCHAR(50) NOT NULL,
+        end_date INT(4) NOT NULL,
+        resident VARCHAR(50),
+        roster_status VARCHAR(50),
+        team_tag VARCHAR(50),
+        team_contact_info VARCHAR(50),
+        change_type VARCHAR(16) NOT NULL,
+        valid_from DATETIME(6) NOT NULL,
+        valid_to DATETIME(6),
+        PRIMARY KEY (id),
+        INDEX valid_from_index (valid_from),
+        INDEX handle_index (handle_name, valid_from),
+        INDEX key_index (first_name, family_name, valid_to)
+    )
+    """.format(
+        history_table_name
+    )
+    execute_query(
+        connection,
+        query,
+        success_message="Create history table or already exists",
+        error_message="Failed creating history table",
+    )
+    seed_history(connection, table_name)
+
+
+# 履歴が空の場合は、現在のレコードを"initial"の行として書き込む
+def seed_history(connection, table_name):
+    history_table_name = HISTORY_TABLE_FORMAT.format(table_name)
+    try:
+        with transaction(connection) as cursor:
+            cursor.execute("SELECT EXISTS(SELECT 1 FROM `{}`)".format(history_table_name))
+            if cursor.fetchone()[0]:
+                return
+            cursor.execute(
+                """INSERT INTO `{0}`({1}, `change_type`, `valid_from`)
+                SELECT {1}, 'initial', %s FROM `{2}`""".format(
+                    history_table_name, COLUMNS, table_name
+                ),
+                (utc_now(),),
+            )
+        logger.debug("Success seeding history")
+    except Exception as err:
+        logger.error("Failed seeding history: '{}'".format(err))
+        exit(1)
+
+
+# 履歴に記録する時刻(UTC)
+def utc_now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
 
 
 def execute_query(
@@ -69,21 +414,76 @@ def execute_query(
     except Exception as err:
         logger.error("{}: '{}'".format(error_message, err))
         exit(1)
+    finally:
+        cursor.close()
+
+
+# テーブルの列(SpreadsheetData.values()の順)
+COLUMN_NAMES = [
+    "league",
+    "team_name",
+    "handle_name",
+    "role",
+    "first_name",
+    "family_name",
+    "end_date",
+    "resident",
+    "roster_status",
+    "team_tag",
+    "team_contact_info",
+]
+COLUMNS = ", ".join("`{}`".format(column) for column in COLUMN_NAMES)
+# DB側で差分を計算する際の一時テーブル
+STAGING_TABLE_FORMAT = "{}_staging"
+# 各列の値に加えてfingerprintを書き込む(値はrow_values()の順)
+INSERT_QUERY_FORMAT = """ INSERT INTO `{}`(
+    `league`, `team_name`, `handle_name`,`role`,`first_name`,`family_name`,
+    `end_date`,`resident`,`roster_status`,`team_tag`,`team_contact_info`,
+    `fingerprint`)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+# 主キーが一致するレコードの主キー以外の列を更新する
+UPSERT_QUERY_FORMAT = INSERT_QUERY_FORMAT + """ ON DUPLICATE KEY UPDATE
+    `league` = VALUES(`league`), `team_name` = VALUES(`team_name`),
+    `handle_name` = VALUES(`handle_name`), `role` = VALUES(`role`),
+    `end_date` = VALUES(`end_date`), `resident` = VALUES(`resident`),
+    `roster_status` = VALUES(`roster_status`), `team_tag` = VALUES(`team_tag`),
+    `team_contact_info` = VALUES(`team_contact_info`),
+    `fingerprint` = VALUES(`fingerprint`)
+"""
+OUTBOX_INSERT_QUERY_FORMAT = (
+    "INSERT INTO `{}`(`webhook_url`, `payload`) VALUES (%s, %s)"
+)
+# 1行ずつ実行する固定の形の文(準備済みの文として使い回す)
+FINGERPRINT_UPDATE_QUERY_FORMAT = """UPDATE `{}` SET `fingerprint` = %s
+    WHERE `first_name` = %s AND `family_name` = %s"""
+DELETE_QUERY_FORMAT = "DELETE FROM `{}` WHERE (`first_name`, `family_name`) IN ({})"
+# 1回のDELETEで指定する主キーの最大数
+DELETE_CHUNK_SIZE = 1000
+# 変更履歴のテーブル
+HISTORY_TABLE_FORMAT = "{}_history"
+HISTORY_COLUMNS = COLUMNS + ", `change_type`, `valid_from`, `valid_to`"
+HISTORY_INSERT_QUERY_FORMAT = (
+    "INSERT INTO `{}`(" + HISTORY_COLUMNS + ") VALUES ("
+    + ", ".join(["%s"] * (len(COLUMN_NAMES) + 3))
+    + ")"
+)
+# 主キーが一致する現在有効な行を終了させる
+HISTORY_CLOSE_QUERY_FORMAT = """UPDATE `{}` SET `valid_to` = %s
+    WHERE `first_name` = %s AND `family_name` = %s AND `valid_to` IS NULL"""
+
+
+# INSERT_QUERY_FORMATに渡す値
+def row_values(data: SpreadsheetData) -> list:
+    return data.values() + [data.fingerprint()]
 
 
 def insert_data_to_db(connection, table_name, data_list):
-    cursor = connection.cursor()
-    query = """ INSERT INTO `{}`(
-        `league`, `team_name`, `handle_name`,`role`,`first_name`,`family_name`,
-        `end_date`,`resident`,`roster_status`,`team_tag`,`team_contact_info`)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """.format(
-        table_name
-    )
+    query = INSERT_QUERY_FORMAT.format(table_name)
     try:
-        # insert用に最適化されたexecutemanyメソッドを使用
-        cursor.executemany(query, [data.values() for data in data_list])
-        connection.commit()
+        with transaction(connection) as cursor:
+            # insert用に最適化されたexecutemanyメソッドを使用
+            cursor.executemany(query, [row_values(data) for data in data_list])
         if data_list != []:
             logger.debug("Success writing table")
     except Exception as err:
@@ -91,10 +491,292 @@ def insert_data_to_db(connection, table_name, data_list):
         exit(1)
 
 
+@dataclass
+class DiffStatement:
+    """差分の書き込みで実行する1つの文"""
+
+    # 計測の名前(db_write_update/delete/insert/outbox)
+    kind: str
+    query: str
+    # manyがTrueの場合は行ごとの値のリスト(executemany)、Falseの場合は1文の値
+    params: list
+    many: bool
+    rows: int
+
+
+# 差分(更新/削除/追加)とアウトボックスへの書き込みで実行する文のリストを作成する
+# 更新は複数行のINSERT ... ON DUPLICATE KEY UPDATE、削除は複数行のDELETE ... IN (...)で行う
+def create_diff_statements(
+    table_name,
+    data_list_update: list[SpreadsheetData],
+    data_list_removed: list[SpreadsheetData],
+    data_list_added: list[SpreadsheetData],
+    outbox_table_name: str = None,
+    outbox_list: list[tuple[str, str]] = None,
+    history_table_name: str = None,
+    changed_at: datetime.datetime = None,
+) -> list[DiffStatement]:
+    statements = []
+    if data_list_update != []:
+        statements.append(
+            DiffStatement(
+                "db_write_update",
+                UPSERT_QUERY_FORMAT.format(table_name),
+                [row_values(data) for data in data_list_update],
+                True,
+                len(data_list_update),
+            )
+        )
+    for i in range(0, len(data_list_removed), DELETE_CHUNK_SIZE):
+        chunk = data_list_removed[i : i + DELETE_CHUNK_SIZE]
+        statements.append(
+            DiffStatement(
+                "db_write_delete",
+                DELETE_QUERY_FORMAT.format(
+                    table_name, ", ".join(["(%s, %s)"] * len(chunk))
+                ),
+                [value for data in chunk for value in primary_key(data)],
+                False,
+                len(chunk),
+            )
+        )
+    if data_list_added != []:
+        statements.append(
+            DiffStatement(
+                "db_write_insert",
+                INSERT_QUERY_FORMAT.format(table_name),
+                [row_values(data) for data in data_list_added],
+                True,
+                len(data_list_added),
+            )
+        )
+    if history_table_name is not None:
+        statements += create_history_statements(
+            history_table_name,
+            data_list_update,
+            data_list_removed,
+            data_list_added,
+            changed_at if changed_at is not None else utc_now(),
+        )
+    if outbox_list:
+        statements.append(
+            DiffStatement(
+                "db_write_outbox",
+                OUTBOX_INSERT_QUERY_FORMAT.format(outbox_table_name),
+                [list(outbox) for outbox in outbox_list],
+                True,
+                len(outbox_list),
+            )
+        )
+    return statements
+
+
+# 差分を変更履歴に書き込む文のリストを作成する
+# 更新・削除されたレコードの現在の行を終了させてから、変更後の行を追加する
+def create_history_statements(
+    history_table_name,
+    data_list_update: list[SpreadsheetData],
+    data_list_removed: list[SpreadsheetData],
+    data_list_added: list[SpreadsheetData],
+    changed_at: datetime.datetime,
+) -> list[DiffStatement]:
+    closed_list = data_list_update + data_list_removed
+    history_rows = (
+        [data.values() + ["updated", changed_at, None] for data in data_list_update]
+        + [
+            data.values() + ["removed", changed_at, changed_at]
+            for data in data_list_removed
+        ]
+        + [data.values() + ["added", changed_at, None] for data in data_list_added]
+    )
+    statements = []
+    if closed_list != []:
+        statements.append(
+            DiffStatement(
+                "db_write_history",
+                HISTORY_CLOSE_QUERY_FORMAT.format(history_table_name),
+                [[changed_at, *primary_key(data)] for data in closed_list],
+                True,
+                len(closed_list),
+            )
+        )
+    if history_rows != []:
+        statements.append(
+            DiffStatement(
+                "db_write_history",
+                HISTORY_INSERT_QUERY_FORMAT.format(history_table_name),
+                history_rows,
+                True,
+                len(history_rows),
+            )
+        )
+    return statements
+
+
+# 差分(更新/削除/追加)を1つのトランザクションでまとめて書き込む
+# コミットは最後に1回だけ行う。途中で失敗した場合はロールバックするのでDBは元の状態のまま
+# outbox_listを渡した場合は(webhook_url, payload)を同じトランザクションでアウトボックスに書き込む
+# history_table_nameを渡した場合は同じトランザクションで変更履歴も書き込む
+def write_diff_to_db(
+    connection,
+    table_name,
+    data_list_update: list[SpreadsheetData],
+    data_list_removed: list[SpreadsheetData],
+    data_list_added: list[SpreadsheetData],
+    outbox_table_name: str = None,
+    outbox_list: list[tuple[str, str]] = None,
+    history_table_name: str = None,
+):
+    statements = create_diff_statements(
+        table_name,
+        data_list_update,
+        data_list_removed,
+        data_list_added,
+        outbox_table_name=outbox_table_name,
+        outbox_list=outbox_list,
+        history_table_name=history_table_name,
+    )
+    try:
+        # INSERTのexecutemanyは複数行の1文にまとめられるので、準備済みの文は使わない
+        with transaction(connection) as cursor:
+            for statement in statements:
+                with span(statement.kind, rows=statement.rows):
+                    if statement.many:
+                        cursor.executemany(statement.query, statement.params)
+                    else:
+                        cursor.execute(statement.query, statement.params)
+        logger.debug(
+            "Success writing diff (update: {}, delete: {}, insert: {})".format(
+                len(data_list_update), len(data_list_removed), len(data_list_added)
+            )
+        )
+    except Exception as err:
+        logger.error("Failed writing diff: '{}'".format(err))
+        exit(1)
+
+
+# SQLの値のリテラル(ログやドライランでの表示用。実行には使わない)
+def sql_literal(value) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, float)):
+        return str(value)
+    escaped = (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("'", "\\'")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+        .replace("\0", "\\0")
+    )
+    return "'{}'".format(escaped)
+
+
+# 文を値を埋め込んだSQLにする(executemanyの文は行ごとに1文にする)
+# translate/literalを渡すと、文の書き換えと値のリテラルをそれに置き換える(MySQL以外のDB向け)
+def render_statements(
+    statements: list[DiffStatement], translate=None, literal=sql_literal
+) -> list[str]:
+    sql_list = []
+    for statement in statements:
+        query = statement.query if translate is None else translate(statement.query)
+        # 値の中の空白は変えないよう、値を埋め込む前に文の空白を詰める
+        query = " ".join(query.split())
+        params_list = statement.params if statement.many else [statement.params]
+        for params in params_list:
+            sql_list.append(query % tuple(literal(value) for value in params) + ";")
+    return sql_list
+
+
+# 読み取り専用のトランザクション。ブロックを抜けると必ずロールバックする
+@contextmanager
+def read_only_transaction(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("START TRANSACTION READ ONLY")
+    finally:
+        cursor.close()
+    try:
+        yield connection
+    finally:
+        connection.rollback()
+
+
+# after_idより後の送信待ちのメッセージを古い順に読み込む
+# 送信中のまま一定時間が経ったもの(送信中にプロセスが終了した場合など)も送信待ちとして扱う
+def read_pending_outbox(
+    connection, table_name, after_id: int, limit: int, claim_timeout: int
+):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(
+            """SELECT `id`, `webhook_url`, `payload` FROM `{}`
+            WHERE `id` > %s AND (`status` = 'pending' OR (`status` = 'sending'
+                AND `claimed_at` < NOW() - INTERVAL %s SECOND))
+            ORDER BY `id` LIMIT %s""".format(table_name),
+            (after_id, claim_timeout, limit),
+        )
+        outbox_list = cursor.fetchall()
+        connection.commit()
+        return outbox_list
+    except Exception as err:
+        logger.error("Failed reading outbox: '{}'".format(err))
+        exit(1)
+    finally:
+        cursor.close()
+
+
+# 送信するメッセージを確保する。他のプロセスがすでに確保していた場合はFalse
+def claim_outbox(connection, table_name, outbox_id: int, claim_timeout: int) -> bool:
+    # メッセージごとに実行するので、準備済みの文を使い回す
+    cursor = connection.cursor(prepared=True)
+    try:
+        cursor.execute(
+            """UPDATE `{}` SET `status` = 'sending', `claimed_at` = NOW(),
+                `attempts` = `attempts` + 1
+            WHERE `id` = %s AND (`status` = 'pending' OR (`status` = 'sending'
+                AND `claimed_at` < NOW() - INTERVAL %s SECOND))""".format(table_name),
+            (outbox_id, claim_timeout),
+        )
+        connection.commit()
+        return cursor.rowcount == 1
+    finally:
+        cursor.close()
+
+
+# 送信結果を書き込む。失敗した場合はmax_attemptsに達するまで送信待ちに戻す
+def finish_outbox(
+    connection,
+    table_name,
+    outbox_id: int,
+    success: bool,
+    error: str = None,
+    max_attempts: int = None,
+):
+    cursor = connection.cursor(prepared=True)
+    try:
+        if success:
+            cursor.execute(
+                """UPDATE `{}` SET `status` = 'sent', `sent_at` = NOW(),
+                    `last_error` = NULL WHERE `id` = %s""".format(table_name),
+                (outbox_id,),
+            )
+        else:
+            cursor.execute(
+                """UPDATE `{}` SET `last_error` = %s, `status` =
+                    IF(`attempts` >= %s, 'failed', 'pending')
+                WHERE `id` = %s""".format(table_name),
+                ((error or "")[:255], max_attempts, outbox_id),
+            )
+        connection.commit()
+    finally:
+        cursor.close()
+
+
 # DBのテーブルのデータを読み込む
 def read_data_from_db(connection, table_name):
     cursor = connection.cursor()
-    query = "SELECT * FROM {}".format(table_name)
+    query = "SELECT {} FROM {}".format(COLUMNS, table_name)
     try:
         cursor.execute(query)
         data_list_from_db = [SpreadsheetData(*row) for row in cursor.fetchall()]
@@ -103,46 +785,23 @@ def read_data_from_db(connection, table_name):
     except Exception as err:
         logger.error("Failed reading table: '{}'".format(err))
         exit(1)
+    finally:
+        cursor.close()
 
 
-# すでに存在するレコードを更新する
-def update_data_to_db(connection, table_name, data_list: list[SpreadsheetData]):
-    for data in data_list:
-        execute_query(
-            connection,
-            """UPDATE {} SET league = '{}', team_name = '{}', handle_name = '{}',
-                role = '{}', end_date = {}, resident = '{}', roster_status = '{}',
-                team_tag = '{}', team_contact_info = '{}' where first_name='{}'
-                AND family_name='{}'""".format(
-                table_name,
-                data.league,
-                data.team_name,
-                data.handle_name,
-                data.role,
-                data.end_date,
-                data.resident,
-                data.roster_status,
-                data.team_tag,
-                data.team_contact_info,
-                data.first_name,
-                data.family_name,
-            ),
-            success_message="Success updating table",
-            error_message="Failed updating table",
-        )
-
-
-# レコードの削除を行う
-def delete_data_from_db(connection, table_name, data_list):
-    for data in data_list:
-        execute_query(
-            connection,
-            "DELETE FROM {} WHERE first_name = '{}' AND family_name= '{}'".format(
-                table_name, data.first_name, data.family_name
-            ),
-            success_message="Success deleting record",
-            error_message="Failed deleting record",
-        )
+# テーブルにレコードが1件もないかどうか
+def is_table_empty(connection, table_name) -> bool:
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM `{}`)".format(table_name))
+        empty = not cursor.fetchone()[0]
+        connection.commit()
+        return empty
+    except Exception as err:
+        logger.error("Failed reading table: '{}'".format(err))
+        exit(1)
+    finally:
+        cursor.close()
 
 
 def show_data_list(data_list):
@@ -153,63 +812,276 @@ def show_data_list(data_list):
         logger.debug(data.values())
 
 
+def show_diff_lists(
+    data_list_update_old, data_list_update_new, data_list_added, data_list_removed
+):
+    logger.debug("list_update_old")
+    show_data_list(data_list_update_old)
+    logger.debug("list_update_new")
+    show_data_list(data_list_update_new)
+    logger.debug("list_removed")
+    show_data_list(data_list_removed)
+    logger.debug("list_added")
+    show_data_list(data_list_added)
+
+
+# 主キー(first_name, family_name)を返す
+def primary_key(data: SpreadsheetData) -> tuple[str, str]:
+    return (data.first_name, data.family_name)
+
+
+# 主キーが重複するデータを取り除き、主キーをキーとする辞書を返す
+# 既存のDBからは主キー(first_name, family_name)が重複することはない
+# しかしSpreadsheetから取得したデータでは重複することがあるので、事前に取り除く
+# 将来的にはDBを正規化することが必要だが、とりあえずend_dateが長いほうを残すことにする
+# (end_dateが同じ場合は先に出現したほうを残す)
+def index_by_primary_key(
+    data_list: list[SpreadsheetData],
+) -> dict[tuple[str, str], SpreadsheetData]:
+    index: dict[tuple[str, str], SpreadsheetData] = {}
+    for data in data_list:
+        key = primary_key(data)
+        current = index.get(key)
+        if current is None or data.end_date > current.end_date:
+            index[key] = data
+    return index
+
+
 # リストを2つ受け取り、差分を更新/追加/削除済みの3つのリストに分けて返す
+# 主キーで索引を作って突き合わせるので、計算量はO(n)(出力順を揃えるためのソートを除く)
 def diff_lists_from_data_lists(
     data_list_new: list[SpreadsheetData], data_list_old: list[SpreadsheetData]
 ):
     if data_list_new == [] or data_list_old == []:
         logger.warning("No data in old|new list")
         return ([], [], [], [])
-    # それぞれのリストをfirst_nameでソート
-    data_list_new.sort(key=lambda x: x.first_name)
-    data_list_old.sort(key=lambda x: x.first_name)
+    # 出力の順序を従来と揃えるため、それぞれのリストをfirst_nameで(安定)ソート
+    # 引数のリストは変更しない
+    index_new = index_by_primary_key(
+        sorted(data_list_new, key=lambda x: x.first_name)
+    )
+    index_old = index_by_primary_key(
+        sorted(data_list_old, key=lambda x: x.first_name)
+    )
 
-    # 既存のDB(data_list_new)からは主キー(first_name, family_name)が重複することはない
-    # しかしSpreadsheetから取得したdata_list_newでは重複することがあるので、事前に取り除く
-    # 将来的にはDBを正規化することが必要だが、とりあえずend_dateが長いほうを残すことにする
+    # 重複の除去で残ったデータが同じ名前の先頭の位置に来るよう、索引の挿入順で走査する
     # 処理としてはupdateになるので、チーム名の変更が表示される
     data_list_update_old = []
     data_list_update_new = []
     data_list_added = []
-    data_list_removed = []
-    # 重複を除去
-    for newd1 in data_list_new:
-        for newd2 in data_list_new:
-            # 同じ名前のデータが複数存在する場合
-            if (
-                newd1.first_name == newd2.first_name
-                and newd1.family_name == newd2.family_name
-                and newd1 != newd2
-            ):
-                if newd1.end_date >= newd2.end_date:
-                    data_list_new.remove(newd2)
-                else:
-                    data_list_new.remove(newd1)
-
-    data_list_added.extend(copy.deepcopy(data_list_new))
-    data_list_removed.extend(copy.deepcopy(data_list_old))
-    for new_data in data_list_new:
-        for old_data in data_list_old:
-            # もし同じ名前のデータがあったら
-            if (
-                new_data.first_name == old_data.first_name
-                and new_data.family_name == old_data.family_name
-            ):
-                # それぞれのデータを比較
-                if new_data != old_data:
-                    data_list_update_old.append(old_data)
-                    data_list_update_new.append(new_data)
-                data_list_added.remove(new_data)
-                data_list_removed.remove(old_data)
+    for key, new_data in index_new.items():
+        old_data = index_old.get(key)
+        # 同じ名前のデータがなければ追加
+        if old_data is None:
+            data_list_added.append(new_data)
+        # 同じ名前のデータがあり、内容が異なれば更新
+        elif new_data != old_data:
+            data_list_update_old.append(old_data)
+            data_list_update_new.append(new_data)
+    data_list_removed = [
+        old_data for key, old_data in index_old.items() if key not in index_new
+    ]
     # ログに出力
-    logger.debug("list_update_old")
-    show_data_list(data_list_update_old)
-    logger.debug("list_update_new")
-    show_data_list(data_list_update_new)
-    logger.debug("list_removed")
-    show_data_list(data_list_removed)
-    logger.debug("list_added")
-    show_data_list(data_list_added)
+    show_diff_lists(
+        data_list_update_old, data_list_update_new, data_list_added, data_list_removed
+    )
+    return (
+        data_list_update_old,
+        data_list_update_new,
+        data_list_added,
+        data_list_removed,
+    )
+
+
+# 主キー(DBに保存された値)を指定してレコードを読み込む
+# 戻り値の辞書のキーは正規化した主キー
+def read_data_by_primary_keys(
+    connection, table_name, key_list: list[tuple[str, str]]
+) -> dict[tuple[str, str], SpreadsheetData]:
+    data_dict = {}
+    cursor = connection.cursor()
+    try:
+        for i in range(0, len(key_list), DELETE_CHUNK_SIZE):
+            chunk = key_list[i : i + DELETE_CHUNK_SIZE]
+            cursor.execute(
+                "SELECT {} FROM `{}` WHERE (`first_name`, `family_name`) IN ({})".format(
+                    COLUMNS, table_name, ", ".join(["(%s, %s)"] * len(chunk))
+                ),
+                [value for key in chunk for value in key],
+            )
+            for row in cursor.fetchall():
+                data = SpreadsheetData(*row)
+                data_dict[primary_key(data)] = data
+        return data_dict
+    except Exception as err:
+        logger.error("Failed reading table: '{}'".format(err))
+        exit(1)
+    finally:
+        cursor.close()
+
+
+# 主キーとfingerprintだけを読み込んで差分を計算する
+# fingerprintが異なるレコードと削除されたレコードだけを全列読み込む
+# 戻り値はdiff_lists_from_data_listsと同じ
+def diff_lists_by_fingerprint(
+    connection, table_name, data_list_new: list[SpreadsheetData]
+):
+    if data_list_new == []:
+        logger.warning("No data in old|new list")
+        return ([], [], [], [])
+    cursor = connection.cursor()
+    try:
+        with span("db_read") as db_read_span:
+            cursor.execute(
+                "SELECT `first_name`, `family_name`, `fingerprint` FROM `{}`".format(
+                    table_name
+                )
+            )
+            # SpreadsheetDataと同じく正規化した主キーで突き合わせる
+            # (正規化前に保存された古い行は、DBの値のままの主キーで読み込む)
+            fingerprint_dict = {}
+            db_key_dict = {}
+            for first_name, family_name, fingerprint in cursor.fetchall():
+                key = (normalize_unicode(first_name), normalize_unicode(family_name))
+                fingerprint_dict[key] = fingerprint
+                db_key_dict[key] = (first_name, family_name)
+            db_read_span.rows = len(fingerprint_dict)
+    except Exception as err:
+        logger.error("Failed reading table: '{}'".format(err))
+        exit(1)
+    finally:
+        cursor.close()
+    if fingerprint_dict == {}:
+        logger.warning("No data in old|new list")
+        return ([], [], [], [])
+
+    # 重複の除去はdiff_lists_from_data_listsと同じ規則で行う
+    index_new = index_by_primary_key(
+        sorted(data_list_new, key=lambda x: x.first_name)
+    )
+    changed_key_list = [
+        key
+        for key, data in index_new.items()
+        if key in fingerprint_dict and fingerprint_dict[key] != data.fingerprint()
+    ]
+    removed_key_list = sorted(
+        (key for key in fingerprint_dict if key not in index_new),
+        key=lambda key: key[0],
+    )
+    with span("db_read") as db_read_span:
+        data_dict_old = read_data_by_primary_keys(
+            connection,
+            table_name,
+            [db_key_dict[key] for key in changed_key_list + removed_key_list],
+        )
+        db_read_span.rows = len(data_dict_old)
+
+    data_list_update_old = []
+    data_list_update_new = []
+    for key in changed_key_list:
+        # fingerprintが未計算などで異なっていても、値が同じなら更新しない
+        if key in data_dict_old and data_dict_old[key] != index_new[key]:
+            data_list_update_old.append(data_dict_old[key])
+            data_list_update_new.append(index_new[key])
+    data_list_added = [
+        data for key, data in index_new.items() if key not in fingerprint_dict
+    ]
+    data_list_removed = [
+        data_dict_old[key] for key in removed_key_list if key in data_dict_old
+    ]
+    # ログに出力
+    show_diff_lists(
+        data_list_update_old, data_list_update_new, data_list_added, data_list_removed
+    )
+    return (
+        data_list_update_old,
+        data_list_update_new,
+        data_list_added,
+        data_list_removed,
+    )
+
+
+# 一時テーブル(ステージングテーブル)を使ってDB側で差分を計算する
+# スプレッドシートのデータを一時テーブルにまとめて書き込み、主キーで結合して
+# 更新/追加/削除されたレコードだけを読み込むので、転送量とメモリは変更の数に比例する
+# 戻り値はdiff_lists_from_data_listsと同じ
+def diff_lists_in_db(
+    connection, table_name, data_list_new: list[SpreadsheetData]
+):
+    if data_list_new == []:
+        logger.warning("No data in old|new list")
+        return ([], [], [], [])
+    staging_table_name = STAGING_TABLE_FORMAT.format(table_name)
+    # 重複の除去はdiff_lists_from_data_listsと同じ規則で行う
+    index_new = index_by_primary_key(
+        sorted(data_list_new, key=lambda x: x.first_name)
+    )
+    old_columns = ", ".join("t.`{}`".format(column) for column in COLUMN_NAMES)
+    new_columns = ", ".join("s.`{}`".format(column) for column in COLUMN_NAMES)
+    join_condition = "t.`first_name` = s.`first_name` AND t.`family_name` = s.`family_name`"
+    # fingerprintが異なるものを変更の候補とする(未計算のNULLも候補に含める)
+    same_condition = "t.`fingerprint` <=> s.`fingerprint`"
+    cursor = connection.cursor()
+    try:
+        cursor.execute("DROP TEMPORARY TABLE IF EXISTS `{}`".format(staging_table_name))
+        cursor.execute(
+            "CREATE TEMPORARY TABLE `{}` LIKE `{}`".format(staging_table_name, table_name)
+        )
+        cursor.executemany(
+            INSERT_QUERY_FORMAT.format(staging_table_name),
+            [row_values(data) for data in index_new.values()],
+        )
+        # 既存のテーブルが空の場合はdiff_lists_from_data_listsと同様に差分なしとする
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM `{}`)".format(table_name))
+        if not cursor.fetchone()[0]:
+            logger.warning("No data in old|new list")
+            return ([], [], [], [])
+
+        cursor.execute(
+            """SELECT {}, {} FROM `{}` t JOIN `{}` s ON {} WHERE NOT ({})
+            ORDER BY s.`first_name`, s.`family_name`""".format(
+                old_columns,
+                new_columns,
+                table_name,
+                staging_table_name,
+                join_condition,
+                same_condition,
+            )
+        )
+        data_list_update_old = []
+        data_list_update_new = []
+        for row in cursor.fetchall():
+            old_data = SpreadsheetData(*row[: len(COLUMN_NAMES)])
+            new_data = SpreadsheetData(*row[len(COLUMN_NAMES) :])
+            if old_data != new_data:
+                data_list_update_old.append(old_data)
+                data_list_update_new.append(new_data)
+        cursor.execute(
+            """SELECT {} FROM `{}` s LEFT JOIN `{}` t ON {}
+            WHERE t.`first_name` IS NULL ORDER BY s.`first_name`, s.`family_name`""".format(
+                new_columns, staging_table_name, table_name, join_condition
+            )
+        )
+        data_list_added = [SpreadsheetData(*row) for row in cursor.fetchall()]
+        cursor.execute(
+            """SELECT {} FROM `{}` t LEFT JOIN `{}` s ON {}
+            WHERE s.`first_name` IS NULL ORDER BY t.`first_name`, t.`family_name`""".format(
+                old_columns, table_name, staging_table_name, join_condition
+            )
+        )
+        data_list_removed = [SpreadsheetData(*row) for row in cursor.fetchall()]
+        # 一時テーブルはセッション終了時にも削除される
+        cursor.execute("DROP TEMPORARY TABLE IF EXISTS `{}`".format(staging_table_name))
+        logger.debug("Success diffing table in DB")
+    except Exception as err:
+        logger.error("Failed diffing table: '{}'".format(err))
+        exit(1)
+    finally:
+        cursor.close()
+    # ログに出力
+    show_diff_lists(
+        data_list_update_old, data_list_update_new, data_list_added, data_list_removed
+    )
     return (
         data_list_update_old,
         data_list_update_new,
@@ -0,0 +1,73 @@
+import datetime
+
+from db.db_access import COLUMN_NAMES, HISTORY_COLUMNS, HISTORY_TABLE_FORMAT
+from model.models import HistoryRecord, SpreadsheetData
+from utils.utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# 変更履歴の検索(いずれもcreate_or_check_history_tableで作成した索引を使う)
+# 時刻はUTCで、valid_from〜valid_toの間有効(valid_toは含まない)
+
+
+def _read_history(connection, query: str, params) -> list[HistoryRecord]:
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query, params)
+        return [
+            HistoryRecord(
+                SpreadsheetData(*row[: len(COLUMN_NAMES)]),
+                *row[len(COLUMN_NAMES) :],
+            )
+            for row in cursor.fetchall()
+        ]
+    except Exception as err:
+        logger.error("Failed reading history: '{}'".format(err))
+        exit(1)
+    finally:
+        cursor.close()
+
+
+# since以降until未満に記録された変更を古い順に返す(valid_fromの索引を範囲で読む)
+# テーブル作成時の既存のレコード("initial")は変更に含めない
+def read_changes(
+    connection,
+    table_name,
+    since: datetime.datetime,
+    until: datetime.datetime = None,
+) -> list[HistoryRecord]:
+    query = "SELECT {} FROM `{}` WHERE `valid_from` >= %s".format(
+        HISTORY_COLUMNS, HISTORY_TABLE_FORMAT.format(table_name)
+    )
+    params = [since]
+    if until is not None:
+        query += " AND `valid_from` < %s"
+        params.append(until)
+    query += " AND `change_type` <> 'initial' ORDER BY `valid_from`, `id`"
+    return _read_history(connection, query, params)
+
+
+# 選手(handle_name)のすべての履歴を古い順に返す
+def read_player_history(connection, table_name, handle_name: str) -> list[HistoryRecord]:
+    return _read_history(
+        connection,
+        "SELECT {} FROM `{}` WHERE `handle_name` = %s ORDER BY `valid_from`, `id`".format(
+            HISTORY_COLUMNS, HISTORY_TABLE_FORMAT.format(table_name)
+        ),
+        (handle_name,),
+    )
+
+
+# ある時点で有効だった選手(handle_name)の契約を返す(削除済みの行は含まない)
+def read_player_at(
+    connection, table_name, handle_name: str, at: datetime.datetime
+) -> list[HistoryRecord]:
+    return _read_history(
+        connection,
+        """SELECT {} FROM `{}` WHERE `handle_name` = %s AND `valid_from` <= %s
+        AND (`valid_to` IS NULL OR `valid_to` > %s) AND `change_type` <> 'removed'
+        ORDER BY `valid_from`, `id`""".format(
+            HISTORY_COLUMNS, HISTORY_TABLE_FORMAT.format(table_name)
+        ),
+        (handle_name, at, at),
+    )
@@ -0,0 +1,229 @@
+import mmap
+import os
+import struct
+from typing import Iterator, Optional
+
+from db.db_access import index_by_primary_key, show_diff_lists
+from model.models import SpreadsheetData
+from utils.utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# 前回の取得結果を保存するバイナリファイル(DBを使わずに差分を計算する場合に使う)
+#
+# ヘッダー: マジック, バージョン, レコード数, 文字列の数, 文字列の位置の表・文字列・レコードの開始位置
+# 文字列の位置の表: 文字列の数+1個のu32(文字列の領域内での開始位置。最後は終端)
+# 文字列: UTF-8。同じ値(リーグ・チーム・ロール・ステータスなど)は1つだけ保存する
+# レコード: 主キー(first_name, family_name)の昇順に並んだ固定長のレコード
+#   (文字列は文字列の番号、NULLはNULL_STRING)
+# 差分は値をそのまま比較するので、fingerprintは保存しない(バージョン1では保存していた)
+MAGIC = b"VCTSNAP\x00"
+VERSION = 2
+HEADER = struct.Struct("<8sIIIQQQ")
+RECORD = struct.Struct("<6Ii4I")
+# 全件を走査する場合の読み方(文字列の番号を符号付きで読み、NULL_STRINGを-1として扱う)
+SIGNED_RECORD = struct.Struct("<6ii4i")
+STRING_OFFSET = struct.Struct("<I")
+NULL_STRING = 0xFFFFFFFF
+# RECORDの文字列の列(SpreadsheetData.values()の順、end_dateを除く)
+STRING_COLUMN_INDEXES = [0, 1, 2, 3, 4, 5, 7, 8, 9, 10]
+
+
+class SnapshotReader:
+    """スナップショットファイルをメモリマップして読む
+
+    開いた時点ではヘッダーしか読まず、文字列・レコードは差分を計算するときに読み込む。
+    バージョンが異なるファイル(以前の形式)はValueErrorになる。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            version,
+            self.record_count,
+            self.string_count,
+            self._string_offsets_start,
+            self._strings_start,
+            self._records_start,
+        ) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError("Unsupported snapshot file: {}".format(path))
+        self._strings: Optional[list[str]] = None
+
+    def __len__(self) -> int:
+        return self.record_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._mmap.close()
+
+    # すべての文字列をまとめて読み込む
+    def _load_all_strings(self):
+        if self._strings is not None:
+            return
+        offsets = struct.unpack_from(
+            "<{}I".format(self.string_count + 1), self._mmap, self._string_offsets_start
+        )
+        blob = self._mmap[self._strings_start : self._records_start]
+        text = str(blob, "utf-8")
+        if len(text) != len(blob):
+            # ASCII以外の文字を含む場合は、バイト単位の位置で切り出してから1つずつデコードする
+            self._strings = [
+                str(blob[offsets[i] : offsets[i + 1]], "utf-8")
+                for i in range(self.string_count)
+            ]
+        else:
+            # ASCIIだけの場合はバイト単位の位置と文字単位の位置が同じなので、まとめてデコードして切り出す
+            self._strings = [
+                text[offsets[i] : offsets[i + 1]] for i in range(self.string_count)
+            ]
+
+    # 文字列の番号から文字列を引くリスト(最後にNoneを加えてあるので、-1はNoneになる)
+    def string_list(self) -> list[Optional[str]]:
+        self._load_all_strings()
+        return self._strings + [None]
+
+    # SIGNED_RECORDで読んだ値を主キーの昇順に返す(文字列もレコードも作成しない)
+    # 文字列の列はstring_list()の添字としてそのまま使える
+    def iter_raw_records(self) -> Iterator[tuple]:
+        records = memoryview(self._mmap)[
+            self._records_start : self._records_start + self.record_count * RECORD.size
+        ]
+        try:
+            yield from SIGNED_RECORD.iter_unpack(records)
+        finally:
+            records.release()
+
+
+# data_listをスナップショットファイルに書き込む
+# 主キーが重複する場合はindex_by_primary_keyと同じ規則で残す
+# 一時ファイルに書き込んでから置き換えるので、途中で失敗しても前回のファイルは壊れない
+def write_snapshot(path: str, data_list: list[SpreadsheetData]):
+    index = index_by_primary_key(data_list)
+    string_ids: dict[str, int] = {}
+    records = []
+    for key in sorted(index):
+        values = index[key].values()
+        for i in STRING_COLUMN_INDEXES:
+            value = values[i]
+            if value is not None and value not in string_ids:
+                string_ids[value] = len(string_ids)
+        records.append(
+            RECORD.pack(
+                *[
+                    values[i] if i == 6 else _string_id(string_ids, values[i])
+                    for i in range(len(values))
+                ]
+            )
+        )
+    encoded = [value.encode("utf-8") for value in string_ids]
+    string_offsets = [0]
+    for value in encoded:
+        string_offsets.append(string_offsets[-1] + len(value))
+
+    string_offsets_start = HEADER.size
+    strings_start = string_offsets_start + len(string_offsets) * STRING_OFFSET.size
+    records_start = strings_start + string_offsets[-1]
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(
+            HEADER.pack(
+                MAGIC,
+                VERSION,
+                len(records),
+                len(encoded),
+                string_offsets_start,
+                strings_start,
+                records_start,
+            )
+        )
+        f.write(struct.pack("<{}I".format(len(string_offsets)), *string_offsets))
+        f.write(b"".join(encoded))
+        f.write(b"".join(records))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    logger.debug(
+        "Wrote snapshot ({} records, {} strings) to {}".format(
+            len(records), len(encoded), path
+        )
+    )
+
+
+def _string_id(string_ids: dict[str, int], value: Optional[str]) -> int:
+    return NULL_STRING if value is None else string_ids[value]
+
+
+# スナップショットと比較して差分を計算する(diff_lists_by_fingerprintのDBの代わりにファイルを読む)
+# 各レコードの値を文字列の表から引いて、主キーで突き合わせた新しいデータの値とそのまま比較する
+# 値が異なるレコードと削除されたレコードだけを作成する
+# 戻り値はdiff_lists_from_data_listsと同じ
+def diff_lists_by_snapshot(
+    snapshot: SnapshotReader, data_list_new: list[SpreadsheetData]
+):
+    if data_list_new == [] or len(snapshot) == 0:
+        logger.warning("No data in old|new list")
+        return ([], [], [], [])
+    # 重複の除去はdiff_lists_from_data_listsと同じ規則で行う
+    index_new = index_by_primary_key(
+        sorted(data_list_new, key=lambda x: x.first_name)
+    )
+    strings = snapshot.string_list()
+    data_dict_old = {}
+    removed_key_list = []
+    old_keys = set()
+    for fields in snapshot.iter_raw_records():
+        # 主キーの列はNULLにならない
+        key = (strings[fields[4]], strings[fields[5]])
+        new_data = index_new.get(key)
+        old_values = [
+            strings[fields[0]],
+            strings[fields[1]],
+            strings[fields[2]],
+            strings[fields[3]],
+            key[0],
+            key[1],
+            fields[6],
+            strings[fields[7]],
+            strings[fields[8]],
+            strings[fields[9]],
+            strings[fields[10]],
+        ]
+        if new_data is None:
+            removed_key_list.append(key)
+            data_dict_old[key] = SpreadsheetData(*old_values)
+            continue
+        old_keys.add(key)
+        if old_values != new_data.values():
+            data_dict_old[key] = SpreadsheetData(*old_values)
+
+    data_list_update_old = []
+    data_list_update_new = []
+    for key, new_data in index_new.items():
+        old_data = data_dict_old.get(key)
+        if old_data is not None and old_data != new_data:
+            data_list_update_old.append(old_data)
+            data_list_update_new.append(new_data)
+    data_list_added = [data for key, data in index_new.items() if key not in old_keys]
+    data_list_removed = [
+        data_dict_old[key] for key in sorted(removed_key_list, key=lambda key: key[0])
+    ]
+    # ログに出力
+    show_diff_lists(
+        data_list_update_old, data_list_update_new, data_list_added, data_list_removed
+    )
+    return (
+        data_list_update_old,
+        data_list_update_new,
+        data_list_added,
+        data_list_removed,
+    )
@@ -0,0 +1,239 @@
+import datetime
+import re
+import sqlite3
+from contextlib import contextmanager
+
+from db.db_access import HISTORY_TABLE_FORMAT, execute_query, seed_history, transaction
+from utils.utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# 他の接続が書き込み中の場合に待つ秒数
+BUSY_TIMEOUT = 30
+
+REX_VALUES = re.compile(r"VALUES\((`\w+`)\)")
+REX_INTERVAL = re.compile(r"NOW\(\) - INTERVAL %s SECOND")
+REX_IF = re.compile(r"\bIF\(")
+
+# DATETIME列はdatetimeとして読み書きする(時刻はUTC)
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter(
+    "DATETIME", lambda value: datetime.datetime.fromisoformat(value.decode("utf-8"))
+)
+
+
+# db.db_accessのMySQL向けのSQLをSQLite向けに書き換える
+# (%sのプレースホルダー、ON DUPLICATE KEY UPDATE ... VALUES(...)、NOW()とINTERVAL、IF()、
+# START TRANSACTION READ ONLYのみ対応)
+# placeholderを"%s"にすると、プレースホルダーは書き換えない(値を埋め込んで表示する場合)
+def translate_query(query: str, placeholder: str = "?") -> str:
+    if query.strip() == "START TRANSACTION READ ONLY":
+        return "BEGIN"
+    query = REX_INTERVAL.sub("datetime('now', '-' || %s || ' seconds')", query)
+    query = query.replace("NOW()", "datetime('now')")
+    query = REX_IF.sub("IIF(", query)
+    query = query.replace("%s", placeholder)
+    if "ON DUPLICATE KEY UPDATE" in query:
+        query = query.replace(
+            "ON DUPLICATE KEY UPDATE",
+            "ON CONFLICT(`first_name`, `family_name`) DO UPDATE SET",
+        )
+        query = REX_VALUES.sub(r"excluded.\1", query)
+    return query
+
+
+# SQLiteのSQLの値のリテラル(ドライランでの表示用。実行には使わない)
+def sql_literal(value) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+class SQLiteCursor:
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        return self._cursor.execute(translate_query(query), tuple(params))
+
+    def executemany(self, query, seq_params):
+        return self._cursor.executemany(
+            translate_query(query), [tuple(params) for params in seq_params]
+        )
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteSession:
+    """SQLiteのファイル(またはメモリ)への接続
+
+    DBSessionと同じようにcursor()/commit()/rollback()/transaction()を持ち、
+    db.db_accessの関数にはconnectionの代わりにそのまま渡せる(SQLはtranslate_queryで書き換える)。
+    ファイルの場合はWALモードにし、読み込みが書き込みを待たないようにする。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(
+            path,
+            timeout=BUSY_TIMEOUT,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+        )
+        if path != ":memory:":
+            self._connection.execute("PRAGMA journal_mode=WAL")
+        # WALではコミットごとのfsyncを省いても壊れない(電源断で直近のコミットが失われるだけ)
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+
+    def cursor(self, prepared: bool = False, buffered: bool = False):
+        # sqlite3は文をキャッシュするので、preparedは区別しない
+        return SQLiteCursor(self._connection.cursor())
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def is_connected(self) -> bool:
+        return True
+
+    @contextmanager
+    def transaction(self, prepared: bool = False):
+        with transaction(self, prepared=prepared) as cursor:
+            yield cursor
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# db.db_accessの同名の関数と同じ列・索引のテーブルをSQLiteに作成する
+def create_or_check_table(connection, table_name):
+    query = """
+    CREATE TABLE IF NOT EXISTS `{}` (
+        league TEXT,
+        team_name TEXT,
+        handle_name TEXT,
+        role TEXT,
+        first_name TEXT NOT NULL,
+        family_name TEXT NOT NULL,
+        end_date INTEGER NOT NULL,
+        resident TEXT,
+        roster_status TEXT,
+        team_tag TEXT,
+        team_contact_info TEXT,
+        fingerprint TEXT,
+        PRIMARY KEY (first_name, family_name)
+    )
+    """.format(
+        table_name
+    )
+    execute_query(
+        connection,
+        query,
+        success_message="Create table or already exists",
+        error_message="Failed creating table",
+    )
+
+
+# db.db_accessの同名の関数のSQLite版(information_schemaの代わりにtable_infoを使う)
+def fingerprint_column_exists(connection, table_name) -> bool:
+    cursor = connection.cursor()
+    try:
+        cursor.execute("PRAGMA table_info(`{}`)".format(table_name))
+        return any(row[1] == "fingerprint" for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def create_or_check_outbox_table(connection, table_name):
+    execute_query(
+        connection,
+        """
+        CREATE TABLE IF NOT EXISTS `{}` (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            webhook_url TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            claimed_at DATETIME,
+            sent_at DATETIME
+        )
+        """.format(
+            table_name
+        ),
+        success_message="Create outbox table or already exists",
+        error_message="Failed creating outbox table",
+    )
+    # SQLiteの索引の名前はDB全体で一意なので、テーブル名をつける
+    execute_query(
+        connection,
+        "CREATE INDEX IF NOT EXISTS `{0}_status_index` ON `{0}` (status, id)".format(
+            table_name
+        ),
+        error_message="Failed creating outbox index",
+    )
+
+
+def create_or_check_history_table(connection, table_name):
+    history_table_name = HISTORY_TABLE_FORMAT.format(table_name)
+    execute_query(
+        connection,
+        """
+        CREATE TABLE IF NOT EXISTS `{}` (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            league TEXT,
+            team_name TEXT,
+            handle_name TEXT,
+            role TEXT,
+            first_name TEXT NOT NULL,
+            family_name TEXT NOT NULL,
+            end_date INTEGER NOT NULL,
+            resident TEXT,
+            roster_status TEXT,
+            team_tag TEXT,
+            team_contact_info TEXT,
+            change_type TEXT NOT NULL,
+            valid_from DATETIME NOT NULL,
+            valid_to DATETIME
+        )
+        """.format(
+            history_table_name
+        ),
+        success_message="Create history table or already exists",
+        error_message="Failed creating history table",
+    )
+    for index_name, columns in [
+        ("valid_from_index", "valid_from"),
+        ("handle_index", "handle_name, valid_from"),
+        ("key_index", "first_name, family_name, valid_to"),
+    ]:
+        execute_query(
+            connection,
+            "CREATE INDEX IF NOT EXISTS `{0}_{1}` ON `{0}` ({2})".format(
+                history_table_name, index_name, columns
+            ),
+            error_message="Failed creating history index",
+        )
+    seed_history(connection, table_name)
@@ -0,0 +1,260 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import partial
+
+import conf.global_values as g
+import db.db_access as mysql_access
+import db.sqlite_access as sqlite_access
+from db.db_access import (
+    COLUMNS,
+    HISTORY_TABLE_FORMAT,
+    DiffStatement,
+    backfill_fingerprints,
+    connect_to_mysql_server,
+    create_or_check_database,
+    diff_lists_by_fingerprint,
+    diff_lists_from_data_lists,
+    diff_lists_in_db,
+    execute_query,
+    fingerprint_column_exists,
+    has_null_fingerprints,
+    index_by_primary_key,
+    insert_data_to_db,
+    is_table_empty,
+    read_data_from_db,
+    read_only_transaction,
+    render_statements,
+    seed_history,
+    write_diff_to_db,
+)
+from db.sqlite_access import SQLiteSession
+from model.models import SpreadsheetData
+from utils.metrics import span
+from utils.utils import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class Storage(ABC):
+    """データの保存先(DB)のインターフェース
+
+    connect()で作成したセッションを各メソッドに渡す。セッションはcursor()/commit()/rollback()/
+    transaction()/close()を持ち、db.db_accessの関数(アウトボックス・変更履歴など)にもそのまま渡せる。
+    読み込み・書き込み・差分の計算は共通のSQLで行い、接続とテーブルの作成だけを実装ごとに変える。
+    """
+
+    @abstractmethod
+    def connect(self):
+        pass
+
+    # 契約のテーブルと、history=Trueの場合は変更履歴のテーブルを作成|存在確認する
+    @abstractmethod
+    def ensure_schema(self, session, table_name, history: bool = True):
+        pass
+
+    # アウトボックスのテーブルを作成|存在確認する
+    @abstractmethod
+    def ensure_outbox(self, session, outbox_table_name):
+        pass
+
+    # with文で使うセッション
+    @contextmanager
+    def session(self):
+        session = self.connect()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def read(self, session, table_name) -> list[SpreadsheetData]:
+        return read_data_from_db(session, table_name)
+
+    def is_empty(self, session, table_name) -> bool:
+        return is_table_empty(session, table_name)
+
+    # DIFF_MODEに従ってテーブルとdata_list_newを比較する
+    # 戻り値はdiff_lists_from_data_listsと同じ
+    def diff(self, session, table_name, data_list_new: list[SpreadsheetData]):
+        if g.DIFF_MODE == "python":
+            # テーブル全体を読み込んで比較する
+            with span("db_read") as db_read_span:
+                data_list_old = self.read(session, table_name)
+                db_read_span.rows = len(data_list_old)
+            with span("diff", rows=len(data_list_new)):
+                return diff_lists_from_data_lists(data_list_new, data_list_old)
+        # 主キーとfingerprintを読み込んで比較し、変更のあったレコードだけを全列読み込む
+        with span("diff", rows=len(data_list_new)):
+            return diff_lists_by_fingerprint(session, table_name, data_list_new)
+
+    # fingerprint列があるかどうか
+    def has_fingerprint_column(self, session, table_name) -> bool:
+        return fingerprint_column_exists(session, table_name)
+
+    # DBを変更せずに比較する(ドライラン用)
+    # 読み取り専用のトランザクション内で、DIFF_MODEに関わらず一時テーブルを作成せずに比較する
+    # fingerprint列がない、または未計算のレコードがある(テーブルの準備をしていない)場合は
+    # テーブル全体を読み込んで比較する
+    def diff_read_only(self, session, table_name, data_list_new: list[SpreadsheetData]):
+        with read_only_transaction(session):
+            if self.has_fingerprint_column(
+                session, table_name
+            ) and not has_null_fingerprints(session, table_name):
+                with span("diff", rows=len(data_list_new)):
+                    return diff_lists_by_fingerprint(session, table_name, data_list_new)
+            logger.debug("Fingerprints are not ready, reading the whole table")
+            with span("db_read") as db_read_span:
+                data_list_old = self.read(session, table_name)
+                db_read_span.rows = len(data_list_old)
+            with span("diff", rows=len(data_list_new)):
+                return diff_lists_from_data_lists(data_list_new, data_list_old)
+
+    # table_nameのデータをsource_table_nameのデータで置き換え、fingerprintを計算する
+    def copy_table(self, session, source_table_name, table_name):
+        execute_query(
+            session,
+            "DELETE FROM `{}`".format(table_name),
+            success_message="Success reset table data",
+            error_message="Failed reset table data",
+        )
+        execute_query(
+            session,
+            "INSERT INTO `{0}` ({1}) SELECT {1} FROM `{2}`".format(
+                table_name, COLUMNS, source_table_name
+            ),
+            success_message="Success copying table",
+            error_message="Failed copying table",
+        )
+        backfill_fingerprints(session, table_name)
+
+    # 差分の文を、値を埋め込んだ1つのトランザクションのSQLにする(ドライラン用)
+    def render_statements(self, statements: list[DiffStatement]) -> list[str]:
+        return ["START TRANSACTION;"] + render_statements(statements) + ["COMMIT;"]
+
+    # まとめて追加する(1つのトランザクション。主キーが重複するものは取り除く)
+    # history=Trueの場合、変更履歴が空であれば追加したレコードを"initial"として書き込む
+    def bulk_insert(
+        self,
+        session,
+        table_name,
+        data_list: list[SpreadsheetData],
+        history: bool = True,
+    ):
+        insert_data_to_db(
+            session, table_name, list(index_by_primary_key(data_list).values())
+        )
+        if history:
+            seed_history(session, table_name)
+
+    # 差分と、アウトボックス・変更履歴への書き込みを1つのトランザクションで行う
+    def write_diff(
+        self,
+        session,
+        table_name,
+        data_list_update: list[SpreadsheetData],
+        data_list_removed: list[SpreadsheetData],
+        data_list_added: list[SpreadsheetData],
+        outbox_table_name: str = None,
+        outbox_list: list[tuple[str, str]] = None,
+        history: bool = True,
+    ):
+        write_diff_to_db(
+            session,
+            table_name,
+            data_list_update,
+            data_list_removed,
+            data_list_added,
+            outbox_table_name=outbox_table_name,
+            outbox_list=outbox_list,
+            history_table_name=(
+                HISTORY_TABLE_FORMAT.format(table_name) if history else None
+            ),
+        )
+
+
+class MySQLStorage(Storage):
+    """MySQLサーバー(接続プールから借りた接続)"""
+
+    def __init__(self, host_name, user_name, user_password, db_name):
+        self.host_name = host_name
+        self.user_name = user_name
+        self.user_password = user_password
+        self.db_name = db_name
+
+    # 接続し、DBを作成|存在確認して選択する
+    def connect(self):
+        session = connect_to_mysql_server(
+            self.host_name, self.user_name, self.user_password
+        )
+        if session is None:
+            exit(1)
+        create_or_check_database(session, self.db_name)
+        execute_query(session, "USE {}".format(self.db_name))
+        return session
+
+    def ensure_schema(self, session, table_name, history: bool = True):
+        mysql_access.create_or_check_table(session, table_name)
+        if history:
+            mysql_access.create_or_check_history_table(session, table_name)
+
+    def ensure_outbox(self, session, outbox_table_name):
+        mysql_access.create_or_check_outbox_table(session, outbox_table_name)
+
+    def diff(self, session, table_name, data_list_new: list[SpreadsheetData]):
+        if g.DIFF_MODE == "staging":
+            # 一時テーブルを使ってDB側で比較し、差分のレコードだけを読み込む
+            with span("diff", rows=len(data_list_new)):
+                return diff_lists_in_db(session, table_name, data_list_new)
+        return super().diff(session, table_name, data_list_new)
+
+
+class SQLiteStorage(Storage):
+    """組み込みのSQLite(1台で動かす場合向け。ネットワーク越しの通信がない)
+
+    WALモードで読み込みと書き込みが互いを待たず、差分は1つのトランザクションでまとめて書き込む。
+    DIFF_MODEの"staging"(一時テーブル)には対応しないので、"fingerprint"で比較する。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if g.DIFF_MODE == "staging":
+            logger.warning(
+                "DIFF_MODE 'staging' is not supported by SQLite, using 'fingerprint'"
+            )
+
+    def connect(self):
+        session = SQLiteSession(self.path)
+        logger.debug("SQLite database opened: {}".format(self.path))
+        return session
+
+    def ensure_schema(self, session, table_name, history: bool = True):
+        sqlite_access.create_or_check_table(session, table_name)
+        if history:
+            sqlite_access.create_or_check_history_table(session, table_name)
+
+    def ensure_outbox(self, session, outbox_table_name):
+        sqlite_access.create_or_check_outbox_table(session, outbox_table_name)
+
+    def has_fingerprint_column(self, session, table_name) -> bool:
+        return sqlite_access.fingerprint_column_exists(session, table_name)
+
+    def render_statements(self, statements: list[DiffStatement]) -> list[str]:
+        return (
+            ["BEGIN;"]
+            + render_statements(
+                statements,
+                translate=partial(sqlite_access.translate_query, placeholder="%s"),
+                literal=sqlite_access.sql_literal,
+            )
+            + ["COMMIT;"]
+        )
+
+
+# STORAGE_BACKENDの保存先を返す
+def create_storage(backend: str = None) -> Storage:
+    if backend is None:
+        backend = g.STORAGE_BACKEND
+    if backend == "sqlite":
+        return SQLiteStorage(g.SQLITE_PATH)
+    if backend == "mysql":
+        return MySQLStorage(g.HOST_NAME, g.USER_NAME, g.PASSWORD, g.DB_NAME)
+    raise ValueError("Unknown storage backend: {}".format(backend))
@@ -0,0 +1,145 @@
+import json
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import requests
+
+from discord_utils.discord_message_sender import DiscordMessageSender
+from utils.http_client import HttpClient, get_http_client
+from utils.metrics import span
+from utils.utils import setup_logger
+
+logger = setup_logger(__name__)
+
+
+@dataclass
+class DeliveryResult:
+    # 送信済みのペイロードを直接送った場合はNone
+    message: Optional[DiscordMessageSender]
+    success: bool
+    attempts: int
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class _RateLimitBucket:
+    remaining: Optional[int] = None
+    reset_at: float = 0.0
+
+
+class DiscordWebhookDispatcher:
+    """Discordのレート制限のヘッダーに従ってメッセージを送信する
+
+    X-RateLimit-Remainingが0になった場合だけX-RateLimit-Reset-Afterの分だけ待ち、
+    429はretry_afterだけ待って、5xxや通信エラーは指数的に間隔を空けて、それぞれ再送する。
+    送信に失敗しても残りのメッセージの送信は続け、メッセージごとの結果を返す。
+    """
+
+    HEADERS = {"Content-Type": "application/json"}
+    MAX_ATTEMPTS = 5
+    BACKOFF_BASE = 1.0
+    BACKOFF_MAX = 30.0
+
+    def __init__(
+        self, http_client: HttpClient = None, sleep=time.sleep, clock=time.monotonic
+    ):
+        self.http_client = http_client or get_http_client()
+        self._sleep = sleep
+        self._clock = clock
+        # webhookのURLごとのレート制限の状態
+        self._buckets: dict[str, _RateLimitBucket] = {}
+
+    def _wait_for_bucket(self, bucket: _RateLimitBucket):
+        if bucket.remaining is not None and bucket.remaining <= 0:
+            wait = bucket.reset_at - self._clock()
+            if wait > 0:
+                logger.debug("Rate limit bucket is empty, waiting {:.2f}s".format(wait))
+                self._sleep(wait)
+            bucket.remaining = None
+
+    def _update_bucket(self, bucket: _RateLimitBucket, response: requests.Response):
+        try:
+            remaining = response.headers.get("X-RateLimit-Remaining")
+            reset_after = response.headers.get("X-RateLimit-Reset-After")
+            if remaining is not None:
+                bucket.remaining = int(remaining)
+            if reset_after is not None:
+                bucket.reset_at = self._clock() + float(reset_after)
+        except ValueError as err:
+            logger.debug(err)
+
+    @staticmethod
+    def _retry_after(response: requests.Response) -> float:
+        try:
+            return float(response.json()["retry_after"])
+        except Exception:
+            return float(response.headers.get("Retry-After", 1))
+
+    def _backoff(self, attempts: int) -> float:
+        return min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** (attempts - 1))
+
+    def send(self, message: DiscordMessageSender) -> DeliveryResult:
+        main_content = json.dumps(message.webhook_structure.dict())
+        result = self.send_payload(message.webhook_url, main_content)
+        result.message = message
+        return result
+
+    # 再送する場合だけ待つ(最後の試行の後は待たずに諦める)
+    def _sleep_before_retry(self, result: DeliveryResult, seconds: float):
+        if result.attempts < self.MAX_ATTEMPTS:
+            self._sleep(seconds)
+
+    # JSONに変換済みのペイロードを送信する
+    def send_payload(self, webhook_url: str, main_content: str) -> DeliveryResult:
+        logger.debug(main_content)
+        bucket = self._buckets.setdefault(webhook_url, _RateLimitBucket())
+        result = DeliveryResult(message=None, success=False, attempts=0)
+        while result.attempts < self.MAX_ATTEMPTS:
+            self._wait_for_bucket(bucket)
+            result.attempts += 1
+            try:
+                with span("webhook_post", bytes=len(main_content)):
+                    response = self.http_client.post(
+                        webhook_url, headers=self.HEADERS, data=main_content
+                    )
+            except requests.RequestException as err:
+                result.status_code = None
+                result.error = str(err)
+                self._sleep_before_retry(result, self._backoff(result.attempts))
+                continue
+            result.status_code = response.status_code
+            self._update_bucket(bucket, response)
+            if response.status_code == 429:
+                # 制限を超えた場合は指定された時間だけ待って再送する
+                result.error = "Too Many Requests"
+                self._sleep_before_retry(result, self._retry_after(response))
+            elif response.status_code >= 500:
+                result.error = "Server Error"
+                self._sleep_before_retry(result, self._backoff(result.attempts))
+            elif response.status_code >= 400:
+                # リクエストの内容が不正な場合は再送しても成功しない
+                result.error = response.text
+                break
+            else:
+                result.success = True
+                result.error = None
+                logger.debug("Success post request")
+                break
+        if not result.success:
+            logger.warning(
+                "Failed post request ({} attempts): '{}'".format(
+                    result.attempts, result.error
+                )
+            )
+        return result
+
+    def dispatch(self, message_list: list[DiscordMessageSender]) -> list[DeliveryResult]:
+        result_list = [self.send(message) for message in message_list]
+        logger.debug(
+            "Delivered {}/{} messages".format(
+                sum(result.success for result in result_list), len(result_list)
+            )
+        )
+        return result_list
@@ -3,15 +3,15 @@ from model.models import SpreadsheetData
 from model.webhook_structures import DiscordWebhookStructure, Embed, Field, Image, Thumbnail
 from utils.utils import setup_logger
 from scraping.liquipedia import LiquipediaScraper
+from utils.http_client import get_http_client
 
-import json, requests, time
+import json, time
 
 logger = setup_logger(__name__)
 
 
 class DiscordMessageSender:
     HEADERS = {"Content-Type": "application/json"}
-    TIMEOUT = 10
     SLEEP_INTERVAL = 3
 
     def __init__(
@@ -28,11 +28,8 @@ class DiscordMessageSender:
         main_content = json.dumps(self.webhook_structure.dict())
         logger.debug(main_content)
         try:
-            response = requests.post(
-                url=self.webhook_url,
-                headers=self.HEADERS,
-                data=main_content,
-                timeout=self.TIMEOUT,
+            response = get_http_client().post(
+                self.webhook_url, headers=self.HEADERS, data=main_content
             )
             response.raise_for_status()
             logger.debug("Success post request")
@@ -44,14 +41,21 @@ class DiscordMessageSender:
 
 
 class DiscordSpreadsheetMessageSender(DiscordMessageSender):
+    # まとめて送信する際のグループ(変更の種類・リーグ)
+    league: str = ""
+
     def __init__(
         self,
         player_name: str,
         webhook_url: str,
         webhook_structure: DiscordWebhookStructure = None,
+        liquipedia_scraper: LiquipediaScraper = None,
     ):
         super().__init__(webhook_url=webhook_url, webhook_structure=webhook_structure)
-        self.liquipedia_scraper = LiquipediaScraper(player_name=player_name)
+        # 事前に取得済みのLiquipediaScraperが渡されなかった場合はここで取得する
+        if liquipedia_scraper is None:
+            liquipedia_scraper = LiquipediaScraper(player_name=player_name)
+        self.liquipedia_scraper = liquipedia_scraper
         if self.liquipedia_scraper.scrape_successfully:
             self.webhook_structure.embeds = [
                 Embed(
@@ -88,8 +92,17 @@ class DiscordTeamUpdatedMessageSender(DiscordSpreadsheetMessageSender):
     TEAM_TITLE_FORMAT = "{}({} {}, {}, ex-{}) joined {}"
     COLOR = 0x118822
 
-    def __init__(self, old_data: SpreadsheetData, new_data: SpreadsheetData, webhook_url: str):
-        super().__init__(new_data.handle_name, webhook_url)
+    def __init__(
+        self,
+        old_data: SpreadsheetData,
+        new_data: SpreadsheetData,
+        webhook_url: str,
+        liquipedia_scraper: LiquipediaScraper = None,
+    ):
+        super().__init__(
+            new_data.handle_name, webhook_url, liquipedia_scraper=liquipedia_scraper
+        )
+        self.league = new_data.league
         self.webhook_structure.embeds[0].color = self.COLOR
         self.webhook_structure.embeds[0].title = self.TEAM_TITLE_FORMAT.format(
             new_data.handle_name,
@@ -105,8 +118,17 @@ class DiscordEndDateUpdatedMessageSender(DiscordSpreadsheetMessageSender):
     END_DATE_TITLE_FORMAT = "The end date of {}({} {}, {} in {}) was changed from {} to {}"
     COLOR = 0x118822
 
-    def __init__(self, old_data: SpreadsheetData, new_data: SpreadsheetData, webhook_url: str):
-        super().__init__(new_data.handle_name, webhook_url)
+    def __init__(
+        self,
+        old_data: SpreadsheetData,
+        new_data: SpreadsheetData,
+        webhook_url: str,
+        liquipedia_scraper: LiquipediaScraper = None,
+    ):
+        super().__init__(
+            new_data.handle_name, webhook_url, liquipedia_scraper=liquipedia_scraper
+        )
+        self.league = new_data.league
         self.webhook_structure.embeds[0].color = self.COLOR
         self.webhook_structure.embeds[0].title = self.END_DATE_TITLE_FORMAT.format(
             new_data.handle_name,
@@ -122,8 +144,17 @@ class DiscordRosterUpdatedMessageSender(DiscordSpreadsheetMessageSender):
     ROSTER_TITLE_FORMAT = "{}({} {}, {} in {}) is {} now"
     COLOR = 0x118822
 
-    def __init__(self, old_data: SpreadsheetData, new_data: SpreadsheetData, webhook_url: str):
-        super().__init__(new_data.handle_name, webhook_url)
+    def __init__(
+        self,
+        old_data: SpreadsheetData,
+        new_data: SpreadsheetData,
+        webhook_url: str,
+        liquipedia_scraper: LiquipediaScraper = None,
+    ):
+        super().__init__(
+            new_data.handle_name, webhook_url, liquipedia_scraper=liquipedia_scraper
+        )
+        self.league = new_data.league
         self.webhook_structure.embeds[0].color = self.COLOR
         self.webhook_structure.embeds[0].title = self.ROSTER_TITLE_FORMAT.format(
             new_data.handle_name,
@@ -138,8 +169,17 @@ class DiscordRoleUpdatedMessageSender(DiscordSpreadsheetMessageSender):
     ROLE_TITLE_FORMAT = "{}({} {} in {}) changed role from {} to {}"
     COLOR = 0x118822
 
-    def __init__(self, old_data: SpreadsheetData, new_data: SpreadsheetData, webhook_url: str):
-        super().__init__(new_data.handle_name, webhook_url)
+    def __init__(
+        self,
+        old_data: SpreadsheetData,
+        new_data: SpreadsheetData,
+        webhook_url: str,
+        liquipedia_scraper: LiquipediaScraper = None,
+    ):
+        super().__init__(
+            new_data.handle_name, webhook_url, liquipedia_scraper=liquipedia_scraper
+        )
+        self.league = new_data.league
         self.webhook_structure.embeds[0].color = self.COLOR
         self.webhook_structure.embeds[0].title = self.ROLE_TITLE_FORMAT.format(
             new_data.handle_name,
@@ -159,8 +199,12 @@ class DiscordDeletedMessageSender(DiscordSpreadsheetMessageSender):
         self,
         data: SpreadsheetData,
         webhook_url: str,
+        liquipedia_scraper: LiquipediaScraper = None,
     ):
-        super().__init__(data.handle_name, webhook_url)
+        super().__init__(
+            data.handle_name, webhook_url, liquipedia_scraper=liquipedia_scraper
+        )
+        self.league = data.league
         self.webhook_structure.embeds[0].color = self.COLOR
         self.webhook_structure.embeds[0].title = self.TITLE_FORMAT.format(
             data.handle_name,
@@ -179,8 +223,12 @@ class DiscordAddedMessageSender(DiscordSpreadsheetMessageSender):
         self,
         data: SpreadsheetData,
         webhook_url: str,
+        liquipedia_scraper: LiquipediaScraper = None,
     ):
-        super().__init__(data.handle_name, webhook_url)
+        super().__init__(
+            data.handle_name, webhook_url, liquipedia_scraper=liquipedia_scraper
+        )
+        self.league = data.league
         self.webhook_structure.embeds[0].color = self.COLOR
         self.webhook_structure.embeds[0].title = self.TITLE_FORMAT.format(
             data.handle_name,
@@ -190,3 +238,83 @@ class DiscordAddedMessageSender(DiscordSpreadsheetMessageSender):
             data.team_name,
         )
 
+
+
+class DiscordBatchMessageSender(DiscordMessageSender):
+    """複数のメッセージのembedを1つのメッセージにまとめて送信する"""
+
+    # docs:https://discord.com/developers/docs/resources/message#embed-object-embed-limits
+    MAX_EMBEDS = 10
+    MAX_TOTAL_CHARACTERS = 6000
+
+    def __init__(self, webhook_url: str, message_list: list[DiscordMessageSender]):
+        super().__init__(
+            webhook_url=webhook_url,
+            webhook_structure=DiscordWebhookStructure(
+                embeds=[
+                    embed
+                    for message in message_list
+                    for embed in message.webhook_structure.embeds or []
+                ]
+            ),
+        )
+        self.message_list = message_list
+
+
+# embedの文字数(Discordの上限の計算に含まれるもの)を数える
+def count_embed_characters(embed: Embed) -> int:
+    count = len(embed.title or "") + len(embed.description or "")
+    if embed.author is not None:
+        count += len(embed.author.name or "")
+    for field in embed.fields or []:
+        count += len(str(field.name)) + len(str(field.value))
+    return count
+
+
+def count_message_characters(message: DiscordMessageSender) -> int:
+    return sum(
+        count_embed_characters(embed) for embed in message.webhook_structure.embeds or []
+    )
+
+
+# メッセージをembedの数・文字数の上限までまとめ、送信回数を減らす
+# 送信先・変更の種類・リーグが同じものが隣り合うように並べてから順に詰める
+def pack_messages(
+    message_list: list[DiscordMessageSender],
+) -> list[DiscordBatchMessageSender]:
+    type_order = {}
+    for message in message_list:
+        type_order.setdefault(type(message), len(type_order))
+    sorted_message_list = sorted(
+        message_list,
+        key=lambda message: (
+            message.webhook_url,
+            type_order[type(message)],
+            getattr(message, "league", ""),
+        ),
+    )
+
+    batch_list: list[DiscordBatchMessageSender] = []
+    batch: list[DiscordMessageSender] = []
+    embed_count = 0
+    character_count = 0
+    for message in sorted_message_list:
+        message_embed_count = len(message.webhook_structure.embeds or [])
+        message_character_count = count_message_characters(message)
+        if batch != [] and (
+            message.webhook_url != batch[0].webhook_url
+            or embed_count + message_embed_count
+            > DiscordBatchMessageSender.MAX_EMBEDS
+            or character_count + message_character_count
+            > DiscordBatchMessageSender.MAX_TOTAL_CHARACTERS
+        ):
+            batch_list.append(DiscordBatchMessageSender(batch[0].webhook_url, batch))
+            batch = []
+            embed_count = 0
+            character_count = 0
+        batch.append(message)
+        embed_count += message_embed_count
+        character_count += message_character_count
+    if batch != []:
+        batch_list.append(DiscordBatchMessageSender(batch[0].webhook_url, batch))
+    return batch_list
@@ -0,0 +1,93 @@
+import json
+import os
+
+import conf.global_values as g
+from db.db_access import claim_outbox, finish_outbox, read_pending_outbox
+from discord_utils.discord_dispatcher import DeliveryResult, DiscordWebhookDispatcher
+from discord_utils.discord_message_sender import DiscordMessageSender
+from utils.utils import setup_logger
+
+logger = setup_logger(__name__)
+
+
+# アウトボックスに書き込む(webhook_url, payload)のリストを作成する
+def create_outbox_list(
+    message_list: list[DiscordMessageSender],
+) -> list[tuple[str, str]]:
+    return [
+        (message.webhook_url, json.dumps(message.webhook_structure.dict()))
+        for message in message_list
+    ]
+
+
+# 送信待ちのメッセージがあるかもしれないことを示す目印のファイル
+# (スプレッドシートに変化がない場合に、DBに接続せずに送信が必要かどうかを判断するために使う)
+def outbox_pending_path(table_name: str) -> str:
+    return g.OUTBOX_PENDING_PATH_FORMAT.format(table_name)
+
+
+def has_pending_outbox(table_name: str) -> bool:
+    return os.path.exists(outbox_pending_path(table_name))
+
+
+# アウトボックスに書き込む前に呼び出す(書き込み後に送信できずに終了しても、次回に送信する)
+def mark_outbox_pending(table_name: str):
+    with open(outbox_pending_path(table_name), "w", encoding="utf-8"):
+        pass
+
+
+def clear_outbox_pending(table_name: str):
+    try:
+        os.remove(outbox_pending_path(table_name))
+    except FileNotFoundError:
+        pass
+
+
+# アウトボックスの送信待ちのメッセージを古い順に送信する
+# 送信前に行を確保するので、複数のプロセスで同時に実行しても同じメッセージを二重に送信しない
+def drain_outbox(
+    connection,
+    table_name: str,
+    dispatcher: DiscordWebhookDispatcher = None,
+) -> list[DeliveryResult]:
+    if dispatcher is None:
+        dispatcher = DiscordWebhookDispatcher()
+    result_list = []
+    last_id = 0
+    while True:
+        outbox_list = read_pending_outbox(
+            connection,
+            table_name,
+            after_id=last_id,
+            limit=g.OUTBOX_BATCH_SIZE,
+            claim_timeout=g.OUTBOX_CLAIM_TIMEOUT,
+        )
+        if outbox_list == []:
+            break
+        for outbox_id, webhook_url, payload in outbox_list:
+            last_id = outbox_id
+            if not claim_outbox(
+                connection, table_name, outbox_id, g.OUTBOX_CLAIM_TIMEOUT
+            ):
+                continue
+            result = dispatcher.send_payload(webhook_url, payload)
+            finish_outbox(
+                connection,
+                table_name,
+                outbox_id,
+                success=result.success,
+                error=result.error,
+                max_attempts=g.OUTBOX_MAX_ATTEMPTS,
+            )
+            result_list.append(result)
+    # 送信できなかったメッセージがあれば目印を残し、すべて送信できれば消す
+    if all(result.success for result in result_list):
+        clear_outbox_pending(table_name)
+    else:
+        mark_outbox_pending(table_name)
+    logger.debug(
+        "Drained outbox: {}/{} messages delivered".format(
+            sum(result.success for result in result_list), len(result_list)
+        )
+    )
+    return result_list
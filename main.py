@@ -1,72 +1,382 @@
 from __future__ import annotations
 import conf.global_values as g
+import json
+import os
+import signal
 import sys
+import threading
 
-import urllib3.util.connection as urllib3_cn
-import socket
 from conf.settings import load_env
 from utils.utils import setup_logger
 from db.db_access import (
-    connect_to_mysql_server,
-    create_or_check_database,
-    execute_query,
-    create_or_check_table,
-    read_data_from_db,
     diff_lists_from_data_lists,
-    update_data_to_db,
-    delete_data_from_db,
-    insert_data_to_db,
+    create_diff_statements,
+    HISTORY_TABLE_FORMAT,
 )
+from db.storage import Storage, create_storage
 
-from scraping.spreadsheet import get_spreadsheet_data_list
+from scraping.spreadsheet import (
+    get_spreadsheet_data_list,
+    get_sheet_gids,
+    is_spreadsheet_csv_url,
+    parse_spreadsheet_csv,
+    parse_spreadsheet_html,
+    spreadsheet_csv_url,
+)
+from scraping.fetcher import ConditionalFetcher, FetchResult
 from message.message_creator import create_message_list
+from scraping.liquipedia import LiquipediaEnrichmentExecutor
+from scraping.liquipedia_cache import LiquipediaProfileCache
+from discord_utils.discord_message_sender import pack_messages
+from discord_utils.discord_dispatcher import DiscordWebhookDispatcher
+from discord_utils.outbox_worker import (
+    create_outbox_list,
+    drain_outbox,
+    has_pending_outbox,
+    mark_outbox_pending,
+)
+from utils.poll_scheduler import AdaptivePollScheduler
+from utils.metrics import Metrics, get_metrics, set_metrics, span
+from api.contract_snapshot import ContractSnapshot
+from api.read_api import ContractReadApi
+from db.snapshot_file import SnapshotReader, diff_lists_by_snapshot, write_snapshot
 
+logger = setup_logger(__name__)
 
-# ソケットの通信をIPv4のみに制限
-def allowed_gai_family4():
-    return socket.AF_INET
 
+# テーブルを作成|存在確認する
+def prepare_database(storage: Storage, connection, table_name: str):
+    storage.ensure_schema(connection, table_name)
+    storage.ensure_outbox(connection, g.OUTBOX_TABLE_NAME)
 
-def main(table_name: str, webhook_url: str):
-    # スプレッドシートのpubhtmlのデータを取得
-    data_list_from_spreadsheet = get_spreadsheet_data_list(g.TARGET_URL)
-    # MySQLサーバーに接続
-    connection = connect_to_mysql_server(g.HOST_NAME, g.USER_NAME, g.PASSWORD)
-    # DBを作成|存在確認
-    create_or_check_database(connection, g.DB_NAME)
-    # DBを選択
-    execute_query(connection, "USE {}".format(g.DB_NAME))
-    # テーブルを作成|存在確認
-    create_or_check_table(connection, table_name)
 
-    # テーブルのデータを表示
-    data_list_from_db = read_data_from_db(connection, table_name)
+# スプレッドシートを条件付きで取得する
+# SPREADSHEET_BACKENDが"csv"の場合はシートごとのCSVを並行して取得し、失敗した場合はpubhtmlを取得する
+# (pubhtmlから探したシートのgidはfetcherに保存し、毎回は探さない)
+def fetch_spreadsheet(fetcher: ConditionalFetcher) -> list[FetchResult]:
+    if g.SPREADSHEET_BACKEND == "csv":
+        try:
+            gids = get_sheet_gids(g.TARGET_URL, fetcher=fetcher)
+            if gids != []:
+                return fetcher.fetch_many(
+                    [spreadsheet_csv_url(g.TARGET_URL, gid) for gid in gids],
+                    max_workers=g.SPREADSHEET_MAX_WORKERS,
+                )
+            logger.warning("No sheet found, falling back to pubhtml")
+        except Exception as err:
+            logger.warning(
+                "Failed fetching CSV, falling back to pubhtml: '{}'".format(err)
+            )
+            # シートが削除された場合に備えて、次回はgidを探し直す
+            fetcher.clear_sheet_gids(g.TARGET_URL)
+    return [fetcher.fetch(g.TARGET_URL)]
+
+
+# 取得したCSV|pubhtmlをパースし、取得した順につなげる
+def parse_fetch_results(fetch_result_list: list[FetchResult]):
+    data_list = []
+    for fetch_result in fetch_result_list:
+        if is_spreadsheet_csv_url(fetch_result.url):
+            data_list.extend(parse_spreadsheet_csv(fetch_result.text))
+        else:
+            data_list.extend(parse_spreadsheet_html(fetch_result.text))
+    return data_list
+
+
+def run_once(
+    table_name: str,
+    webhook_url: str,
+    fetcher: ConditionalFetcher,
+    storage: Storage,
+    get_connection,
+    enrichment_executor: LiquipediaEnrichmentExecutor = None,
+    dispatcher: DiscordWebhookDispatcher = None,
+    snapshot: ContractSnapshot = None,
+    drain: bool = True,
+) -> bool:
+    """
+    スプレッドシートを取得し、差分があればDBの更新と通知を行う
+    get_connectionはstorageの準備済みの接続を返す関数(必要になった時点で呼び出す)
+    snapshotを渡した場合はDBに書き込んだ差分を反映する
+    drainがFalseの場合はアウトボックスに書き込むだけで送信しない(--drainで送信する)
+    スプレッドシートに変化があった場合はTrueを返す
+    """
+    # スプレッドシートを条件付きで取得
+    with span("fetch") as fetch_span:
+        fetch_result_list = fetch_spreadsheet(fetcher)
+        fetch_span.bytes = sum(
+            len(fetch_result.text or "") for fetch_result in fetch_result_list
+        )
+    # 前回から変化がなければパースやDBへの接続をせずに終了
+    if not any(fetch_result.changed for fetch_result in fetch_result_list):
+        logger.debug("Spreadsheet is not changed")
+        return False
+    with span("parse", bytes=fetch_span.bytes) as parse_span:
+        data_list_from_spreadsheet = parse_fetch_results(fetch_result_list)
+        parse_span.rows = len(data_list_from_spreadsheet)
+    # 取得した内容から1行も読み取れない場合(エラーページなど)は、取得結果を保存せずに次回やり直す
+    if data_list_from_spreadsheet == []:
+        logger.warning("No valid row in spreadsheet")
+        return False
+    with span("db_connect"):
+        connection = get_connection()
+    # テーブルが空の場合(新しく作成したDBなど)は、全件を追加として通知しないよう書き込みだけを行う
+    if storage.is_empty(connection, table_name):
+        logger.debug("Table is empty, inserting all rows without notification")
+        with span("db_write_insert", rows=len(data_list_from_spreadsheet)):
+            storage.bulk_insert(connection, table_name, data_list_from_spreadsheet)
+        if snapshot is not None:
+            snapshot.load(storage.read(connection, table_name))
+        for fetch_result in fetch_result_list:
+            fetcher.save(fetch_result)
+        return True
+
     # DBとスプレッドシートのデータを比較し、差分のリストを取得
     (
         data_list_update_old,
         data_list_update_new,
         data_list_added,
         data_list_removed,
-    ) = diff_lists_from_data_lists(data_list_from_spreadsheet, data_list_from_db)
-
-    # DBの更新、追加、削除
-    update_data_to_db(connection, table_name, data_list_update_new)
-    delete_data_from_db(connection, table_name, data_list_removed)
-    insert_data_to_db(connection, table_name, data_list_added)
+    ) = storage.diff(connection, table_name, data_list_from_spreadsheet)
 
-    # WEBHOOKを利用してdiffを送信
-    message_list = create_message_list(
-        data_list_update_old,
+    # diffを告知するメッセージを作成し、embedを上限までまとめる
+    with span("message") as message_span:
+        message_list = create_message_list(
+            data_list_update_old,
+            data_list_update_new,
+            data_list_added,
+            data_list_removed,
+            webhook_url=webhook_url,
+            enrichment_executor=enrichment_executor,
+        )
+        message_span.rows = len(message_list)
+    outbox_list = create_outbox_list(pack_messages(message_list))
+    # 送信する前に終了しても次回に送信できるよう、書き込む前に目印を残す
+    if outbox_list != []:
+        mark_outbox_pending(g.OUTBOX_TABLE_NAME)
+    # DBの更新、追加、削除と、変更履歴・送信するメッセージのアウトボックスへの書き込みを
+    # 1つのトランザクションで行う
+    storage.write_diff(
+        connection,
+        table_name,
         data_list_update_new,
-        data_list_added,
         data_list_removed,
-        webhook_url=webhook_url,
+        data_list_added,
+        outbox_table_name=g.OUTBOX_TABLE_NAME,
+        outbox_list=outbox_list,
     )
-    for message in message_list:
-        message.post()
+    if snapshot is not None:
+        snapshot.apply_diff(data_list_update_new, data_list_removed, data_list_added)
 
-    # MySQLサーバーとの接続を切断
-    connection.close()
+    # アウトボックスのメッセージを送信する(送信できなかったものは次回以降に再送する)
+    if drain:
+        with span("dispatch"):
+            drain_outbox(connection, g.OUTBOX_TABLE_NAME, dispatcher=dispatcher)
+
+    # 最後まで処理できたので、次回の条件付きリクエストのために取得結果を保存
+    for fetch_result in fetch_result_list:
+        fetcher.save(fetch_result)
+    return True
+
+
+def main(table_name: str, webhook_url: str):
+    fetcher = ConditionalFetcher(g.FETCH_STATE_PATH_FORMAT.format(table_name))
+    storage = create_storage()
+    connection = None
+
+    def get_connection():
+        nonlocal connection
+        # DBに接続
+        if connection is None:
+            connection = storage.connect()
+            prepare_database(storage, connection, table_name)
+        return connection
+
+    changed = run_once(
+        table_name,
+        webhook_url,
+        fetcher,
+        storage,
+        get_connection,
+        drain=g.OUTBOX_DRAIN_INLINE,
+    )
+    # 変化がなかった場合も、前回までに送信できなかったメッセージが残っていれば送信する
+    # (目印のファイルがなければDBに接続しない。アウトボックスは書き込んだ時点で作成済みなので、
+    # テーブルの作成|存在確認はしない)
+    if not changed and g.OUTBOX_DRAIN_INLINE and has_pending_outbox(g.OUTBOX_TABLE_NAME):
+        if connection is None:
+            connection = storage.connect()
+        with span("dispatch"):
+            drain_outbox(connection, g.OUTBOX_TABLE_NAME)
+
+    # DBとの接続を切断
+    if connection is not None:
+        connection.close()
+
+
+def main_watch(
+    table_name: str, webhook_url: str, export_metrics=None, serve: bool = False
+):
+    """
+    常駐してスプレッドシートを繰り返し取得する
+    DBへの接続、Liquipediaのキャッシュ、送信のレート制限の状態などは実行の間で使い回す
+    変化があった直後や移籍期間中は短い間隔で、変化がなければ間隔を延ばしながら取得する
+    SIGINT/SIGTERMを受け取ると、処理中の取得が終わってから終了する
+    export_metricsを渡した場合は取得のたびに呼び出す(計測結果は累積する)
+    serveがTrueの場合は契約の読み取り用のHTTP/JSON APIをAPI_HOST:API_PORTで公開する
+    (最初にDBから読み込み、以降は取得のたびに差分だけを反映する)
+    """
+    fetcher = ConditionalFetcher(g.FETCH_STATE_PATH_FORMAT.format(table_name))
+    storage = create_storage()
+    enrichment_executor = LiquipediaEnrichmentExecutor(cache=LiquipediaProfileCache())
+    dispatcher = DiscordWebhookDispatcher()
+    scheduler = AdaptivePollScheduler(
+        min_interval=g.WATCH_MIN_INTERVAL,
+        max_interval=g.WATCH_MAX_INTERVAL,
+        backoff_factor=g.WATCH_BACKOFF_FACTOR,
+        transfer_windows=g.WATCH_TRANSFER_WINDOWS,
+        transfer_window_interval=g.WATCH_TRANSFER_WINDOW_INTERVAL,
+    )
+    stop_event = threading.Event()
+    connection = None
+    snapshot = ContractSnapshot() if serve else None
+
+    def stop(signum, frame):
+        logger.debug("Received signal {}, stopping".format(signum))
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    def get_connection():
+        nonlocal connection
+        # 接続が切れていた場合だけ接続し直す
+        if connection is None or not connection.is_connected():
+            # 切れた接続はプールに返してから、新しい接続を借りる
+            if connection is not None:
+                connection.close()
+            connection = storage.connect()
+            prepare_database(storage, connection, table_name)
+        if snapshot is not None and not snapshot.loaded:
+            snapshot.load(storage.read(connection, table_name))
+        return connection
+
+    read_api = None
+    if serve:
+        # スプレッドシートに変化がなくても答えられるよう、最初にDBから読み込んでおく
+        get_connection()
+        read_api = ContractReadApi(snapshot, g.API_HOST, g.API_PORT).start()
+
+    while not stop_event.is_set():
+        try:
+            changed = run_once(
+                table_name,
+                webhook_url,
+                fetcher,
+                storage,
+                get_connection,
+                enrichment_executor=enrichment_executor,
+                dispatcher=dispatcher,
+                snapshot=snapshot,
+            )
+            # 変化がなくても、接続済みであれば送信に失敗したメッセージを再送する
+            if not changed and connection is not None:
+                drain_outbox(get_connection(), g.OUTBOX_TABLE_NAME, dispatcher=dispatcher)
+        # 各処理は失敗時にexit(1)するが、常駐中は次の取得で再試行する
+        except (Exception, SystemExit) as err:
+            logger.error("Failed polling: '{}'".format(err))
+            changed = False
+        if export_metrics is not None:
+            export_metrics()
+        interval = scheduler.next_interval(changed)
+        logger.debug("Next poll in {:.0f}s".format(interval))
+        stop_event.wait(interval)
+
+    if read_api is not None:
+        read_api.stop()
+    # DBとの接続を切断
+    if connection is not None:
+        connection.close()
+
+
+def main_snapshot(table_name: str, webhook_url: str):
+    """
+    DBを使わずに、前回の取得結果をスナップショットファイルと比較して差分を通知する
+    (小規模な環境やCI向け。アウトボックス・変更履歴は使わず、直接送信する)
+    スナップショットファイルがない場合は作成だけを行い、通知はしない
+    """
+    fetcher = ConditionalFetcher(
+        g.FETCH_STATE_PATH_FORMAT.format(table_name + "_snapshot")
+    )
+    snapshot_path = g.SNAPSHOT_PATH_FORMAT.format(table_name)
+    with span("fetch") as fetch_span:
+        fetch_result_list = fetch_spreadsheet(fetcher)
+        fetch_span.bytes = sum(
+            len(fetch_result.text or "") for fetch_result in fetch_result_list
+        )
+    if not any(fetch_result.changed for fetch_result in fetch_result_list):
+        logger.debug("Spreadsheet is not changed")
+        return
+    with span("parse", bytes=fetch_span.bytes) as parse_span:
+        data_list_from_spreadsheet = parse_fetch_results(fetch_result_list)
+        parse_span.rows = len(data_list_from_spreadsheet)
+    if data_list_from_spreadsheet == []:
+        logger.warning("No valid row in spreadsheet")
+        return
+
+    snapshot = None
+    if os.path.exists(snapshot_path):
+        # ヘッダーだけを読み、レコードは比較しながら読み込む
+        with span("snapshot_load"):
+            try:
+                snapshot = SnapshotReader(snapshot_path)
+            except ValueError as err:
+                # 以前の形式のファイルは、今回の取得結果で作り直す(通知はしない)
+                logger.warning("{}, recreating it".format(err))
+    if snapshot is not None:
+        with snapshot, span("diff", rows=len(data_list_from_spreadsheet)):
+            (
+                data_list_update_old,
+                data_list_update_new,
+                data_list_added,
+                data_list_removed,
+            ) = diff_lists_by_snapshot(snapshot, data_list_from_spreadsheet)
+
+        with span("message") as message_span:
+            message_list = create_message_list(
+                data_list_update_old,
+                data_list_update_new,
+                data_list_added,
+                data_list_removed,
+                webhook_url=webhook_url,
+            )
+            message_span.rows = len(message_list)
+        with span("dispatch"):
+            result_list = DiscordWebhookDispatcher().dispatch(pack_messages(message_list))
+        failed_count = sum(not result.success for result in result_list)
+        if failed_count > 0:
+            logger.warning("Failed sending {} messages".format(failed_count))
+    else:
+        logger.debug("No snapshot file, creating {}".format(snapshot_path))
+
+    # 送信が終わってから、今回の取得結果で置き換える
+    with span("snapshot_write", rows=len(data_list_from_spreadsheet)):
+        write_snapshot(snapshot_path, data_list_from_spreadsheet)
+    for fetch_result in fetch_result_list:
+        fetcher.save(fetch_result)
+
+
+def main_drain():
+    """
+    アウトボックスの送信待ちのメッセージだけを送信する
+    スクレイピングとは別のスケジュールで実行できる
+    """
+    storage = create_storage()
+    # DBに接続し、テーブルを作成|存在確認
+    with storage.session() as connection:
+        storage.ensure_outbox(connection, g.OUTBOX_TABLE_NAME)
+        # アウトボックスのメッセージを送信する
+        drain_outbox(connection, g.OUTBOX_TABLE_NAME)
 
 
 def main_verify():
@@ -78,70 +388,188 @@ def main_verify():
     # 環境変数を読み込む
     load_env()
 
-    # スプレッドシートのpubhtmlのデータを取得
-    data_list_from_spreadsheet = get_spreadsheet_data_list(g.TARGET_URL)
+    # スプレッドシートのpubhtmlのデータを取得(受信しながらパースするので取得とパースをまとめて計測)
+    with span("fetch_parse") as fetch_parse_span:
+        data_list_from_spreadsheet = get_spreadsheet_data_list(g.TARGET_URL)
+        fetch_parse_span.rows = len(data_list_from_spreadsheet)
 
-    # MySQLサーバーに接続
-    connection = connect_to_mysql_server(g.HOST_NAME, g.USER_NAME, g.PASSWORD)
-    # DBを作成|存在確認
-    create_or_check_database(connection, g.DB_NAME)
-    # DBを選択
-    execute_query(connection, "USE {}".format(g.DB_NAME))
+    # DBに接続
+    storage = create_storage()
+    connection = storage.connect()
     # テーブルを作成|存在確認
-    create_or_check_table(connection, g.TABLE_NAME_TEST)
-    # 既存のデータを削除
-    execute_query(
-        connection,
-        "DELETE FROM {}".format(g.TABLE_NAME_TEST),
-        success_message="Success reset table data",
-        error_message="Failed reset table data",
-    )
-    # 実際のテーブルのデータをコピー
-    execute_query(
-        connection,
-        "INSERT INTO {} SELECT * FROM {};".format(g.TABLE_NAME_TEST, g.TABLE_NAME),
-        success_message="Success copying table",
-        error_message="Failed copying table",
-    )
+    storage.ensure_schema(connection, g.TABLE_NAME_TEST, history=False)
+    # 既存のデータを削除し、実際のテーブルのデータをコピー(fingerprintも計算する)
+    storage.copy_table(connection, g.TABLE_NAME, g.TABLE_NAME_TEST)
     # テーブルのデータを表示
-    data_list_from_db = read_data_from_db(connection, g.TABLE_NAME_TEST)
+    with span("db_read") as db_read_span:
+        data_list_from_db = storage.read(connection, g.TABLE_NAME_TEST)
+        db_read_span.rows = len(data_list_from_db)
     # DBとスプレッドシートのデータを比較し、差分のリストを取得
-    (
-        data_list_update_old,
+    with span("diff", rows=len(data_list_from_spreadsheet)):
+        (
+            data_list_update_old,
+            data_list_update_new,
+            data_list_added,
+            data_list_removed,
+        ) = diff_lists_from_data_lists(data_list_from_spreadsheet, data_list_from_db)
+
+    # DBの更新、追加、削除を1つのトランザクションで行う
+    storage.write_diff(
+        connection,
+        g.TABLE_NAME_TEST,
         data_list_update_new,
-        data_list_added,
         data_list_removed,
-    ) = diff_lists_from_data_lists(data_list_from_spreadsheet, data_list_from_db)
-
-    # DBの更新、追加、削除
-    update_data_to_db(connection, g.TABLE_NAME_TEST, data_list_update_new)
-    delete_data_from_db(connection, g.TABLE_NAME_TEST, data_list_removed)
-    insert_data_to_db(connection, g.TABLE_NAME_TEST, data_list_added)
+        data_list_added,
+        history=False,
+    )
     # WEBHOOKを利用してdiffを送信
-    message_list = create_message_list(
-        data_list_update_old,
+    with span("message") as message_span:
+        message_list = create_message_list(
+            data_list_update_old,
+            data_list_update_new,
+            data_list_added,
+            data_list_removed,
+            webhook_url=g.WEBHOOK_URL,
+        )
+        message_span.rows = len(message_list)
+    # embedを上限までまとめ、レート制限に従って送信する
+    with span("dispatch"):
+        DiscordWebhookDispatcher().dispatch(pack_messages(message_list))
+
+    # DBとの接続を切断
+    connection.close()
+
+
+def main_dry_run():
+    """
+    本番のテーブルを変更せずに、実行した場合の結果を確認する
+    テーブルはコピーせず、読み取り専用のトランザクション内で本番のテーブルと比較する(最後に必ずロールバック)
+    実行されるはずのSQLとwebhookのペイロードをDRY_RUN_SQL_PATH/DRY_RUN_PAYLOAD_PATHに書き込み、
+    ペイロードはWEBHOOK_URL_TESTにだけ送信する
+    """
+    # スプレッドシートのデータを取得(取得結果の保存はしない)
+    with span("fetch_parse") as fetch_parse_span:
+        data_list_from_spreadsheet = get_spreadsheet_data_list(g.TARGET_URL)
+        fetch_parse_span.rows = len(data_list_from_spreadsheet)
+
+    # DBに接続(テーブルの作成などはしない)
+    storage = create_storage()
+    with storage.session() as connection:
+        # DBとスプレッドシートのデータを読み取り専用のトランザクション内で比較し、差分のリストを取得
+        (
+            data_list_update_old,
+            data_list_update_new,
+            data_list_added,
+            data_list_removed,
+        ) = storage.diff_read_only(connection, g.TABLE_NAME, data_list_from_spreadsheet)
+
+    # 本番と同じURL宛てのメッセージを作成し、embedを上限までまとめる
+    with span("message") as message_span:
+        message_list = pack_messages(
+            create_message_list(
+                data_list_update_old,
+                data_list_update_new,
+                data_list_added,
+                data_list_removed,
+                webhook_url=g.WEBHOOK_URL,
+            )
+        )
+        message_span.rows = len(message_list)
+    outbox_list = create_outbox_list(message_list)
+    # 実行されるはずのSQLとペイロードを書き込む
+    statements = create_diff_statements(
+        g.TABLE_NAME,
         data_list_update_new,
-        data_list_added,
         data_list_removed,
-        webhook_url=g.WEBHOOK_URL,
+        data_list_added,
+        outbox_table_name=g.OUTBOX_TABLE_NAME,
+        outbox_list=outbox_list,
+        history_table_name=HISTORY_TABLE_FORMAT.format(g.TABLE_NAME),
+    )
+    # (STORAGE_BACKENDのDB向けのSQLにする)
+    with open(g.DRY_RUN_SQL_PATH, "w", encoding="utf-8") as f:
+        for sql in storage.render_statements(statements):
+            f.write(sql + "\n")
+    with open(g.DRY_RUN_PAYLOAD_PATH, "w", encoding="utf-8") as f:
+        json.dump(
+            [
+                {"webhook_url": webhook_url, "payload": json.loads(payload)}
+                for webhook_url, payload in outbox_list
+            ],
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    logger.debug(
+        "Wrote {} statements to {} and {} payloads to {}".format(
+            len(statements), g.DRY_RUN_SQL_PATH, len(outbox_list), g.DRY_RUN_PAYLOAD_PATH
+        )
     )
-    for message in message_list:
-        message.post()
 
-    # MySQLサーバーとの接続を切断
-    connection.close()
+    # ペイロードはテスト用のURLにだけ送信する
+    dispatcher = DiscordWebhookDispatcher()
+    with span("dispatch"):
+        for _, payload in outbox_list:
+            dispatcher.send_payload(g.WEBHOOK_URL_TEST, payload)
+
+
+# 計測結果をファイルに書き込む
+def export_metrics(metrics_path: str = None, profile_dir: str = None):
+    metrics = get_metrics()
+    try:
+        if metrics_path is not None:
+            metrics.write(metrics_path)
+        if profile_dir is not None:
+            metrics.write_profile(profile_dir)
+    except Exception as err:
+        # 計測結果を書き込めなくても本来の処理は失敗させない
+        logger.warning("Failed writing metrics: '{}'".format(err))
+
+
+# オプションの値を返す(指定されていなければdefault)
+def option_value(args: list[str], name: str, default=None):
+    if name in args and args.index(name) + 1 < len(args):
+        return args[args.index(name) + 1]
+    return default
 
 
 if __name__ == "__main__":
-    logger = setup_logger(__name__)
-    load_env()
-    urllib3_cn.allowed_gai_family = allowed_gai_family4
+    args = sys.argv[1:]
+    # --snapshotはDBを使わないので、MySQLの接続情報がなくても実行できる
+    load_env(use_db="--snapshot" not in args)
+    # --metrics <path>: 計測結果の書き込み先(.promの場合はPrometheusのテキスト形式、それ以外はJSON)
+    # --profile: 段階ごとのcProfileとtracemallocのレポートをPROFILE_DIRに書き込む
+    # --serve: --watchと一緒に指定すると、読み取り用のHTTP/JSON APIを公開する
+    metrics_path = option_value(args, "--metrics", g.METRICS_PATH)
+    profile_dir = g.PROFILE_DIR if "--profile" in args else None
+    set_metrics(Metrics(profile=profile_dir is not None, top_n=g.PROFILE_TOP_N))
     try:
-        if len(sys.argv) >= 2 and sys.argv[1] == "--verify":
+        if "--verify" in args:
             logger.debug("---START verify mode---")
             main_verify()
             logger.debug("---END verify mode---")
-        elif len(sys.argv) >= 2 and sys.argv[1] == "--test":
+        elif "--dry-run" in args:
+            logger.debug("---START dry-run mode---")
+            main_dry_run()
+            logger.debug("---END dry-run mode---")
+        elif "--watch" in args:
+            logger.debug("---START watch mode---")
+            main_watch(
+                g.TABLE_NAME,
+                g.WEBHOOK_URL,
+                export_metrics=lambda: export_metrics(metrics_path, profile_dir),
+                serve="--serve" in args,
+            )
+            logger.debug("---END watch mode---")
+        elif "--snapshot" in args:
+            logger.debug("---START snapshot mode---")
+            main_snapshot(g.TABLE_NAME, g.WEBHOOK_URL)
+            logger.debug("---END snapshot mode---")
+        elif "--drain" in args:
+            logger.debug("---START drain mode---")
+            main_drain()
+            logger.debug("---END drain mode---")
+        elif "--test" in args:
             logger.debug("---START test mode---")
             print("Table name: ", g.TABLE_NAME_TEST)
             print("Webhook URL: ", g.WEBHOOK_URL_TEST)
@@ -152,3 +580,5 @@ if __name__ == "__main__":
     except Exception as e:
         logger.error(e)
         sys.exit(1)
+    finally:
+        export_metrics(metrics_path, profile_dir)
@@ -1,5 +1,56 @@
+from dataclasses import dataclass
+
 from model.models import Color, DiscordRequestMainContent, SpreadsheetData
 from discord_utils.discord_message_sender import *
+from scraping.liquipedia import LiquipediaEnrichmentExecutor, LiquipediaScraper
+from scraping.liquipedia_cache import LiquipediaProfileCache
+from utils.metrics import span
+from utils.utils import setup_logger
+
+logger = setup_logger(__name__)
+
+
+@dataclass
+class MessageDescriptor:
+    """作成するメッセージのクラスと引数(Liquipediaの情報は含まない)"""
+
+    message_class: type
+    args: dict
+    player_name: str
+
+    # Liquipediaの情報を埋め込んでメッセージを作成する
+    # 埋め込みに失敗した場合はプロフィールなしのメッセージを作成する
+    def build(self, liquipedia_scraper: LiquipediaScraper) -> DiscordMessageSender:
+        try:
+            return self.message_class(**self.args, liquipedia_scraper=liquipedia_scraper)
+        except Exception as e:
+            logger.warning(
+                "Failed to embed the profile of {}: '{}'".format(self.player_name, e)
+            )
+            return self.message_class(
+                **self.args,
+                liquipedia_scraper=LiquipediaScraper.unavailable(self.player_name),
+            )
+
+
+# 選手ごとに1回だけLiquipediaの情報を取得し、メッセージを作成する
+def resolve_message_list(
+    descriptor_list: list[MessageDescriptor],
+    enrichment_executor: LiquipediaEnrichmentExecutor = None,
+) -> list[DiscordMessageSender]:
+    if enrichment_executor is None:
+        enrichment_executor = LiquipediaEnrichmentExecutor(
+            cache=LiquipediaProfileCache()
+        )
+    player_names = list(
+        dict.fromkeys(descriptor.player_name for descriptor in descriptor_list)
+    )
+    with span("enrichment", rows=len(player_names)):
+        scrapers = enrichment_executor.enrich(player_names)
+    return [
+        descriptor.build(scrapers[descriptor.player_name])
+        for descriptor in descriptor_list
+    ]
 
 # 差分を取り、team_name, end_date, roster_status, roleの変更のみ告知する
 def create_message_list(
@@ -7,9 +58,11 @@ def create_message_list(
     data_list_update_new: list[SpreadsheetData],
     data_list_added: list[SpreadsheetData],
     data_list_removed: list[SpreadsheetData],
-    webhook_url: str
+    webhook_url: str,
+    enrichment_executor: LiquipediaEnrichmentExecutor = None,
 ):
-    message_list: list[DiscordMessageSender] = []
+    # 作成するメッセージのリスト(Liquipediaの情報は最後にまとめて取得する)
+    descriptor_list: list[MessageDescriptor] = []
 
     # updateされたデータをmessage_listに追加
     for index in range(len(data_list_update_new)):
@@ -17,33 +70,46 @@ def create_message_list(
             break
         data_new = data_list_update_new[index]
         data_old = data_list_update_old[index]
+        update_args = dict(old_data=data_old, new_data=data_new, webhook_url=webhook_url)
         if data_new.team_name != data_old.team_name:
-            message_list.append(DiscordTeamUpdatedMessageSender(
-                old_data=data_old, new_data=data_new, webhook_url=webhook_url
-            ))
+            descriptor_list.append(
+                MessageDescriptor(
+                    DiscordTeamUpdatedMessageSender, update_args, data_new.handle_name
+                )
+            )
         elif data_new.end_date != data_old.end_date:
-            message_list.append(DiscordEndDateUpdatedMessageSender(
-                old_data=data_old, new_data=data_new,webhook_url=webhook_url
-            ))
+            descriptor_list.append(
+                MessageDescriptor(
+                    DiscordEndDateUpdatedMessageSender, update_args, data_new.handle_name
+                )
+            )
         elif data_new.roster_status != data_old.roster_status:
-            message_list.append(DiscordRosterUpdatedMessageSender(
-                old_data=data_old, new_data=data_new, webhook_url=webhook_url
-            ))
+            descriptor_list.append(
+                MessageDescriptor(
+                    DiscordRosterUpdatedMessageSender, update_args, data_new.handle_name
+                )
+            )
         elif data_new.role != data_old.role:
-            message_list.append(DiscordRoleUpdatedMessageSender(
-                old_data=data_old, new_data=data_new, webhook_url=webhook_url
-            ))
+            descriptor_list.append(
+                MessageDescriptor(
+                    DiscordRoleUpdatedMessageSender, update_args, data_new.handle_name
+                )
+            )
 
     # 削除されたデータをmessage_listに追加
     for data in data_list_removed:
-        message_list.append(DiscordDeletedMessageSender(
-            data=data, webhook_url=webhook_url
+        descriptor_list.append(MessageDescriptor(
+            DiscordDeletedMessageSender,
+            dict(data=data, webhook_url=webhook_url),
+            data.handle_name,
         ))
 
     # 追加されたデータをmessage_listに追加
     for data in data_list_added:
-        message_list.append(DiscordAddedMessageSender(
-            data=data, webhook_url=webhook_url
+        descriptor_list.append(MessageDescriptor(
+            DiscordAddedMessageSender,
+            dict(data=data, webhook_url=webhook_url),
+            data.handle_name,
         ))
 
-    return message_list
+    return resolve_message_list(descriptor_list, enrichment_executor)
@@ -0,0 +1,64 @@
+# 契約の変更履歴を検索する
+# 使い方:
+#   python3 -m misc.history_query changes --since 2026-10-01 [--until 2026-10-08]
+#   python3 -m misc.history_query player <handle_name> [--at 2026-06-15]
+# 時刻はUTC(タイムゾーン付きで指定した場合はUTCに変換する)
+
+import argparse
+import datetime
+
+import conf.global_values as g
+from conf.settings import load_env
+from db.storage import create_storage
+from db.history import read_changes, read_player_at, read_player_history
+from model.models import HistoryRecord
+
+
+def parse_time(value: str) -> datetime.datetime:
+    time = datetime.datetime.fromisoformat(value)
+    if time.tzinfo is not None:
+        time = time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return time
+
+
+def show_history(history_list: list[HistoryRecord]):
+    if history_list == []:
+        print("No history")
+        return
+    for history in history_list:
+        valid_to = history.valid_to.isoformat(" ") if history.valid_to else "now"
+        print(
+            "{} - {}\t{}\t{}".format(
+                history.valid_from.isoformat(" "),
+                valid_to,
+                history.change_type,
+                history.data.values(),
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--table", default=g.TABLE_NAME)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    changes_parser = subparsers.add_parser("changes", help="期間内の変更")
+    changes_parser.add_argument("--since", type=parse_time, required=True)
+    changes_parser.add_argument("--until", type=parse_time)
+    player_parser = subparsers.add_parser("player", help="選手ごとの履歴")
+    player_parser.add_argument("handle_name")
+    player_parser.add_argument("--at", type=parse_time, help="この時点で有効だった契約")
+    args = parser.parse_args()
+
+    load_env()
+    with create_storage().session() as session:
+        if args.command == "changes":
+            history_list = read_changes(session, args.table, args.since, args.until)
+        elif args.at is not None:
+            history_list = read_player_at(session, args.table, args.handle_name, args.at)
+        else:
+            history_list = read_player_history(session, args.table, args.handle_name)
+    show_history(history_list)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,65 +2,61 @@
 # 現在はクラスのメンバとして保存する際にnormalize_unicodeしているので不要
 # おそらく今後使うことはないがいちおう残しておく
 
-import os
-from dotenv import load_dotenv
-from model.models import normalize_unicode
-from main import (
-    create_or_check_table,
-    read_data_from_db,
-    connect_to_mysql_server,
-    insert_data_to_db,
+from conf.settings import load_env
+from db.db_access import (
     execute_query,
+    row_values,
+    COLUMNS,
+    INSERT_QUERY_FORMAT,
 )
+from db.storage import Storage, create_storage
+from utils.utils import setup_logger
+
+logger = setup_logger(__name__)
 
 
 # すべてのレコードのfirst_name, family_nameを正規化する
-def normalize_records(connection, table_name):
-    data_list_from_db = read_data_from_db(connection=connection, table_name=table_name)
-    for record in data_list_from_db:
-        record.first_name = normalize_unicode(record.first_name)
-        record.family_name = normalize_unicode(record.family_name)
-    return data_list_from_db
+# (SpreadsheetDataは作成時に正規化するので、読み込むだけでよい)
+def normalize_records(storage: Storage, connection, table_name):
+    return storage.read(connection, table_name)
 
 
 # 現状first_name, family_nameは主キーなので単純に更新できない
 # 強引だが、VCTContractsTableのデータをすべて削除して置換する
 def main():
     # 環境変数を読み込む
-    load_dotenv()
-    HOST_NAME = os.getenv("HOST_NAME")
-    USER_NAME = os.getenv("USER_NAME")
-    PASSWORD = os.getenv("PASSWORD")
+    load_env()
     TABLE_NAME = "VCTContractsTable"
     TABLE_NAME_OLD = "VCTContractsTable_old"
-    DB_NAME = "VCTContractsDB"
-    # MySQLサーバーに接続
-    connection = connect_to_mysql_server(HOST_NAME, USER_NAME, PASSWORD)
-    # DBを選択
-    execute_query(connection, "USE {}".format(DB_NAME))
-    # コピー先テーブルの作成
-    create_or_check_table(connection, TABLE_NAME_OLD)
-    # VCTContractsTableをVCTContractsTable_oldにコピー
-    execute_query(
-        connection,
-        "INSERT INTO {} SELECT * FROM {};".format(TABLE_NAME_OLD, TABLE_NAME),
-        success_message="Success copying table",
-        error_message="Failed copying table",
-    )
-    # VCTContractsTableのデータを正規化する
-    normalized_records = normalize_records(connection, TABLE_NAME)
-    # VCTContractsTableのデータをすべて削除
-    execute_query(
-        connection,
-        "DELETE FROM {}".format(TABLE_NAME),
-        success_message="Success reset table data",
-        error_message="Failed reset table data",
-    )
-    # 正規化したデータをVCTContractsTableに挿入
-    insert_data_to_db(connection, TABLE_NAME, normalized_records)
-    # MySQLサーバーとの接続を切断
-    connection.close()
-
+    # STORAGE_BACKENDのDBに接続
+    storage = create_storage()
+    with storage.session() as session:
+        # コピー先テーブルの作成
+        storage.ensure_schema(session, TABLE_NAME_OLD, history=False)
+        # VCTContractsTableをVCTContractsTable_oldにコピー
+        execute_query(
+            session,
+            "INSERT INTO {0} ({1}) SELECT {1} FROM {2};".format(
+                TABLE_NAME_OLD, COLUMNS, TABLE_NAME
+            ),
+            success_message="Success copying table",
+            error_message="Failed copying table",
+        )
+        # VCTContractsTableのデータを正規化する
+        normalized_records = normalize_records(storage, session, TABLE_NAME)
+        # VCTContractsTableのデータの削除と正規化したデータの挿入を1つのトランザクションで行う
+        try:
+            with session.transaction() as cursor:
+                cursor.execute("DELETE FROM {}".format(TABLE_NAME))
+                cursor.executemany(
+                    INSERT_QUERY_FORMAT.format(TABLE_NAME),
+                    [row_values(data) for data in normalized_records],
+                )
+            logger.debug("Success replacing table data")
+        except Exception as err:
+            logger.error("Failed replacing table data: '{}'".format(err))
+            exit(1)
+    # DBとの接続はwithを抜けると閉じられる(MySQLの場合はプールに返される)
 
 if __name__ == "__main__":
     main()
@@ -1,6 +1,10 @@
 from enum import Enum
+import datetime
+import hashlib
+import sys
 from utils.utils import normalize_unicode
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional
 
 
 class League(Enum):
@@ -17,7 +21,14 @@ class Color(Enum):
     ADDED = 7935
 
 
-@dataclass
+# 同じ値の文字列をインターンして、行ごとに別の文字列を持たないようにする
+# (DBのNULLはNoneのまま)
+def intern_value(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+# __slots__でインスタンスごとの__dict__を持たないようにし、10万行規模でもメモリを抑える
+@dataclass(slots=True)
 class SpreadsheetData:
     league: League
     team_name: str
@@ -35,6 +46,13 @@ class SpreadsheetData:
         self.first_name = normalize_unicode(self.first_name)
         self.family_name = normalize_unicode(self.family_name)
         self.end_date = int(self.end_date) if self.end_date != "" else 0
+        # 取りうる値の種類が少ない列(リーグ・チーム・ロールなど)
+        self.league = intern_value(self.league)
+        self.team_name = intern_value(self.team_name)
+        self.role = intern_value(self.role)
+        self.resident = intern_value(self.resident)
+        self.roster_status = intern_value(self.roster_status)
+        self.team_tag = intern_value(self.team_tag)
 
     def values(self):
         return [
@@ -51,6 +69,45 @@ class SpreadsheetData:
             self.team_contact_info,
         ]
 
+    # 正規化後の値から計算したハッシュ値(DBのfingerprint列に保存し、変更の有無の判定に使う)
+    def fingerprint(self) -> str:
+        return hashlib.sha1(
+            "\x1f".join(str(value) for value in self.values()).encode("utf-8")
+        ).hexdigest()
+
+
+# 変更履歴の1行(valid_toがNoneの場合は現在も有効)
+@dataclass
+class HistoryRecord:
+    data: SpreadsheetData
+    change_type: str
+    valid_from: datetime.datetime
+    valid_to: Optional[datetime.datetime] = None
+
+
+# Liquipediaの選手ページから取得したプロフィール情報
+@dataclass
+class LiquipediaProfile:
+    name: Optional[str] = None
+    status: Optional[str] = None
+    team: Optional[str] = None
+    born: Optional[str] = None
+    age: Optional[int] = None
+    links: list[tuple[str, str]] = field(default_factory=list)
+    history: list[tuple[str, str]] = field(default_factory=list)
+    image_url: Optional[str] = None
+    description: Optional[str] = None
+    # インフォボックスの"Name:"などの見出しと値の辞書
+    infobox: dict[str, str] = field(default_factory=dict)
+
+    # asdictした辞書(JSONから読み込んだものを含む)から作成する
+    @classmethod
+    def from_dict(cls, data: dict) -> "LiquipediaProfile":
+        data = dict(data)
+        data["links"] = [tuple(link) for link in data["links"]]
+        data["history"] = [tuple(history) for history in data["history"]]
+        return cls(**data)
+
 
 # Discordのリクエストを作成する
 # docs:https://birdie0.github.io/discord-webhooks-guide/discord_webhook.html
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from utils.http_client import get_http_client
+from utils.utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# 取得結果の保存ファイルで、pubhtmlから探したシートのgidを保存するキー(他のキーはURL)
+SHEET_GIDS_KEY = "sheet_gids"
+
+
+@dataclass
+class FetchResult:
+    url: str
+    # 前回処理した内容から変化しているかどうか
+    changed: bool
+    # 変化していない場合はNone
+    text: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    digest: Optional[str] = None
+
+    def state(self):
+        return {
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "digest": self.digest,
+        }
+
+
+# 前回取得時のETag/Last-Modifiedと表部分のダイジェストを保存しておき、
+# 条件付きリクエストで内容が変わっていない場合は本文のパースやDBへの接続を省略できるようにする
+class ConditionalFetcher:
+    REX_TABLE = re.compile(r"<table\b.*?</table>", re.DOTALL | re.IGNORECASE)
+    REX_WHITESPACE = re.compile(r"\s+")
+
+    def __init__(self, state_path: str):
+        self.state_path = state_path
+        self._state = self._load_state()
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as err:
+            # 壊れている場合は保存内容を使わずに取得し直す
+            logger.warning("Failed loading fetch state: '{}'".format(err))
+            return {}
+
+    # 書き込み途中のファイルが残らないよう、一時ファイルに書いてから置き換える
+    def _save_state(self):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._state, f)
+        os.replace(tmp_path, self.state_path)
+
+    # pubhtmlにはリクエストごとに変わるスクリプトなどが含まれるので、表部分だけを正規化してハッシュを取る
+    @classmethod
+    def digest(cls, text: str) -> str:
+        tables = cls.REX_TABLE.findall(text)
+        body = "".join(tables) if tables else text
+        body = cls.REX_WHITESPACE.sub(" ", body)
+        return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+    # 取得に失敗した場合は例外を送出する
+    # ダイジェストが前回と同じ場合はchanged=Falseだが、本文(text)は返す
+    def _get(self, url: str, conditional: bool = True) -> FetchResult:
+        state = self._state.get(url, {})
+        headers = {}
+        if conditional and state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if conditional and state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+        response = get_http_client().get(url, headers=headers)
+        if response.status_code == 304:
+            logger.debug("Not modified (304): {}".format(url))
+            return FetchResult(url=url, changed=False, **state)
+        response.raise_for_status()
+        # charsetが指定されない場合(CSVなど)はUTF-8として読む
+        if "charset" not in response.headers.get("Content-Type", ""):
+            response.encoding = "utf-8"
+        result = FetchResult(
+            url=url,
+            changed=True,
+            text=response.text,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            digest=self.digest(response.text),
+        )
+        if result.digest == state.get("digest"):
+            logger.debug("Content digest is unchanged: {}".format(url))
+            result.changed = False
+        return result
+
+    def fetch(self, url: str) -> FetchResult:
+        try:
+            result = self._get(url)
+        except Exception as err:
+            logger.error("Error: '{}'".format(err))
+            exit(1)
+        if not result.changed and result.text is not None:
+            # 本文は変わっていないので、ヘッダーだけ更新して次回の条件付きリクエストに使う
+            result.text = None
+            self.save(result)
+        return result
+
+    # 複数のURL(シートごとのCSVなど)を並行して条件付きで取得する
+    # どれかが変化していれば、すべての本文が必要なので304だったものは条件なしで取得し直す
+    # どれも変化していなければtextはNoneになる。取得に失敗した場合は例外を送出する
+    def fetch_many(self, urls: list[str], max_workers: int = None) -> list[FetchResult]:
+        with ThreadPoolExecutor(max_workers=max_workers or len(urls)) as executor:
+            results = list(executor.map(self._get, urls))
+            if not any(result.changed for result in results):
+                for result in results:
+                    if result.text is not None:
+                        result.text = None
+                        self.save(result)
+                return results
+            return list(
+                executor.map(
+                    lambda result: result
+                    if result.text is not None
+                    else self._get(result.url, conditional=False),
+                    results,
+                )
+            )
+
+    # 保存してあるシートのgid(ないかttl秒を過ぎた場合はNone)
+    def load_sheet_gids(self, url: str, ttl: float) -> Optional[list[str]]:
+        entry = self._state.get(SHEET_GIDS_KEY, {}).get(url)
+        if entry is None or time.time() - entry["discovered_at"] > ttl:
+            return None
+        return entry["gids"]
+
+    # pubhtmlから探したシートのgidを保存する(次回以降はpubhtmlを取得しない)
+    def save_sheet_gids(self, url: str, gids: list[str]):
+        self._state.setdefault(SHEET_GIDS_KEY, {})[url] = {
+            "gids": gids,
+            "discovered_at": time.time(),
+        }
+        try:
+            self._save_state()
+        except Exception as err:
+            logger.warning("Failed saving fetch state: '{}'".format(err))
+
+    # シートが削除された場合などに、次回はpubhtmlから探し直す
+    def clear_sheet_gids(self, url: str):
+        if self._state.get(SHEET_GIDS_KEY, {}).pop(url, None) is not None:
+            try:
+                self._save_state()
+            except Exception as err:
+                logger.warning("Failed saving fetch state: '{}'".format(err))
+
+    # パイプラインの処理が最後まで成功してから呼び出す
+    # (途中で失敗した場合は次回も変化ありとして処理し直す)
+    def save(self, result: FetchResult):
+        self._state[result.url] = result.state()
+        try:
+            self._save_state()
+        except Exception as err:
+            logger.warning("Failed saving fetch state: '{}'".format(err))
@@ -1,131 +1,153 @@
-import requests
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import asdict
 
+import conf.global_values as g
 from utils.utils import setup_logger
-import time, re, datetime
-from typing import Optional
+from utils.rate_limiter import TokenBucket
+from utils.http_client import get_http_client
+from scraping.liquipedia_cache import LiquipediaProfileCache
+from scraping.liquipedia_extractor import extract_profile
+from model.models import LiquipediaProfile
+import re, datetime, threading
+from typing import Iterable, Optional
 
 logger = setup_logger(__name__)
 
+# Liquipediaへのリクエストはすべてこのレートリミッタを通す(スレッド間で共有)
+LIQUIPEDIA_RATE_LIMITER = TokenBucket(
+    rate=g.LIQUIPEDIA_REQUESTS_PER_SECOND, capacity=g.LIQUIPEDIA_BURST
+)
+
 
 class LiquipediaScraper:
     LIQUIPEDIA_URL_FORMAT = "https://liquipedia.net/valorant/{}"
+    # Liquipediaの利用規約に従い、連絡先のわかるUser-Agentを指定する
+    # (gzipはHTTPクライアントが要求する)
+    HEADERS = {
+        "User-Agent": "VCTGlobalContract (https://github.com/kasatomorning/VCTGlobalContract)",
+    }
     REX_BIRTH_DATE = re.compile(r"[a-zA-Z]+ [0-9]+, [0-9]+")
-    REX_AGE = re.compile(r"age.([0-9]+)")
-    REX_LINK_TYPE = re.compile(r"lp-(.+)")
 
-    def __init__(self, player_name):
+    def __init__(
+        self,
+        player_name,
+        rate_limiter: TokenBucket = None,
+        url_format: str = None,
+        cache: LiquipediaProfileCache = None,
+    ):
+        if rate_limiter is None:
+            rate_limiter = LIQUIPEDIA_RATE_LIMITER
+        if url_format is None:
+            url_format = LiquipediaScraper.LIQUIPEDIA_URL_FORMAT
+        # 取得できなかった場合はNone
+        self.profile: Optional[LiquipediaProfile] = None
+
+        # キャッシュが有効期間内であれば通信もパースもしない
+        entry = cache.get(player_name) if cache is not None else None
+        # 前回ページを取得できなかった選手は、有効期間内であれば取得できなかったものとして扱う
+        if entry is not None and entry["data"] is None:
+            if cache.is_fresh(entry):
+                cache.count_hit()
+                return
+            entry = None
+        cached_profile = self._load_cache_data(entry)
+        if cached_profile is None:
+            entry = None
+        if entry is not None and cache.is_fresh(entry):
+            cache.count_hit()
+            self.profile = cached_profile
+            return
+
         # liquipediaからページを取得
         try:
-            self.request_url = LiquipediaScraper.LIQUIPEDIA_URL_FORMAT.format(
-                player_name
-            )
-            self.response = requests.get(self.request_url)
+            self.request_url = url_format.format(player_name)
+            headers = dict(self.HEADERS)
+            # 有効期間が過ぎたキャッシュがあれば条件付きリクエストで再検証する
+            if entry is not None and entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry is not None and entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+            rate_limiter.acquire()
+            self.response = get_http_client().get(self.request_url, headers=headers)
+            if self.response.status_code == 304 and entry is not None:
+                cache.touch(player_name)
+                cache.count_revalidation()
+                self.profile = cached_profile
+                return
+            if cache is not None:
+                cache.count_miss()
+                # ページがない場合など(レート制限の429を除く)は、取得できなかったことを保存する
+                if (
+                    self.response.status_code >= 400
+                    and self.response.status_code != 429
+                    and cached_profile is None
+                ):
+                    cache.put(player_name, None)
             self.response.raise_for_status()
-            self.soup = BeautifulSoup(self.response.content, features="html.parser")
+            # <head>のmetaタグとインフォボックスだけを1回の走査で読み取る
+            self.profile = extract_profile(self.response.text)
         except Exception as e:
             # liquipediaにアクセスできない場合・ユーザーが存在しない場合などは空文字列を返す
-            self.soup = None
+            # 有効期間が過ぎていてもキャッシュがあればそれを使う
             logger.debug(e)
-        finally:
-            time.sleep(1)
+            self.profile = cached_profile
+            return
 
-        # プロフィール情報を取得して辞書を作成
+        if cache is not None:
+            cache.put(
+                player_name,
+                asdict(self.profile),
+                etag=self.response.headers.get("ETag"),
+                last_modified=self.response.headers.get("Last-Modified"),
+            )
+
+    # 取得に失敗したものとして扱うLiquipediaScraperを返す(通信しない)
+    @classmethod
+    def unavailable(cls, player_name: str) -> "LiquipediaScraper":
+        scraper = cls.__new__(cls)
+        scraper.profile = None
+        return scraper
+
+    # キャッシュのエントリからプロフィール情報を読み込む(読み込めない場合はNone)
+    @staticmethod
+    def _load_cache_data(entry: Optional[dict]) -> Optional[LiquipediaProfile]:
+        if entry is None:
+            return None
         try:
-            self._profile = {}
-            profile_elements = self.soup.find("div", class_="fo-nttax-infobox")
-            for content in profile_elements.contents:
-                if len(content.contents) >= 2:
-                    self._profile[content.contents[0].get_text()] = content.contents[
-                        1
-                    ].get_text()
+            return LiquipediaProfile.from_dict(entry["data"])
         except Exception as e:
-            self._profile = None
             logger.debug(e)
-        self._links = None
-        self._history = None
-        self._image_url = None
-        self._description = None
+            return None
 
     @property
     def scrape_successfully(self) -> bool:
-        return self.soup is not None
-
-    def get_links(self) -> list[tuple[str, str]]:
-        if self.scrape_successfully and self._links is None:
-            self._links = []
-            tag_name_flag = False
-            player_information = self.soup.find("div", class_="fo-nttax-infobox")
-            if player_information is None:
-                return self._links
-            for info in player_information:
-                if tag_name_flag:
-                    try:
-                        for link_line in info.find_all("a"):
-                            try:
-                                link_type = self.REX_LINK_TYPE.match(link_line.contents[0]["class"][1]).group(1)
-                                self._links.append((link_type, link_line["href"]))
-                            except Exception as e:
-                                self._links.append(("link", link_line["href"]))
-                                logger.debug(e)
-                    except Exception as e:
-                        logger.debug(e)
-                    break
-                try:
-                    if info.contents[0].contents[0].text == 'Links':
-                        tag_name_flag = True
-                except IndexError:
-                    continue
-        return self._links
+        return self.profile is not None
+
+    def get_links(self) -> Optional[list[tuple[str, str]]]:
+        if self.scrape_successfully:
+            return self.profile.links
+        return None
 
     def get_history(self) -> Optional[list[tuple[str, str]]]:
-        if self.scrape_successfully and self._history is None:
-            self._history = []
-            tag_name_flag = False
-            player_information = self.soup.find("div", class_="fo-nttax-infobox")
-            if player_information is None:
-                return self._history
-            for info in player_information:
-                if tag_name_flag:
-                    try:
-                        for history_line in info.find("tbody"):
-                            self._history.append((history_line.contents[0].text, history_line.contents[1].text))
-                    except Exception as e:
-                        logger.debug(e)
-                    break
-                try:
-                    if info.contents[0].contents[0].text == 'History':
-                        tag_name_flag = True
-                except IndexError:
-                    continue
-        return self._history
+        if self.scrape_successfully:
+            return self.profile.history
+        return None
 
     def get_image_url(self) -> Optional[str]:
-        if self.scrape_successfully and self._image_url is None:
-            # パースできなかった場合はNoneが返ってくる
-            url = self.soup.find("meta", attrs={"property": "og:image"})["content"]
-            if "facebook-image.png" in url:  # 画像がデフォルトの場合
-                self._image_url = "https://liquipedia.net/commons/images/a/a4/PlayerImagePlaceholder.png"
-            elif url is None:  # リンクが取得できない場合
-                self._image_url = "https://liquipedia.net/commons/images/a/a4/PlayerImagePlaceholder.png"
-            else:
-                self._image_url = url
-        return self._image_url
+        if self.scrape_successfully:
+            return self.profile.image_url
+        return None
 
     def get_description(self) -> Optional[str]:
-        if self.scrape_successfully and self._description is None:
-            self._description = self.soup.find(
-                "meta", attrs={"property": "og:description"}
-            )["content"]
-            if self._description is None:
-                self._description = ""
-        return self._description
+        if self.scrape_successfully:
+            return self.profile.description
+        return None
 
     def get_birth_date(self) -> Optional[datetime.date]:
-        if self.scrape_successfully and "Born:" in self._profile:
+        if self.scrape_successfully and self.profile.born is not None:
             try:
                 return datetime.datetime.strptime(
-                    self.REX_BIRTH_DATE.search(self._profile["Born:"]).group(),
+                    self.REX_BIRTH_DATE.search(self.profile.born).group(),
                     "%B %d, %Y",
                 ).date()
             except Exception as e:
@@ -133,28 +155,104 @@ class LiquipediaScraper:
         return None
 
     def get_age(self) -> Optional[int]:
-        if self.scrape_successfully and "Born:" in self._profile:
-            try:
-                print(self._profile["Born:"])
-                return int(self.REX_AGE.search(self._profile["Born:"]).group(1))
-            except Exception as e:
-                logger.debug(e)
+        if self.scrape_successfully:
+            return self.profile.age
         return None
 
     def get_status(self) -> Optional[str]:
-        if self.scrape_successfully and "Status:" in self._profile:
-            return self._profile["Status:"]
-        else:
-            return None
+        if self.scrape_successfully:
+            return self.profile.status
+        return None
 
     def get_name(self) -> Optional[str]:
-        if self.scrape_successfully and "Name:" in self._profile:
-            return self._profile["Name:"]
-        else:
-            return None
+        if self.scrape_successfully:
+            return self.profile.name
+        return None
 
     def get_team(self) -> Optional[str]:
-        if self.scrape_successfully and "Team:" in self._profile:
-            return self._profile["Team:"]
-        else:
-            return None
+        if self.scrape_successfully:
+            return self.profile.team
+        return None
+
+
+class LiquipediaEnrichmentExecutor:
+    """複数の選手のLiquipediaのページを並行して取得する
+
+    リクエストの間隔は共有のレートリミッタで制御し、同時に取得するページ数はmax_workersで制限する
+    """
+
+    def __init__(
+        self,
+        max_workers: int = None,
+        rate_limiter: TokenBucket = None,
+        url_format: str = None,
+        cache: LiquipediaProfileCache = None,
+    ):
+        self.max_workers = max_workers or g.LIQUIPEDIA_MAX_WORKERS
+        self.rate_limiter = rate_limiter or LIQUIPEDIA_RATE_LIMITER
+        self.url_format = url_format
+        self.cache = cache
+
+    def _save_cache_when_done(self, futures):
+        if self.cache is None:
+            return
+        lock = threading.Lock()
+        remaining = [len(futures)]
+
+        def on_done(future):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            self.cache.save()
+            logger.debug("Saved Liquipedia cache after timed-out fetches finished")
+
+        for future in futures:
+            future.add_done_callback(on_done)
+
+    # 選手名ごとのLiquipediaScraperの辞書を返す(同じ選手名は1回だけ取得する)
+    # timeout秒以内に取得できなかった選手・取得中に例外が発生した選手は取得に失敗したものとして扱う
+    def enrich(
+        self, player_names: Iterable[str], timeout: float = None
+    ) -> dict[str, LiquipediaScraper]:
+        if timeout is None:
+            timeout = g.LIQUIPEDIA_ENRICHMENT_TIMEOUT
+        player_names = list(dict.fromkeys(player_names))
+        if player_names == []:
+            return {}
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = {
+            player_name: executor.submit(
+                LiquipediaScraper,
+                player_name,
+                rate_limiter=self.rate_limiter,
+                url_format=self.url_format,
+                cache=self.cache,
+            )
+            for player_name in player_names
+        }
+        _, not_done = wait(futures.values(), timeout=timeout)
+        # 間に合わなかった取得は待たずに打ち切る(実行中のものは裏で終わらせる)
+        executor.shutdown(wait=False, cancel_futures=True)
+        if not_done:
+            logger.warning(
+                "Liquipedia enrichment timed out for {} player(s)".format(len(not_done))
+            )
+            # 裏で終わった取得の結果も失わないよう、すべて終わった時点でもう一度キャッシュを保存する
+            # (実行中のスレッドはプロセスの終了前に待たれるので、1回だけ実行する場合も保存される)
+            self._save_cache_when_done(not_done)
+
+        scraper_dict = {}
+        for player_name, future in futures.items():
+            if future in not_done:
+                scraper_dict[player_name] = LiquipediaScraper.unavailable(player_name)
+                continue
+            try:
+                scraper_dict[player_name] = future.result()
+            except Exception as e:
+                logger.warning("Failed to enrich {}: '{}'".format(player_name, e))
+                scraper_dict[player_name] = LiquipediaScraper.unavailable(player_name)
+        if self.cache is not None:
+            self.cache.save()
+            logger.debug("Liquipedia cache: {}".format(self.cache.stats()))
+        return scraper_dict
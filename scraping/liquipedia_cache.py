@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import conf.global_values as g
+from utils.utils import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class LiquipediaProfileCache:
+    """選手名をキーにLiquipediaのプロフィール情報を保存するディスク上のキャッシュ
+
+    エントリごとに取得時刻を持ち、ttl秒を過ぎたものはETag/Last-Modifiedで再検証する。
+    ページを取得できなかった選手はdataをNoneとして保存し、negative_ttl秒の間は取得し直さない。
+    max_entriesを超えた場合は最後に参照されてから最も時間が経ったものから削除する(LRU)。
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        ttl: float = None,
+        max_entries: int = None,
+        negative_ttl: float = None,
+    ):
+        self.path = path or g.LIQUIPEDIA_CACHE_PATH
+        self.ttl = g.LIQUIPEDIA_CACHE_TTL if ttl is None else ttl
+        self.negative_ttl = (
+            g.LIQUIPEDIA_NEGATIVE_CACHE_TTL if negative_ttl is None else negative_ttl
+        )
+        self.max_entries = max_entries or g.LIQUIPEDIA_CACHE_MAX_ENTRIES
+        # ヒット数(通信なし)、再検証数(304で再利用)、ミス数(ページを取得してパース)
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, dict] = self._load()
+
+    def _load(self) -> OrderedDict:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                # 保存時の順序(参照が古い順)を保持する
+                return OrderedDict(json.load(f))
+        except FileNotFoundError:
+            return OrderedDict()
+        except Exception as err:
+            logger.warning("Failed loading Liquipedia cache: '{}'".format(err))
+            return OrderedDict()
+
+    # エントリを返し、参照順を更新する。存在しない場合はNone
+    def get(self, player_name: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(player_name)
+            if entry is not None:
+                self._entries.move_to_end(player_name)
+            return entry
+
+    def is_fresh(self, entry: dict) -> bool:
+        ttl = self.ttl if entry["data"] is not None else self.negative_ttl
+        return time.time() - entry["fetched_at"] < ttl
+
+    # dataがNoneの場合は取得できなかったことを保存する
+    def put(
+        self,
+        player_name: str,
+        data: Optional[dict],
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ):
+        with self._lock:
+            self._entries[player_name] = {
+                "data": data,
+                "etag": etag,
+                "last_modified": last_modified,
+                "fetched_at": time.time(),
+            }
+            self._entries.move_to_end(player_name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # 再検証で変更がなかった場合に取得時刻だけを更新する
+    def touch(self, player_name: str):
+        with self._lock:
+            entry = self._entries.get(player_name)
+            if entry is not None:
+                entry["fetched_at"] = time.time()
+
+    def count_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def count_revalidation(self):
+        with self._lock:
+            self.revalidations += 1
+
+    def count_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "revalidations": self.revalidations,
+                "misses": self.misses,
+            }
+
+    # 書き込み途中のファイルが残らないよう、一時ファイルに書いてから置き換える
+    def save(self):
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self._entries, f)
+                os.replace(tmp_path, self.path)
+            except Exception as err:
+                logger.warning("Failed saving Liquipedia cache: '{}'".format(err))
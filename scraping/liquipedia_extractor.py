@@ -0,0 +1,259 @@
+import re
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+
+from model.models import LiquipediaProfile
+from utils.utils import setup_logger
+
+logger = setup_logger(__name__)
+
+INFOBOX_CLASS = "fo-nttax-infobox"
+PLACEHOLDER_IMAGE_URL = (
+    "https://liquipedia.net/commons/images/a/a4/PlayerImagePlaceholder.png"
+)
+REX_AGE = re.compile(r"age.([0-9]+)")
+REX_LINK_TYPE = re.compile(r"lp-(.+)")
+# 終了タグを持たない要素
+VOID_ELEMENTS = frozenset(
+    [
+        "area", "base", "br", "col", "embed", "hr", "img", "input",
+        "link", "meta", "param", "source", "track", "wbr",
+    ]
+)
+
+
+# インフォボックスの見出しと値の辞書などからLiquipediaProfileを作成する
+def create_profile(
+    infobox: dict[str, str],
+    links: list[tuple[str, str]],
+    history: list[tuple[str, str]],
+    image_url: str,
+    description: str,
+) -> LiquipediaProfile:
+    age = None
+    born = infobox.get("Born:")
+    if born is not None:
+        age_match = REX_AGE.search(born)
+        if age_match:
+            age = int(age_match.group(1))
+    # 画像がデフォルトの場合・リンクが取得できない場合はプレースホルダーの画像にする
+    if image_url is None or "facebook-image.png" in image_url:
+        image_url = PLACEHOLDER_IMAGE_URL
+    return LiquipediaProfile(
+        name=infobox.get("Name:"),
+        status=infobox.get("Status:"),
+        team=infobox.get("Team:"),
+        born=born,
+        age=age,
+        links=links,
+        history=history,
+        image_url=image_url,
+        description=description if description is not None else "",
+        infobox=infobox,
+    )
+
+
+class _ExtractionFinished(Exception):
+    pass
+
+
+class _ProfileExtractor(HTMLParser):
+    """<head>のmetaタグとインフォボックスの部分木だけを1回の走査で読み取る
+
+    インフォボックスの直下の要素を行、行の直下の要素をセルとして扱い、
+    セルが2つ以上ある行は1つ目を見出し、2つ目を値とする。
+    見出しが"Links"/"History"の行の次の行からリンク/経歴を取得する。
+    インフォボックスが閉じた時点で残りの文書は読まない。
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.meta: dict[str, str] = {}
+        self.infobox: dict[str, str] = {}
+        self.links: list[tuple[str, str]] = []
+        self.history: list[tuple[str, str]] = []
+        # 開いている要素の数とインフォボックスの開始位置
+        self._depth = 0
+        self._infobox_depth = None
+        # 行ごとの状態
+        self._section = None
+        self._next_section = None
+        self._cells = None
+        self._cell_parts = None
+        # Links行の<a>ごとの状態([href, 種類, 最初の子要素を読んだか])
+        self._link = None
+        # History行の<tr>ごとの状態
+        self._history_depth = None
+        self._history_cells = None
+        self._history_cell_parts = None
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self._depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs)
+
+    def _start(self, tag, attrs):
+        if tag == "meta":
+            attrs = dict(attrs)
+            if attrs.get("property") in ("og:image", "og:description"):
+                self.meta.setdefault(attrs["property"], attrs.get("content"))
+            return
+        if self._infobox_depth is None:
+            if tag == "div":
+                classes = (dict(attrs).get("class") or "").split()
+                if INFOBOX_CLASS in classes:
+                    self._infobox_depth = self._depth
+            return
+        # 開始タグを処理する前の深さで判定する
+        depth = self._depth - self._infobox_depth
+        if depth == 1:
+            self._cells = []
+            self._section = self._next_section
+            self._next_section = None
+        elif depth == 2 and self._cells is not None:
+            self._cell_parts = []
+        if self._section == "Links":
+            self._start_link(tag, attrs)
+        elif self._section == "History":
+            self._start_history(tag, depth)
+
+    def _start_link(self, tag, attrs):
+        if tag == "a":
+            self._link = [dict(attrs).get("href"), None, False]
+        elif self._link is not None and not self._link[2]:
+            # <a>の最初の子要素(<i class="lp-icon lp-twitter">など)のclassから種類を取得
+            self._link[2] = True
+            classes = (dict(attrs).get("class") or "").split()
+            if len(classes) >= 2:
+                link_type_match = REX_LINK_TYPE.match(classes[1])
+                if link_type_match:
+                    self._link[1] = link_type_match.group(1)
+
+    def _start_history(self, tag, depth):
+        if tag == "tr" and self._history_depth is None:
+            self._history_depth = depth
+            self._history_cells = []
+        elif (
+            self._history_depth is not None
+            and depth == self._history_depth + 1
+            and tag in ("td", "th")
+        ):
+            self._history_cell_parts = []
+
+    def handle_endtag(self, tag):
+        if tag in VOID_ELEMENTS:
+            return
+        self._depth -= 1
+        if self._infobox_depth is None:
+            return
+        depth = self._depth - self._infobox_depth
+        if depth == 0:
+            raise _ExtractionFinished()
+        if self._section == "Links" and tag == "a" and self._link is not None:
+            href, link_type, _ = self._link
+            self.links.append((link_type or "link", href))
+            self._link = None
+        if self._section == "History" and self._history_depth is not None:
+            if depth == self._history_depth + 1 and self._history_cell_parts is not None:
+                self._history_cells.append("".join(self._history_cell_parts))
+                self._history_cell_parts = None
+            elif depth == self._history_depth:
+                if len(self._history_cells) >= 2:
+                    self.history.append(
+                        (self._history_cells[0], self._history_cells[1])
+                    )
+                self._history_depth = None
+        if depth == 2 and self._cell_parts is not None:
+            self._cells.append("".join(self._cell_parts))
+            self._cell_parts = None
+        elif depth == 1 and self._cells is not None:
+            self._end_row()
+
+    def _end_row(self):
+        if len(self._cells) >= 2:
+            self.infobox[self._cells[0]] = self._cells[1]
+        if self._cells and self._cells[0] in ("Links", "History"):
+            self._next_section = self._cells[0]
+        self._cells = None
+        self._section = None
+
+    def handle_data(self, data):
+        if self._cell_parts is not None:
+            self._cell_parts.append(data)
+        if self._history_cell_parts is not None:
+            self._history_cell_parts.append(data)
+        # <a>の最初の子が文字列の場合は種類を取得できない
+        if self._link is not None and not self._link[2]:
+            self._link[2] = True
+
+
+def extract_profile(text: str) -> LiquipediaProfile:
+    extractor = _ProfileExtractor()
+    try:
+        extractor.feed(text)
+        extractor.close()
+    except _ExtractionFinished:
+        pass
+    return create_profile(
+        extractor.infobox,
+        extractor.links,
+        extractor.history,
+        extractor.meta.get("og:image"),
+        extractor.meta.get("og:description"),
+    )
+
+
+# ページ全体の木を作成して何度も探索する(比較用の従来の実装)
+def extract_profile_with_beautifulsoup(text: str) -> LiquipediaProfile:
+    soup = BeautifulSoup(text, features="html.parser")
+    infobox = {}
+    links = []
+    history = []
+    player_information = soup.find("div", class_=INFOBOX_CLASS)
+    if player_information is not None:
+        try:
+            for content in player_information.contents:
+                if len(content.contents) >= 2:
+                    infobox[content.contents[0].get_text()] = content.contents[
+                        1
+                    ].get_text()
+        except Exception as e:
+            logger.debug(e)
+        tag_name = None
+        for info in player_information:
+            if tag_name == "Links":
+                for link_line in info.find_all("a"):
+                    try:
+                        link_type = REX_LINK_TYPE.match(
+                            link_line.contents[0]["class"][1]
+                        ).group(1)
+                        links.append((link_type, link_line["href"]))
+                    except Exception:
+                        links.append(("link", link_line["href"]))
+            elif tag_name == "History":
+                try:
+                    for history_line in info.find("tbody"):
+                        history.append(
+                            (history_line.contents[0].text, history_line.contents[1].text)
+                        )
+                except Exception as e:
+                    logger.debug(e)
+            tag_name = None
+            try:
+                if info.contents[0].contents[0].text in ("Links", "History"):
+                    tag_name = info.contents[0].contents[0].text
+            except (AttributeError, IndexError):
+                continue
+    image = soup.find("meta", attrs={"property": "og:image"})
+    description = soup.find("meta", attrs={"property": "og:description"})
+    return create_profile(
+        infobox,
+        links,
+        history,
+        image.get("content") if image is not None else None,
+        description.get("content") if description is not None else None,
+    )
@@ -1,17 +1,39 @@
-import requests
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from typing import Iterable
+import csv
+import io
 import re
 from model.models import SpreadsheetData, League
 from utils.utils import setup_logger
+from utils.http_client import get_http_client
+from scraping.fetcher import ConditionalFetcher
 import conf.global_values as g
 
 logger = setup_logger(__name__)
 
 
-def get_spreadsheet_data_list(url: str) -> list[SpreadsheetData]:
-    try:
-        response = requests.get(url, timeout=10)
-        soup = BeautifulSoup(response.text, "html.parser")
+class SpreadsheetParser:
+    """pubhtmlの本文からSpreadsheetDataのリストを作成するパーサーの基底クラス"""
+
+    CHUNK_SIZE = 64 * 1024
+
+    def parse(self, text: str) -> list[SpreadsheetData]:
+        return self.parse_chunks(
+            text[i : i + self.CHUNK_SIZE] for i in range(0, len(text), self.CHUNK_SIZE)
+        )
+
+    # 本文を分割して受け取る(レスポンスを逐次読み込む場合など)
+    def parse_chunks(self, chunks: Iterable[str]) -> list[SpreadsheetData]:
+        raise NotImplementedError
+
+
+class BeautifulSoupSpreadsheetParser(SpreadsheetParser):
+    """ドキュメント全体の木を作成してからtr/tdを探す(比較用の従来の実装)"""
+
+    def parse(self, text: str) -> list[SpreadsheetData]:
+        soup = BeautifulSoup(text, "html.parser")
         tr_element = soup.find_all("tr")
         data_list = []
         for i in tr_element:
@@ -21,6 +43,190 @@ def get_spreadsheet_data_list(url: str) -> list[SpreadsheetData]:
                 text_list.append(ele.text.rstrip())
             if is_validate_text_list(text_list):
                 data_list.append(format_text_list(text_list))
+        return data_list
+
+    def parse_chunks(self, chunks: Iterable[str]) -> list[SpreadsheetData]:
+        return self.parse("".join(chunks))
+
+
+class _StreamingRowCollector(HTMLParser):
+    LEAGUE_NAMES = frozenset(league.value for league in League)
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.data_list: list[SpreadsheetData] = []
+        # 処理中の行のセルの文字列(行の外・読み飛ばす行ではNone)
+        self._text_list = None
+        # 処理中のセルの文字列の断片(セルの外ではNone)
+        self._cell_parts = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "tr":
+            self._end_row()
+            self._text_list = []
+        elif tag == "td":
+            self._end_cell()
+            if self._text_list is not None:
+                self._cell_parts = []
+
+    def handle_endtag(self, tag):
+        if tag == "td":
+            self._end_cell()
+        elif tag in ("tr", "tbody", "table"):
+            self._end_row()
+
+    def handle_data(self, data):
+        if self._cell_parts is not None:
+            self._cell_parts.append(data)
+
+    def _end_cell(self):
+        if self._cell_parts is None:
+            return
+        self._text_list.append("".join(self._cell_parts).rstrip())
+        self._cell_parts = None
+        # 先頭のセルがリーグ名でない行はこれ以降のセルの文字列を作成しない
+        if len(self._text_list) == 1 and self._text_list[0] not in self.LEAGUE_NAMES:
+            self._text_list = None
+
+    def _end_row(self):
+        self._end_cell()
+        if self._text_list is not None and is_validate_text_list(self._text_list):
+            self.data_list.append(format_text_list(self._text_list))
+        self._text_list = None
+
+
+class StreamingSpreadsheetParser(SpreadsheetParser):
+    """木を作成せずに先頭から読み進め、先頭のセルが有効なリーグ名の行のセルだけ文字列にする"""
+
+    def parse_chunks(self, chunks: Iterable[str]) -> list[SpreadsheetData]:
+        collector = _StreamingRowCollector()
+        for chunk in chunks:
+            collector.feed(chunk)
+        collector.close()
+        collector._end_row()
+        return collector.data_list
+
+
+SPREADSHEET_PARSERS: dict[str, type[SpreadsheetParser]] = {
+    "bs4": BeautifulSoupSpreadsheetParser,
+    "stream": StreamingSpreadsheetParser,
+}
+
+
+def get_spreadsheet_parser(name: str = None) -> SpreadsheetParser:
+    if name is None:
+        name = g.SPREADSHEET_PARSER
+    return SPREADSHEET_PARSERS[name]()
+
+
+# pubhtmlのシートのタブ(sheet-button-<gid>)やリンク(gid=<gid>)からシートのgidを探す
+REX_SHEET_GID = re.compile(r"(?:sheet-button-|[?&#]gid=)(\d+)")
+# 探したgidのキャッシュ(公開URLごと、プロセス内のみ)
+_sheet_gids_cache: dict[str, list[str]] = {}
+
+
+# pubhtmlのURLから、シートごとのCSVのURLを作成する
+def spreadsheet_csv_url(url: str, gid: str) -> str:
+    base_url = url.split("/pubhtml")[0]
+    return "{}/pub?gid={}&single=true&output=csv".format(base_url, gid)
+
+
+def is_spreadsheet_csv_url(url: str) -> bool:
+    return "output=csv" in url
+
+
+def discover_sheet_gids(pubhtml: str) -> list[str]:
+    return list(dict.fromkeys(REX_SHEET_GID.findall(pubhtml)))
+
+
+# CSVで取得するシートのgidのリストを返す
+# SPREADSHEET_SHEET_GIDSが設定されていればそれを使い、なければpubhtmlから探す
+# fetcherを渡した場合は探したgidを取得結果と一緒に保存し、SPREADSHEET_SHEET_GIDS_TTL秒の間は
+# pubhtmlを取得しない(1回だけ実行する場合も毎回pubhtml全体を取得しないようにする)
+# 渡さない場合はプロセス内で1回だけ探す
+def get_sheet_gids(url: str, fetcher: ConditionalFetcher = None) -> list[str]:
+    if g.SPREADSHEET_SHEET_GIDS:
+        return [str(gid) for gid in g.SPREADSHEET_SHEET_GIDS]
+    if fetcher is not None:
+        gids = fetcher.load_sheet_gids(url, g.SPREADSHEET_SHEET_GIDS_TTL)
+        if gids is not None:
+            return gids
+    elif url in _sheet_gids_cache:
+        return _sheet_gids_cache[url]
+    response = get_http_client().get(url)
+    response.raise_for_status()
+    response.encoding = "utf-8"
+    gids = discover_sheet_gids(response.text)
+    logger.debug("Discovered sheets: {}".format(gids))
+    if fetcher is None:
+        _sheet_gids_cache[url] = gids
+    elif gids != []:
+        fetcher.save_sheet_gids(url, gids)
+    return gids
+
+
+# シートのCSVをパースする(pubhtmlと同じ規則で有効な行だけを取り出す)
+def parse_spreadsheet_csv(text: str) -> list[SpreadsheetData]:
+    data_list = []
+    for row in csv.reader(io.StringIO(text)):
+        text_list = [cell.rstrip() for cell in row]
+        # 末尾の空のセルが省略されていても列の位置がずれないようにする
+        if len(text_list) < g.COLUMN_NUM:
+            text_list += [""] * (g.COLUMN_NUM - len(text_list))
+        if is_validate_text_list(text_list):
+            data_list.append(format_text_list(text_list))
+    return data_list
+
+
+# シートごとのCSVを並行して取得し、シートの順にパースする
+def get_spreadsheet_csv_data_list(url: str) -> list[SpreadsheetData]:
+    gids = get_sheet_gids(url)
+    if gids == []:
+        raise ValueError("No sheet found in {}".format(url))
+
+    def fetch_csv(gid: str) -> str:
+        response = get_http_client().get(spreadsheet_csv_url(url, gid))
+        response.raise_for_status()
+        # CSVはcharsetが指定されないことがあるのでUTF-8として読む
+        response.encoding = "utf-8"
+        return response.text
+
+    with ThreadPoolExecutor(max_workers=g.SPREADSHEET_MAX_WORKERS) as executor:
+        texts = list(executor.map(fetch_csv, gids))
+    data_list = []
+    for text in texts:
+        data_list.extend(parse_spreadsheet_csv(text))
+    # CSVの代わりにエラーページなどが返された場合はpubhtmlから取得し直す
+    if data_list == []:
+        raise ValueError("No valid row in CSV of {}".format(url))
+    return data_list
+
+
+# backend: "csv"(シートごとのCSV), "html"(pubhtml)。省略時はSPREADSHEET_BACKEND
+# CSVを取得できない場合はpubhtmlから取得する
+def get_spreadsheet_data_list(
+    url: str, parser_name: str = None, backend: str = None
+) -> list[SpreadsheetData]:
+    if backend is None:
+        backend = g.SPREADSHEET_BACKEND
+    if backend == "csv":
+        try:
+            return get_spreadsheet_csv_data_list(url)
+        except Exception as err:
+            logger.warning(
+                "Failed fetching CSV, falling back to pubhtml: '{}'".format(err)
+            )
+    parser = get_spreadsheet_parser(parser_name)
+    try:
+        # 本文全体を文字列にせず、受信した分から順にパーサーへ渡す
+        with get_http_client().get(url, stream=True) as response:
+            if response.encoding is None:
+                response.encoding = "utf-8"
+            data_list = parser.parse_chunks(
+                response.iter_content(
+                    chunk_size=SpreadsheetParser.CHUNK_SIZE, decode_unicode=True
+                )
+            )
     # memo：https://3.python-requests.org/user/quickstart/#errors-and-exceptions
     # 必要に応じて今後追加する
     except Exception as err:
@@ -29,6 +235,16 @@ def get_spreadsheet_data_list(url: str) -> list[SpreadsheetData]:
     return data_list
 
 
+# 取得済みのpubhtmlの本文をパースする
+def parse_spreadsheet_html(text: str, parser_name: str = None) -> list[SpreadsheetData]:
+    try:
+        data_list = get_spreadsheet_parser(parser_name).parse(text)
+    except Exception as err:
+        logger.error("Error: '{}'".format(err))
+        exit(1)
+    return data_list
+
+
 # listを引数に受け取る
 def is_validate_text_list(text_list: list[str]):
     # 空行・リーグ名が不正な行・選手名が空の行は無視
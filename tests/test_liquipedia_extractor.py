@@ -0,0 +1,75 @@
+# Liquipediaの選手ページ(benchmark/fixtures)からプロフィールを取り出せることを確認する
+# 使い方: python3 -m pytest tests
+
+import os
+
+import pytest
+
+from scraping.liquipedia_extractor import (
+    PLACEHOLDER_IMAGE_URL,
+    extract_profile,
+    extract_profile_with_beautifulsoup,
+)
+
+FIXTURE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "benchmark", "fixtures"
+)
+EXTRACTORS = [extract_profile, extract_profile_with_beautifulsoup]
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURE_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("extract", EXTRACTORS)
+def test_player_page(extract):
+    profile = extract(read_fixture("liquipedia_player.html"))
+    assert profile.name == "Koji Ushida"
+    assert profile.status == "Active"
+    assert profile.team == "ZETA DIVISION"
+    assert profile.born == "May 26, 1994 (age\xa030)"
+    assert profile.age == 30
+    assert profile.links == [
+        ("twitter", "https://twitter.com/ZETA_Laz"),
+        ("twitch", "https://www.twitch.tv/laz"),
+        ("youtube", "https://www.youtube.com/@laz"),
+        ("link", "https://www.vlr.gg/player/1/laz"),
+    ]
+    assert profile.history == [
+        ("2020-07-01 — 2020-12-31", "Absolute JUPITER"),
+        ("2021-01-01 — Present", "ZETA DIVISION"),
+    ]
+    assert (
+        profile.image_url
+        == "https://liquipedia.net/commons/images/thumb/laz.jpg/600px-laz.jpg"
+    )
+    assert profile.description.startswith("Koji Ushida (born May 26, 1994)")
+    assert profile.infobox["Role:"] == "Player"
+
+
+# チーム・誕生日・リンク・経歴がないページ
+@pytest.mark.parametrize("extract", EXTRACTORS)
+def test_minimal_player_page(extract):
+    profile = extract(read_fixture("liquipedia_player_minimal.html"))
+    assert profile.name == "Tarou Yamada"
+    assert profile.status == "Active"
+    assert profile.team is None
+    assert profile.born is None
+    assert profile.age is None
+    assert profile.links == []
+    assert profile.history == []
+    assert profile.image_url == PLACEHOLDER_IMAGE_URL
+    assert profile.description == "TEST is a player."
+
+
+# インフォボックスがないページ(検索結果や削除されたページなど)
+@pytest.mark.parametrize("extract", EXTRACTORS)
+def test_page_without_infobox(extract):
+    profile = extract("<html><head></head><body><p>No infobox</p></body></html>")
+    assert profile.name is None
+    assert profile.status is None
+    assert profile.team is None
+    assert profile.links == []
+    assert profile.history == []
+    assert profile.image_url == PLACEHOLDER_IMAGE_URL
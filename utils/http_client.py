@@ -0,0 +1,108 @@
+import socket
+import threading
+
+import requests
+import urllib3.util.connection as urllib3_cn
+from requests.adapters import HTTPAdapter
+
+import conf.global_values as g
+from utils.utils import setup_logger
+
+logger = setup_logger(__name__)
+
+# 名前解決で使うアドレスファミリー
+ADDRESS_FAMILIES = {
+    "ipv4": socket.AF_INET,
+    "ipv6": socket.AF_INET6,
+    "any": socket.AF_UNSPEC,
+}
+
+
+def _accept_encoding() -> str:
+    # brotliはurllib3が展開できる場合(brotli/brotlicffiがある場合)だけ要求する
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        try:
+            import brotlicffi  # noqa: F401
+        except ImportError:
+            return "gzip, deflate"
+    return "gzip, deflate, br"
+
+
+ACCEPT_ENCODING = _accept_encoding()
+
+_address_family = socket.AF_UNSPEC
+_original_allowed_gai_family = urllib3_cn.allowed_gai_family
+
+
+def _allowed_gai_family():
+    if _address_family == socket.AF_UNSPEC:
+        return _original_allowed_gai_family()
+    return _address_family
+
+
+# 名前解決で使うアドレスファミリーを設定する("ipv4", "ipv6", "any")
+# urllib3はアドレスファミリーをプロセス全体でしか選べないので、ここでまとめて設定する
+def set_address_family(policy: str):
+    global _address_family
+    _address_family = ADDRESS_FAMILIES[policy]
+    urllib3_cn.allowed_gai_family = _allowed_gai_family
+    logger.debug("Address family: {}".format(policy))
+
+
+class HttpClient:
+    """keep-aliveで接続を使い回すHTTPクライアント
+
+    ホストごとに接続プールを持ち、gzip(使える場合はbrotliも)で圧縮された応答を要求する。
+    timeoutを指定しないリクエストにはHTTP_CONNECT_TIMEOUT/HTTP_READ_TIMEOUTを使う。
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = None,
+        pool_maxsize: int = None,
+        timeout: tuple[float, float] = None,
+    ):
+        if pool_connections is None:
+            pool_connections = g.HTTP_POOL_CONNECTIONS
+        if pool_maxsize is None:
+            pool_maxsize = g.HTTP_POOL_MAXSIZE
+        if timeout is None:
+            timeout = (g.HTTP_CONNECT_TIMEOUT, g.HTTP_READ_TIMEOUT)
+        self.timeout = timeout
+        self.session = requests.Session()
+        # 再送は呼び出し側で行うので、ここでは再送しない
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_http_client: HttpClient = None
+_http_client_lock = threading.Lock()
+
+
+# プロセス全体で共有するクライアントを返す。初回だけ作成し、アドレスファミリーを設定する
+def get_http_client() -> HttpClient:
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            set_address_family(g.HTTP_ADDRESS_FAMILY)
+            _http_client = HttpClient()
+        return _http_client
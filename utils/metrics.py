@@ -0,0 +1,175 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from utils.utils import setup_logger
+
+logger = setup_logger(__name__)
+
+
+@dataclass
+class Span:
+    """1つの段階の処理時間と、処理した行数・バイト数"""
+
+    name: str
+    seconds: float = 0.0
+    rows: Optional[int] = None
+    bytes: Optional[int] = None
+
+
+class Metrics:
+    """段階ごとの処理時間・行数・バイト数を記録し、JSONかPrometheusのテキスト形式で出力する
+
+    集計は段階の名前ごとに累積し、個々のspanは直近MAX_SPANS件だけ保持する(常駐しても増え続けない)。
+    profileを有効にすると、一番外側の段階(メインスレッドのみ)ごとに
+    cProfileとtracemallocの上位top_n件のレポートも記録する。
+    """
+
+    PROMETHEUS_PREFIX = "vct_stage"
+    MAX_SPANS = 1000
+    # 段階ごとに保持するtracemallocのレポートの数
+    MAX_MEMORY_REPORTS = 5
+
+    def __init__(self, profile: bool = False, top_n: int = 20):
+        self.profile = profile
+        self.top_n = top_n
+        self.spans: deque[Span] = deque(maxlen=self.MAX_SPANS)
+        self._summary: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profilers: dict[str, cProfile.Profile] = {}
+        self._memory_reports: dict[str, deque[str]] = {}
+        if profile and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _should_profile(self) -> bool:
+        return (
+            self.profile
+            and getattr(self._local, "depth", 0) == 0
+            and threading.current_thread() is threading.main_thread()
+        )
+
+    # withブロックの処理時間を計測する。rows/bytesはブロック内でspanに設定してもよい
+    @contextmanager
+    def span(self, name: str, rows: int = None, bytes: int = None):
+        span = Span(name=name, rows=rows, bytes=bytes)
+        profiler = None
+        snapshot = None
+        if self._should_profile():
+            profiler = self._profilers.setdefault(name, cProfile.Profile())
+            snapshot = tracemalloc.take_snapshot()
+            profiler.enable()
+        self._local.depth = getattr(self._local, "depth", 0) + 1
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.seconds = time.perf_counter() - start
+            self._local.depth -= 1
+            if profiler is not None:
+                profiler.disable()
+                self._record_memory(name, snapshot)
+            self._add(span)
+
+    def _add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+            stage = self._summary.setdefault(
+                span.name,
+                {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "rows": 0, "bytes": 0},
+            )
+            stage["count"] += 1
+            stage["seconds"] += span.seconds
+            stage["max_seconds"] = max(stage["max_seconds"], span.seconds)
+            stage["rows"] += span.rows or 0
+            stage["bytes"] += span.bytes or 0
+
+    def _record_memory(self, name: str, before: tracemalloc.Snapshot):
+        stats = tracemalloc.take_snapshot().compare_to(before, "lineno")
+        self._memory_reports.setdefault(
+            name, deque(maxlen=self.MAX_MEMORY_REPORTS)
+        ).append(
+            "\n".join(str(stat) for stat in stats[: self.top_n])
+        )
+
+    # 段階ごとの集計(同じ名前の段階は合計する)
+    def summary(self) -> dict[str, dict]:
+        with self._lock:
+            return {name: dict(stage) for name, stage in self._summary.items()}
+
+    def to_json(self) -> str:
+        with self._lock:
+            spans = [asdict(span) for span in self.spans]
+        return json.dumps({"stages": self.summary(), "spans": spans}, indent=2)
+
+    def to_prometheus(self) -> str:
+        summary = self.summary()
+        lines = []
+        for key, metric_type, help_text in [
+            ("seconds", "counter", "Total wall time spent in the stage"),
+            ("max_seconds", "gauge", "Longest single run of the stage"),
+            ("count", "counter", "Number of times the stage ran"),
+            ("rows", "counter", "Rows processed by the stage"),
+            ("bytes", "counter", "Bytes processed by the stage"),
+        ]:
+            metric = "{}_{}".format(self.PROMETHEUS_PREFIX, key)
+            if metric_type == "counter":
+                metric += "_total"
+            lines.append("# HELP {} {}".format(metric, help_text))
+            lines.append("# TYPE {} {}".format(metric, metric_type))
+            for name, stage in summary.items():
+                lines.append('{}{{stage="{}"}} {}'.format(metric, name, stage[key]))
+        return "\n".join(lines) + "\n"
+
+    # 拡張子が.promの場合はPrometheusのテキスト形式、それ以外はJSONで書き込む
+    def write(self, path: str):
+        text = self.to_prometheus() if path.endswith(".prom") else self.to_json()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        logger.debug("Wrote metrics to {}".format(path))
+
+    # 段階ごとのcProfileとtracemallocのレポートをdirectoryに書き込む
+    def write_profile(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for name, profiler in self._profilers.items():
+            stream = io.StringIO()
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.sort_stats("cumulative").print_stats(self.top_n)
+            with open(
+                os.path.join(directory, "{}.txt".format(name)), "w", encoding="utf-8"
+            ) as f:
+                f.write("# cProfile (top {})\n".format(self.top_n))
+                f.write(stream.getvalue())
+                f.write("\n# tracemalloc (top {})\n".format(self.top_n))
+                f.write("\n\n".join(self._memory_reports.get(name, [])))
+                f.write("\n")
+        logger.debug("Wrote profile reports to {}".format(directory))
+
+
+_metrics = Metrics()
+
+
+# 現在の実行で使うMetricsを返す
+def get_metrics() -> Metrics:
+    return _metrics
+
+
+# 以降の計測で使うMetricsを設定する
+def set_metrics(metrics: Metrics):
+    global _metrics
+    _metrics = metrics
+
+
+def span(name: str, rows: int = None, bytes: int = None):
+    return _metrics.span(name, rows=rows, bytes=bytes)
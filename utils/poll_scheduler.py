@@ -0,0 +1,48 @@
+import datetime
+
+
+class AdaptivePollScheduler:
+    """前回の取得で変化があったかどうかに応じて次の取得までの間隔を決める
+
+    変化があった場合はmin_intervalに戻し、なければbackoff_factor倍ずつmax_intervalまで延ばす。
+    transfer_windows(("MM-DD", "MM-DD")のリスト)の期間中はtransfer_window_intervalを上限にする。
+    """
+
+    def __init__(
+        self,
+        min_interval: float,
+        max_interval: float,
+        backoff_factor: float = 2.0,
+        transfer_windows: list[tuple[str, str]] = None,
+        transfer_window_interval: float = None,
+        today=datetime.date.today,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.transfer_windows = transfer_windows or []
+        self.transfer_window_interval = transfer_window_interval or min_interval
+        self._today = today
+        self._interval = min_interval
+
+    def in_transfer_window(self) -> bool:
+        today = self._today().strftime("%m-%d")
+        for start, end in self.transfer_windows:
+            if start <= end:
+                if start <= today <= end:
+                    return True
+            # 年をまたぐ期間
+            elif today >= start or today <= end:
+                return True
+        return False
+
+    def next_interval(self, changed: bool) -> float:
+        if changed:
+            self._interval = self.min_interval
+        else:
+            self._interval = min(
+                self.max_interval, self._interval * self.backoff_factor
+            )
+        if self.in_transfer_window():
+            return min(self._interval, self.transfer_window_interval)
+        return self._interval
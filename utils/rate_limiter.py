@@ -0,0 +1,35 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """スレッド間で共有できるトークンバケット方式のレートリミッタ
+
+    rate: 1秒あたりに補充されるトークン数, capacity: 貯められるトークンの最大数(バースト)
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    # トークンを1つ取得する。足りない場合は補充されるまで待つ
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            # ロックを持ったまま待たないようにする
+            time.sleep(wait)
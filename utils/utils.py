@@ -1,4 +1,5 @@
 import unicodedata
+from functools import lru_cache
 from logging import getLogger, StreamHandler, DEBUG
 
 
@@ -11,9 +12,15 @@ def setup_logger(name):
     return logger
 
 
+# アクセント記号などの結合文字(Mn)を取り除く
+# 同じ名前はスプレッドシートとDBの両方から何度も渡されるので結果をキャッシュする
+@lru_cache(maxsize=65536)
 def normalize_unicode(words: str) -> str:
-    unicode_words = ""
-    for character in unicodedata.normalize("NFD", words):
-        if unicodedata.category(character) != "Mn":
-            unicode_words += character
-    return unicode_words
+    # ASCIIだけの文字列は分解しても変わらない
+    if words.isascii():
+        return words
+    return "".join(
+        character
+        for character in unicodedata.normalize("NFD", words)
+        if unicodedata.category(character) != "Mn"
+    )